@@ -2,4 +2,7 @@ from lib.optspecextr import *
 from sys import argv
 
 if __name__ == '__main__':
-    optspecextr(argv[1])
\ No newline at end of file
+    if len(argv) > 2:
+        optspecextr_batch(argv[1], argv[2:])
+    else:
+        optspecextr(argv[1])
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+Name: benchmarks
+
+Purpose: Synthetic frames and timing of the extraction stages.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Benchmarks
+
+Calling Example:
+	python -m lib.benchmarks.bench --sizes 256x64 1024x256 --output bench.json
+
+Created on 10/18/2026$
+"""
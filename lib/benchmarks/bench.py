@@ -0,0 +1,299 @@
+"""
+Name: bench.py
+
+Purpose: Times the extraction stages on synthetic frames over a sweep of
+frame sizes, and in serial, batch and parallel modes, so that releases can be
+compared. Results are stored as JSON, and compare lists the cases that got
+slower than a previous run.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Benchmarks
+
+Calling Example:
+	report = run_benchmarks(sizes=[(256, 64), (1024, 256)], modes=[{}, {"workers": 4}])
+	save_report(report, "bench.json")
+	slower = compare(load_report("base.json"), report)
+
+	python -m lib.benchmarks.bench --sizes 256x64 1024x256 --workers 1 4 --batch \
+		--output bench.json --compare base.json
+
+Inputs:
+	sizes:  list of (ny, nx) frame sizes (default SIZES)
+	stages: names of the stages to time (default STAGES): procvect, polyfunc
+			and gaussfunc, called on every row, and fitbg, stdextr and extrspec
+			on the whole frame
+	modes:  list of dicts of options for the stages that take them (fitbg
+			and extrspec), such as {"workers": 4} or {"batch": True}. Other
+			stages are timed once, in the default mode.
+	repeat: number of timed runs of each case (default 3)
+	frame:  dict of options passed to synth_frame
+
+Outputs:
+	A report dict with meta, describing the run and machine, and results, one
+	dict per case with the stage, ny, nx, mode, the times of each run in
+	seconds, their best and median, and the error of a stage that failed.
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from lib.benchmarks.synth import synth_frame
+from lib.utils import Config, sky_bounds
+
+SIZES = [(256, 64), (512, 128), (1024, 256)]
+STAGES = ("procvect", "polyfunc", "gaussfunc", "fitbg", "stdextr", "extrspec")
+MODAL_STAGES = ("fitbg", "extrspec")
+
+
+def _setup_procvect(frame, mode):
+	from lib.procvect import procvect
+	data, var = frame['data'], frame['var']
+	ny, nx = np.shape(data)
+	c1, c2 = sky_bounds(frame['x1'], frame['x2'], nx)
+	xvals = np.array([*np.arange(c1, frame['x1']), *np.arange(frame['x2'] + 1, c2)])
+
+	def run():
+		for i in range(ny):
+			procvect(data[i], xvals=xvals, varv=np.copy(var[i]), maskv=np.ones(nx), func="polyfunc",
+			         parm=1, thresh=5, q=frame['q'], v0=frame['rn'] ** 2)
+	return run
+
+
+def _setup_polyfunc(frame, mode):
+	from lib.fitting.polyfunc import polyfunc
+	data, var = frame['data'], frame['var']
+	ny, nx = np.shape(data)
+	xvals = np.arange(nx)
+	specv = np.ones(nx)
+
+	def run():
+		for i in range(ny):
+			polyfunc(xvals, data[i], var[i], specv, False, None, 1)
+	return run
+
+
+def _setup_gaussfunc(frame, mode):
+	from lib.fitting.gaussfunc import gaussfunc
+	cols = slice(frame['x1'], frame['x2'] + 1)
+	data = (frame['data'] - frame['skyim'])[:, cols]
+	var = frame['var'][:, cols]
+	xvals = np.arange(np.shape(data)[1])
+
+	def run():
+		for i in range(len(data)):
+			gaussfunc(xvals, data[i], var[i], np.array([frame['spec'][i]]), False, None, 0)
+	return run
+
+
+def _setup_fitbg(frame, mode):
+	from lib.fitbg import fitbg
+
+	def run():
+		fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']), q=frame['q'],
+		      v0=frame['rn'] ** 2, bgdeg=1, bthresh=5, **mode)
+	return run
+
+
+def _setup_stdextr(frame, mode):
+	from lib.stdextr import stdextr
+	dataim = frame['data'] - frame['skyim']
+
+	def run():
+		stdextr(dataim, frame['var'], frame['x1'], frame['x2'])
+	return run
+
+
+def _setup_extrspec(frame, mode):
+	from lib.vectsetup import extrspec
+	dataim = frame['data'] - frame['skyim']
+
+	def run():
+		rc = Config(dataim=dataim, varim=np.copy(frame['var']), profim=frame['profim'], x1=frame['x1'],
+		            x2=frame['x2'], q=frame['q'], v0=frame['rn'] ** 2, **mode)
+		extrspec(rc)
+	return run
+
+
+def _git_commit():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+		                      cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+	except Exception:
+		return None
+
+
+def time_case(stage, frame, mode=None, repeat=3):
+	"""
+	Times one stage on one frame, returning the times of each run in seconds,
+	or raising the error of the stage.
+	"""
+	run = globals()["_setup_" + stage](frame, mode or {})
+	times = []
+	for i in range(repeat):
+		# Stages may print per row, which is not what is being timed
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			start = time.perf_counter()
+			run()
+			times.append(time.perf_counter() - start)
+	return times
+
+
+def run_benchmarks(sizes=None, stages=None, modes=None, repeat=3, frame=None, verbose=0):
+	sizes = sizes or SIZES
+	stages = stages or STAGES
+	modes = modes or [{}]
+	frame = dict(dict(curvature=3., nskylines=10, crrate=0.001, seed=0), **(frame or {}))
+
+	for stage in stages:
+		if stage not in STAGES:
+			raise ValueError("Unknown stage " + stage + ", expected one of " + ", ".join(STAGES))
+
+	report = dict(meta=dict(date=datetime.datetime.now().isoformat(timespec="seconds"),
+	                        commit=_git_commit(), python=platform.python_version(),
+	                        numpy=np.__version__, machine=platform.machine(),
+	                        processor=platform.processor(), cpus=os.cpu_count(), repeat=repeat,
+	                        frame=frame),
+	              results=[])
+
+	for ny, nx in sizes:
+		synth = synth_frame(ny, nx, **frame)
+		for stage in stages:
+			for mode in (modes if stage in MODAL_STAGES else [{}]):
+				result = dict(stage=stage, ny=ny, nx=nx, mode=mode, times=[], best=None, median=None,
+				              error=None)
+				try:
+					result['times'] = time_case(stage, synth, mode, repeat)
+					result['best'] = min(result['times'])
+					result['median'] = float(np.median(result['times']))
+				except Exception:
+					result['error'] = traceback.format_exc(limit=2)
+				report['results'].append(result)
+
+				if verbose:
+					print(_format_result(result))
+
+	return report
+
+
+def _case_key(result):
+	return result['stage'], result['ny'], result['nx'], json.dumps(result['mode'], sort_keys=True)
+
+
+def _format_result(result):
+	mode = ", ".join("%s=%s" % item for item in sorted(result['mode'].items())) or "serial"
+	if result['error']:
+		timing = "FAILED: " + result['error'].strip().splitlines()[-1]
+	else:
+		timing = "%10.4f s" % result['best']
+	return "%-10s %6d x %-6d %-22s %s" % (result['stage'], result['ny'], result['nx'], mode, timing)
+
+
+def speedups(report):
+	"""
+	Returns the best time of the serial mode over the best time of each other
+	mode, for each stage and size: {(stage, ny, nx): {mode: speedup}}.
+	"""
+	serial = {_case_key(r)[:3]: r['best'] for r in report['results'] if not r['mode'] and r['best']}
+	out = {}
+	for r in report['results']:
+		key = _case_key(r)[:3]
+		if r['mode'] and r['best'] and key in serial:
+			out.setdefault(key, {})[_case_key(r)[3]] = serial[key] / r['best']
+	return out
+
+
+def compare(base, report, tolerance=0.25):
+	"""
+	Returns the cases of report whose best time is more than tolerance (as a
+	fraction) slower than the same case in base, or that failed where base
+	did not, each a dict with the stage, ny, nx, mode, base and new times and
+	their ratio.
+	"""
+	basecases = {_case_key(r): r for r in base['results']}
+	slower = []
+	for r in report['results']:
+		b = basecases.get(_case_key(r))
+		if b is None or b['best'] is None:
+			continue
+		if r['best'] is None:
+			ratio = float("inf")
+		else:
+			ratio = r['best'] / b['best']
+		if ratio > 1 + tolerance:
+			slower.append(dict(stage=r['stage'], ny=r['ny'], nx=r['nx'], mode=r['mode'],
+			                   base=b['best'], new=r['best'], ratio=ratio))
+	return slower
+
+
+def save_report(report, path):
+	with open(path, "w") as f:
+		json.dump(report, f, indent=1)
+
+
+def load_report(path):
+	with open(path) as f:
+		return json.load(f)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Time the extraction stages on synthetic frames.")
+	parser.add_argument("--sizes", nargs="+", default=["%dx%d" % s for s in SIZES],
+	                    help="frame sizes as NYxNX")
+	parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+	parser.add_argument("--workers", nargs="+", type=int, default=[1],
+	                    help="worker counts to time fitbg and extrspec with")
+	parser.add_argument("--batch", action="store_true", help="also time the batch modes")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--curvature", type=float, default=3.)
+	parser.add_argument("--skylines", type=int, default=10)
+	parser.add_argument("--crrate", type=float, default=0.001)
+	parser.add_argument("--rn", type=float, default=2.)
+	parser.add_argument("--output", help="JSON file to write the report to")
+	parser.add_argument("--compare", help="JSON report to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.25)
+	args = parser.parse_args(argv)
+
+	sizes = [tuple(int(n) for n in size.lower().split("x")) for size in args.sizes]
+	modes = []
+	for batch in ([False, True] if args.batch else [False]):
+		for workers in args.workers:
+			mode = {}
+			if workers > 1:
+				mode['workers'] = workers
+			if batch:
+				mode['batch'] = True
+			modes.append(mode)
+
+	report = run_benchmarks(sizes, args.stages, modes, args.repeat,
+	                        frame=dict(curvature=args.curvature, nskylines=args.skylines,
+	                                   crrate=args.crrate, rn=args.rn, seed=0),
+	                        verbose=1)
+	if args.output:
+		save_report(report, args.output)
+
+	for (stage, ny, nx), modespeed in speedups(report).items():
+		for mode, speedup in modespeed.items():
+			print("%-10s %6d x %-6d %-30s %.2fx the speed of serial" % (stage, ny, nx, mode, speedup))
+
+	if args.compare:
+		slower = compare(load_report(args.compare), report, args.tolerance)
+		for s in slower:
+			print("SLOWER: %-10s %6d x %-6d %s %.4f s -> %.4f s (%.2fx)" %
+			      (s['stage'], s['ny'], s['nx'], json.dumps(s['mode']), s['base'], s['new'] or 0, s['ratio']))
+		return 1 if slower else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Name: precision.py
+
+Purpose: Compares the float32 compute mode (the dtype option) with float64 on
+one frame. The frame is reduced through fitbg, stdextr, fitprof and extrspec
+in each precision, timing every stage and the peak memory of the reduction,
+and the float32 results are compared to the float64 ones: the largest
+differences of the images relative to their range, the differences of the
+spectra in units of their extraction error, and the pixels whose rejection
+changed.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Benchmarks
+
+Calling Example:
+	report = compare_precision("test2obj.fits", read_config("config.yaml"))
+	print(format_report(report))
+
+	python -m lib.benchmarks.precision --config config.yaml --data test2obj.fits --batch \
+		--output precision.json
+
+Inputs:
+	data_file: the FITS frame to reduce (default: the configuration's)
+	opts:      the pipeline configuration, as for reduce_frame. Its dtype
+			   option is replaced by each precision in turn.
+	repeat:    number of timed reductions in each precision (default 3)
+
+Outputs:
+	A report dict with meta, describing the frame and machine, times, the best
+	time of each stage and in total in each precision, peak, the peak memory
+	of a reduction in bytes, and accuracy, the differences of each output.
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from lib.fitbg import fitbg
+from lib.stdextr import stdextr
+from lib.vectsetup import fitprof, extrspec
+from lib.optspecextr import _frame_opts, _frame_data, _frame_variance
+from lib.quality import quality_plane, SKY_CR, EXTR_CR
+from lib.stats import Stats
+from lib.utils import Config, read_config, load_frame
+
+DTYPES = ("float64", "float32")
+STAGES = ("fitbg", "stdextr", "fitprof", "extrspec")
+IMAGES = ("bgim", "dataim", "varim", "profim")
+SPECTRA = ("stdspec", "optspec")
+
+
+def reduce_planes(data, opts, stats):
+	"""
+	Reduces data as reduce_frame does, without saving, and returns the Config
+	of the extraction with its images, spectra and quality plane.
+	"""
+	opts = _frame_opts(opts, stats)
+	data = _frame_data(data, opts)
+	varim = _frame_variance(data, opts)
+	quality = quality_plane(opts.pop('inmask', None), np.shape(data))
+
+	with stats.stage("fitbg"):
+		bgim, varim, quality = fitbg(data, varim=varim, quality=quality, **opts)
+	with stats.stage("stdextr"):
+		stdspec, stdvar, adjspec, dataim = stdextr(data - bgim, varim, quality=quality, **opts)
+
+	rc = Config(**opts)
+	rc.dataim = dataim
+	rc.varim = varim
+	rc.bgim = bgim
+	rc.stdspec = stdspec
+	rc.spec = adjspec if opts.get('integrate') == True else stdspec
+	rc.quality = quality
+	with stats.stage("fitprof"):
+		fitprof(rc)
+	with stats.stage("extrspec"):
+		extrspec(rc)
+	return rc
+
+
+def _reduce(data, opts, repeat):
+	# Best time of each stage and in total over repeat reductions, the peak
+	# memory of one, and its results
+	best = {}
+	for i in range(repeat):
+		stats = Stats()
+		start = time.perf_counter()
+		rc = reduce_planes(data, opts, stats)
+		stats.times['total'] = time.perf_counter() - start
+		for name, seconds in stats.times.items():
+			best[name] = min(best.get(name, np.inf), seconds)
+
+	tracemalloc.start()
+	reduce_planes(data, opts, Stats())
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return best, peak, rc
+
+
+def image_difference(ref, new):
+	"""
+	The largest absolute difference of new from ref, and that over the largest
+	absolute value of ref.
+	"""
+	diff = float(np.max(np.abs(np.asarray(new, np.double) - ref)))
+	scale = float(np.max(np.abs(ref)))
+	return dict(maxabs=diff, maxrel=diff / scale if scale else 0.)
+
+
+def spectrum_difference(ref, new, var):
+	"""
+	The differences of the spectrum new from ref: the largest relative to ref,
+	and the median and largest in units of the extraction error sqrt(var).
+	"""
+	diff = np.abs(np.asarray(new, np.double) - ref)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		rel = np.where(ref != 0, diff / np.abs(ref), 0.)
+		sigma = np.where(var > 0, diff / np.sqrt(var), 0.)
+	return dict(maxrel=float(np.max(rel)), mediansigma=float(np.median(sigma)), maxsigma=float(np.max(sigma)))
+
+
+def compare_precision(data_file=None, opts=None, repeat=3):
+	opts = dict(opts or {})
+	data, opts = load_frame(data_file or opts['data_file'], opts)
+	data = np.asarray(data)
+
+	report = dict(meta=dict(frame=data_file or opts.get('data_file'), shape=list(np.shape(data)),
+	                        dtype=str(data.dtype), python=platform.python_version(), numpy=np.__version__,
+	                        machine=platform.machine(), cpus=os.cpu_count(), repeat=repeat),
+	              times={}, peak={}, accuracy={})
+	results = {}
+	for dtype in DTYPES:
+		report['times'][dtype], report['peak'][dtype], results[dtype] = _reduce(data, dict(opts, dtype=dtype),
+		                                                                        repeat)
+
+	ref, new = results["float64"], results["float32"]
+	accuracy = report['accuracy']
+	for name in IMAGES:
+		accuracy[name] = image_difference(getattr(ref, name), getattr(new, name))
+	for name in SPECTRA:
+		accuracy[name] = spectrum_difference(getattr(ref, name), getattr(new, name), ref.opvar)
+	accuracy['opvar'] = image_difference(ref.opvar, new.opvar)
+	accuracy['skymask'] = int(np.count_nonzero((ref.quality ^ new.quality) & SKY_CR))
+	accuracy['exmask'] = int(np.count_nonzero((ref.quality ^ new.quality) & EXTR_CR))
+	accuracy['quality'] = int(np.count_nonzero(ref.quality != new.quality))
+	return report
+
+
+def format_report(report):
+	"""
+	The report as lines of text: the time of each stage in each precision and
+	their ratio, the peak memory, and the accuracy of each output.
+	"""
+	times, peak = report['times'], report['peak']
+	lines = ["%-10s %12s %12s %8s" % ("stage", "float64 s", "float32 s", "speedup")]
+	for name in STAGES + ("total",):
+		t64, t32 = times["float64"][name], times["float32"][name]
+		lines.append("%-10s %12.4f %12.4f %7.2fx" % (name, t64, t32, t64 / t32))
+	lines.append("%-10s %10.1f MB %10.1f MB %7.2fx" % ("peak", peak["float64"] / 2 ** 20,
+	                                                     peak["float32"] / 2 ** 20, peak["float64"] / peak["float32"]))
+	for name, acc in report['accuracy'].items():
+		if isinstance(acc, dict):
+			lines.append("%-10s " % name + ", ".join("%s=%.3g" % item for item in acc.items()))
+		else:
+			lines.append("%-10s %d pixels differ" % (name, acc))
+	return "\n".join(lines)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Compare the float32 compute mode with float64 on a frame.")
+	parser.add_argument("--config", default="config.yaml", help="YAML configuration of the reduction")
+	parser.add_argument("--data", help="FITS frame to reduce (default: the configuration's data_file)")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--batch", action="store_true", help="fit the rows of each stage together")
+	parser.add_argument("--output", help="JSON file to write the report to")
+	args = parser.parse_args(argv)
+
+	opts = read_config(args.config)
+	opts['verbose'] = 0
+	if args.batch:
+		opts['batch'] = True
+	report = compare_precision(args.data, opts, args.repeat)
+	print(format_report(report))
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=1)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
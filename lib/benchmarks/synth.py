@@ -0,0 +1,101 @@
+"""
+Name: synth.py
+
+Purpose: Synthetic spectra for testing and timing the extraction stages. A
+vector is built as in polyfunc_test, a smooth profile times a varying
+spectrum with noise and bad pixels. A frame is a curved Gaussian trace on a
+sloped sky with sky lines, cosmic rays, photon noise and read noise.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Benchmarks
+
+Calling Example:
+	xvals, datav, varv, profv, specv = synth_vector(100)
+	frame = synth_frame(512, 128, curvature=3., nskylines=10, crrate=0.001)
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+
+
+def synth_vector(nx, gain=10, nbad=4, seed=None):
+	"""
+	A data vector with a quadratic profile and a sine spectrum, as in
+	polyfunc_test, with nbad pixels in the first half set high. The profile
+	is 0 at the bad pixels.
+
+	Outputs:
+		xvals, datav, varv, profv, specv
+	"""
+	rng = np.random.default_rng(seed)
+	xvals = np.arange(nx)
+	profv = ((-xvals / nx * 2 - 1) ** 2 + 1) * 0.75 / nx * 2
+	specv = np.sin(xvals / nx * np.pi * 6) + 10
+	basey = profv * specv
+	datav = rng.normal(basey, basey) / gain
+	varv = basey / gain
+
+	badloc = rng.integers(0, max(nx // 2, 1), nbad)
+	datav[badloc] = rng.uniform(size=nbad) * max(datav) * 2
+	profv[badloc] = 0
+
+	return xvals, datav, varv, profv, specv
+
+
+def synth_frame(ny, nx, x0=None, width=2., curvature=0., flux=2000., sky=100., skyslope=0.5,
+                nskylines=0, skylineamp=500., crrate=0., q=10., rn=2., halfwidth=None, seed=None):
+	"""
+	A frame of a spectrum with rows in wavelength and columns in x.
+
+	Inputs:
+		ny, nx:     the frame size
+		x0:         the trace center at the middle row (default nx/2)
+		width:      the Gaussian sigma of the trace in pixels
+		curvature:  how far in pixels the trace bends at the first and last
+					rows, the trace center being x0 + curvature*(2*y/ny-1)**2
+		flux:       the mean of the spectrum in DN summed over x
+		sky:        the sky level in DN at x=0, rising by skyslope per column
+		nskylines:  number of sky lines, Gaussian in y and flat in x
+		skylineamp: the peak of the sky lines in DN
+		crrate:     the fraction of pixels hit by cosmic rays
+		q, rn:      the photons per DN and the read noise in DN
+		halfwidth:  half width of the aperture x1..x2 around the trace
+					(default: 4 sigma plus the curvature)
+		seed:       seed of the random generator
+
+	Outputs:
+		A dict with the data, the variance var, the aperture x1 and x2, q, rn,
+		the model spec, profim, skyim and trace, and crmask, 1 where a cosmic
+		ray was added.
+	"""
+	rng = np.random.default_rng(seed)
+	y = np.arange(ny)
+	x = np.arange(nx)
+	if x0 is None:
+		x0 = nx / 2.
+
+	trace = x0 + curvature * (2. * y / ny - 1) ** 2
+	profim = np.exp(-0.5 * ((x[None, :] - trace[:, None]) / width) ** 2)
+	profim /= np.sum(profim, 1)[:, None]
+	spec = flux * (1 + 0.2 * np.sin(y / ny * np.pi * 6))
+
+	skyim = (sky + skyslope * x)[None, :] * np.ones((ny, 1))
+	for line, amp in zip(rng.uniform(0, ny, nskylines), rng.uniform(0.2, 1, nskylines) * skylineamp):
+		skyim += amp * np.exp(-0.5 * ((y - line) / 1.5) ** 2)[:, None]
+
+	model = spec[:, None] * profim + skyim
+	var = np.maximum(model, 0) / q + rn ** 2
+	data = model + rng.normal(0, np.sqrt(var))
+
+	crmask = rng.random((ny, nx)) < crrate
+	data[crmask] += rng.uniform(10, 100, np.sum(crmask)) * np.sqrt(var[crmask])
+
+	if halfwidth is None:
+		halfwidth = int(np.ceil(4 * width + abs(curvature)))
+	x1 = max(int(np.floor(x0 - halfwidth)), 0)
+	x2 = min(int(np.ceil(x0 + halfwidth)), nx - 1)
+
+	return dict(data=data, var=var, x1=x1, x2=x2, q=q, rn=rn, spec=spec, profim=profim,
+	            skyim=skyim, trace=trace, crmask=crmask.astype(np.byte))
@@ -0,0 +1,178 @@
+"""
+Name: bgseed.py
+
+Purpose: Warm start of the background fit across the frames of a time
+series. A BackgroundSeed keeps the sky coefficients of every row of the last
+frame fitted, and the sky pixels its clipping rejected. The next frame's fit
+starts from them: each row's fit is passed the previous coefficients to start
+from, its sky is predicted by them, and the pixels of the sky windows that
+are well above bthresh of that prediction are masked before the first pass.
+A pixel rejected in the previous frame that agrees with the prediction again
+was only a cosmic ray, and is fitted. Since the new cosmic rays are masked up
+front, procvect and procblock usually converge on their first pass, about one
+iteration per row instead of one per rejected pixel. A premasked pixel that
+turns out within bthresh of the fit is unmasked, and its row fitted again,
+so the warm start keeps the pixels a cold start would.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Background Fitting
+
+Calling Example:
+	seed = BackgroundSeed()
+	for data in frames:
+		bgim, varim, inmask = fitbg(data, x1, x2, bgseed=seed, ...)
+		print(seed.last)
+
+Inputs:
+	bgdeg:   the degree of the sky polynomials, which sizes the coefficients
+			 kept (default 1)
+	margin:  how many times bthresh a pixel must deviate from the prediction
+			 to be masked up front. The prediction is noisier than the fit,
+			 so pixels near bthresh are left to the clipping (default 2)
+	maxfrac: the largest fraction of a row's sky pixels the prediction may
+			 mask; a row with more is fitted from a cold start (default 0.5)
+
+Outputs:
+	After each fitbg, last holds the convergence statistics of the frame and
+	is appended to history:
+		frame:      the number of the frame fitted with this seed, from 0
+		warm:       True when the frame was started from the previous one
+		vectors, iterations, rejected, errflag:
+					the counts of the row fits, as in Stats
+		iterperrow: iterations / vectors
+		premasked:  sky pixels masked up front by the prediction
+		kept:       of those, the pixels the previous frame rejected too
+		restored:   pixels the previous frame rejected that agree with the
+					prediction, so were only cosmic rays
+		falsemask:  premasked pixels within bthresh of the new fit, which a
+					cold start would have kept. They are unmasked and their
+					rows fitted again. Should stay near zero; a large count
+					means the sky changed too much between frames for the
+					warm start.
+		coldrows:   rows started cold, as their prediction was off (see maxfrac)
+		skychange:  the largest change of the fitted sky over the sky
+					windows from the previous frame, in data units
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from numpy.polynomial import polynomial as poly
+from lib.quality import REJECTED
+
+
+def ncoeff(bgdeg):
+	# polyfunc fits degree 2 for a degree of 0, which the row loop passes for
+	# rows with a thin sky window
+	return max(bgdeg or 2, 2) + 1
+
+
+def _agrees(data, var, sky, thresh, absthresh):
+	# The pixels within thresh of the sky, measured as procvect measures them
+	if absthresh:
+		return abs(data - sky) <= thresh
+	return (data - sky) ** 2 / var <= thresh * thresh
+
+
+class BackgroundSeed:
+	def __init__(self, bgdeg=1, margin=2., maxfrac=0.5):
+		self.ncoeff = ncoeff(bgdeg)
+		self.margin = margin
+		self.maxfrac = maxfrac
+		self.coeffb = None
+		self.rejected = None
+		self.shape = None
+		self.frames = 0
+		self.premask = None
+		self.start = None
+		self.falsemask = None
+		self.coldrows = None
+		self.last = None
+		self.history = []
+
+	def seed(self, dataim, varim, quality, xvals, thresh=5, absthresh=False):
+		"""
+		Returns the boolean image, over the columns xvals, of the sky pixels
+		of dataim that deviate from the previous frame's sky by more than
+		margin times thresh, for the fit to start with them masked. Pixels
+		already rejected in the quality plane are left out. Without a usable
+		previous frame, returns None. start is then set to the coefficients
+		each row's fit starts from, 0 for the rows started cold.
+		"""
+		self.premask = None
+		self.start = None
+		self.falsemask = None
+		if self.coeffb is None or np.shape(dataim) != self.shape:
+			return None
+
+		sky = poly.polyval(xvals, self.coeffb.T)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			deviant = ~_agrees(dataim[:, xvals], varim[:, xvals], sky, self.margin * thresh, absthresh)
+
+		good = (quality[:, xvals] & REJECTED) == 0
+		deviant &= good
+
+		# A row whose prediction is off for many of its pixels, like one the
+		# previous frame could not fit, starts cold
+		self.coldrows = np.sum(deviant, 1) > self.maxfrac * np.sum(good, 1)
+		deviant[self.coldrows] = False
+
+		self.premask = deviant
+		self.start = np.where(self.coldrows[:, None], 0., self.coeffb)
+		return self.premask
+
+	def restore(self, dataim, varim, bgim, xvals, thresh=5, absthresh=False):
+		"""
+		Returns the boolean image, over the columns xvals, of the premasked
+		pixels within thresh of the fitted sky bgim, which a cold start would
+		have kept, for the fit to unmask them and fit their rows again.
+		"""
+		with np.errstate(divide="ignore", invalid="ignore"):
+			agrees = _agrees(dataim[:, xvals], varim[:, xvals], bgim[:, xvals], thresh, absthresh)
+		self.falsemask = self.premask & agrees
+		return self.falsemask
+
+	def store(self, dataim, quality, startmask, coeffb, xvals, counts):
+		"""
+		Keeps the coefficients and rejected sky pixels of a finished fit, and
+		records its convergence statistics in last. startmask is the boolean
+		image, over the columns xvals, of the sky pixels good before the fit,
+		and quality the plane it marked.
+		"""
+		coeffb = np.asarray(coeffb, np.double)
+		coeffb = np.pad(coeffb, ((0, 0), (0, max(self.ncoeff - np.shape(coeffb)[1], 0))))
+		sky = poly.polyval(xvals, coeffb.T)
+
+		last = {name: int(counts.get(name, 0)) for name in ("vectors", "iterations", "rejected", "errflag")}
+		last.update(frame=self.frames, warm=self.premask is not None,
+		            iterperrow=last["iterations"] / max(last["vectors"], 1),
+		            premasked=0, kept=0, restored=0, falsemask=0, coldrows=0, skychange=None)
+
+		if self.premask is not None:
+			premask = self.premask
+			before = np.zeros(np.shape(dataim), bool)
+			before.flat[self.rejected] = True
+			before = before[:, xvals]
+			last.update(premasked=int(np.sum(premask)), kept=int(np.sum(premask & before)),
+			            restored=int(np.sum(before & ~premask)),
+			            falsemask=0 if self.falsemask is None else int(np.sum(self.falsemask)),
+			            coldrows=int(np.sum(self.coldrows)),
+			            skychange=float(np.max(abs(sky - poly.polyval(xvals, self.coeffb.T)))))
+
+		# The sky pixels rejected this frame, whether up front or by the fit
+		rejected = np.zeros(np.shape(dataim), bool)
+		rejected[:, xvals] = startmask & ((quality[:, xvals] & REJECTED) != 0)
+
+		self.coeffb = coeffb
+		self.rejected = np.flatnonzero(rejected)
+		self.shape = np.shape(dataim)
+		self.frames += 1
+		self.premask = None
+		self.start = None
+		self.falsemask = None
+		self.last = last
+		self.history.append(last)
+		return last
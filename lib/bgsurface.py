@@ -0,0 +1,209 @@
+"""
+Name: bgsurface.py
+
+Purpose: Fits the sky background of a whole frame as one smooth surface
+rather than one polynomial per row. The sky at column x of row y is
+
+	sky(x, y) = a(y) + sum_{i=1..bgdeg} sum_{j=0..bgydeg} c_ij t(x)^i P_j(u(y))
+
+with t and u the columns and rows scaled to [-1, 1], and P_j the Legendre
+polynomials. The per-row amplitude a(y) carries the sky lines, which are
+flat across the slit, and the surface carries the slope (and curvature)
+of the sky across the slit, which changes slowly with wavelength. This is a
+single weighted least squares problem over the xvals sky windows of every
+row. Its normal equations are an arrow matrix, diagonal in the ny
+amplitudes with a dense border of the few surface terms, so it is solved by
+the Schur complement of the diagonal in O(ny nx) time and O(ny) memory,
+which scales to 4k x 4k frames. Clipping is over the whole frame: each pass
+keeps the pixels within bthresh of the last fit, until the mask settles.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Background Fitting
+
+Calling Example:
+	bgim, inmask, errvect = fitbg_surface(dataim, x1, x2, varim=varim, bgdeg=1, bgydeg=3)
+
+Inputs:
+	dataim: The data image, with spectrum
+	x1, x2: boundaries in x which contain spectrum
+
+Optional Inputs:
+	xvals:  the sky x values to fit (default: the columns within skywidth of
+			x1..x2, or all columns outside x1..x2)
+	bgdeg:  degree of the surface across the slit (default 1)
+	bgydeg: degree of the surface along the wavelength axis (default 3)
+	bgiter: largest number of clipping passes (default 20)
+	inmask, varim, skyvar, bthresh, q, v0, bpct, absthresh, noupdate:
+			as for fitbg. inmask and varim are updated in place.
+	quality: a quality plane to read the mask from instead of inmask. SKY_CR
+			is set on the sky pixels rejected, in place.
+	bgres:  array, same shape as dataim, to receive the rejection residuals
+	counts: a Counter to count the fit into, as a block of ny vectors
+
+Outputs:
+	bgim:    the background image
+	inmask:  the updated mask, or the quality plane when passed one
+	errvect: 0 for rows left with too few good sky pixels, 1 otherwise
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from numpy.polynomial import legendre
+from lib.excep import *
+from lib.utils import sky_bounds, constant_value
+from lib.quality import mark, REJECTED, SKY_CR
+
+
+def _surface_basis(xvals, nx, ny, bgdeg, bgydeg):
+	# The powers of the scaled columns, dimension (nx, 2*bgdeg + 1), and the
+	# Legendre polynomials of the scaled rows, dimension (ny, bgydeg + 1)
+	off = (np.min(xvals) + np.max(xvals)) / 2.
+	scl = max((np.max(xvals) - np.min(xvals)) / 2., 1.)
+	t = (np.arange(nx) - off) / scl
+	u = np.linspace(-1., 1., ny) if ny > 1 else np.zeros(1)
+	return t[:, None] ** np.arange(2 * bgdeg + 1), legendre.legvander(u, bgydeg)
+
+
+def surface_solve(datas, weights, tpow, leg, bgdeg):
+	"""
+	Solves the weighted least squares fit of the surface to datas, dimension
+	(ny, nxs), with weights (0 for masked pixels), tpow the powers of the
+	scaled sky columns and leg the row Legendre polynomials. Returns the row
+	amplitudes a, dimension ny, and the surface coefficients c, dimension
+	(bgdeg, bgydeg + 1).
+	"""
+	ny = len(datas)
+	nyc = np.shape(leg)[1]
+
+	# Moments of each row: m[y, p] = sum_x w t^p, and r[y, i] = sum_x w d t^i
+	m = weights @ tpow
+	r = (weights * datas) @ tpow[:, :bgdeg + 1]
+
+	# Arrow normal equations: the amplitudes' diagonal, their border with the
+	# surface terms b, the surface block s, and the right hand sides
+	diag = m[:, 0]
+	inv = np.divide(1., diag, out=np.zeros(ny), where=diag > 0)
+	i = np.arange(1, bgdeg + 1)
+	b = (m[:, i][:, :, None] * leg[:, None, :]).reshape(ny, bgdeg * nyc)
+	s = np.einsum("yij,yk,yl->ikjl", m[:, i[:, None] + i[None, :]], leg, leg).reshape(bgdeg * nyc, bgdeg * nyc)
+	rb = (r[:, 1:][:, :, None] * leg[:, None, :]).reshape(ny, bgdeg * nyc)
+
+	if bgdeg == 0:
+		return inv * r[:, 0], np.zeros((0, nyc))
+
+	# Eliminate the amplitudes, solve for the surface, and back substitute
+	schur = s - b.T @ (inv[:, None] * b)
+	rhs = np.sum(rb, 0) - b.T @ (inv * r[:, 0])
+	coeffs = np.linalg.lstsq(schur, rhs, rcond=None)[0]
+	amps = inv * (r[:, 0] - b @ coeffs)
+
+	return amps, coeffs.reshape(bgdeg, nyc)
+
+
+def surface_eval(amps, coeffs, tpow, leg):
+	# The sky of the surface at the columns of tpow, dimension (ny, len(tpow))
+	bgdeg = np.shape(coeffs)[0]
+	slope = leg @ coeffs.T  # (ny, bgdeg)
+	return amps[:, None] + slope @ tpow[:, 1:bgdeg + 1].T
+
+
+def fitbg_surface(dataim, x1, x2, **kwargs):
+	ny, nx = np.shape(dataim)
+
+	xvals = kwargs.get("xvals")
+	if xvals is None:
+		c1, c2 = sky_bounds(x1, x2, nx, kwargs.get("skywidth"))
+		xvals = np.array([*np.arange(c1, x1), *np.arange(x2 + 1, c2)])
+	quality = kwargs.get("quality")
+	inmask = kwargs.get("inmask")
+	if inmask is None and quality is None:
+		inmask = np.ones((ny, nx))
+	varim = kwargs.get("varim")
+	if varim is None:
+		varim = np.ones((ny, nx))
+	skyvar = kwargs.get("skyvar")
+	if skyvar is None:
+		skyvar = 0.
+	bgres = kwargs.get("bgres")
+	bgdeg = kwargs.get("bgdeg", 1)
+	bgydeg = kwargs.get("bgydeg", 3)
+	bgiter = kwargs.get("bgiter", 20)
+	thresh = kwargs.get("bthresh", 5)
+	q = kwargs.get("q", 1)
+	v0 = kwargs.get("v0", 0)
+	bpct = kwargs.get("bpct", 0.5)
+	absthresh = kwargs.get("absthresh", False)
+	noupdate = kwargs.get("noupdate", False)
+	counts = kwargs.get("counts")
+
+	if bgdeg < 0 or bgydeg < 0:
+		raise ParameterException("Degree cannot be < 0.")
+	if len(xvals) <= bgdeg:
+		raise ParameterException("Number of xvals must be greater than degree.")
+
+	vthresh = thresh if absthresh else thresh * thresh
+
+	tpow, leg = _surface_basis(xvals, nx, ny, bgdeg, bgydeg)
+	tsky = tpow[xvals]
+	datas = np.asarray(dataim[:, xvals], np.double)
+	vars = np.array(varim[:, xvals], np.double)
+	skyvars = constant_value(skyvar)
+	if skyvars is None:
+		skyvars = skyvar[:, xvals]
+	if quality is None:
+		goods = inmask[:, xvals] == 1
+	else:
+		goods = (quality[:, xvals] & REJECTED) == 0
+	ngood = np.sum(goods)
+	errorthresh = np.maximum(np.sum(goods, 1) * (1 - bpct), max(len(xvals) * 0.10, 6))
+
+	# MAIN LOOP
+	# Fit the surface to the good pixels of the frame, then take as good the
+	# pixels of inmask within threshold of the fit. A pixel a poor early fit
+	# rejected comes back once the fit improves. Stop when the good pixels
+	# no longer change, or after bgiter passes.
+	inmasks = np.copy(goods)
+	npass = 0
+	while True:
+		with np.errstate(divide="ignore"):
+			weights = np.where(goods & (vars > 0), 1. / vars, 0.)
+		amps, coeffs = surface_solve(datas, weights, tsky, leg, bgdeg)
+		est = surface_eval(amps, coeffs, tsky, leg)
+		npass += 1
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			if absthresh:
+				crs = abs(datas - est)
+			else:
+				crs = (datas - est) ** 2 / vars
+		if not noupdate:
+			vars = np.where(inmasks, abs(est) / q + v0 + skyvars, vars)
+
+		newgoods = inmasks & (crs <= vthresh)
+		if np.array_equal(newgoods, goods) or npass >= bgiter:
+			goods = newgoods
+			break
+		goods = newgoods
+
+	errflag = np.sum(goods, 1) < errorthresh
+
+	if quality is None:
+		inmask[:, xvals] = np.where(goods, inmask[:, xvals], 0)
+	else:
+		mark(quality, inmasks & ~goods, SKY_CR, xvals)
+	if bgres is not None:
+		bgres[:, xvals] = crs
+	if not noupdate:
+		varim[:, xvals] = vars
+
+	bgim = surface_eval(amps, coeffs, tpow, leg)
+
+	if counts is not None:
+		counts.update(vectors=ny, iterations=ny * npass, rejected=int(ngood - np.sum(goods)),
+		              errflag=int(np.sum(errflag)))
+
+	return bgim, inmask if quality is None else quality, 1 - errflag.astype(int)
@@ -13,4 +13,16 @@ class VectorLengthException(Exception):
 
 	def __init__(self, ax, bx):
 		self.message = "Vector of %s does not match vector length of %s." % (ax, bx)
+		super().__init__(self.message)
+
+class OutputException(Exception):
+	"""Exception raised if the products of a frame could not be written.
+
+	Attributes:
+		prefix      -- the output prefix of the frame.
+		error       -- the traceback of the writer.
+	"""
+
+	def __init__(self, prefix, error):
+		self.message = "Writing the products of %s failed:\n%s" % (prefix or "the frame", error)
 		super().__init__(self.message)
\ No newline at end of file
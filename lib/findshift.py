@@ -6,42 +6,67 @@ Purpose: Find the shift in the trace for each row of an input vector.
 Category: Shifting Procedures
 
 Calling Example:
-		findshift(dataim, centerdeg = centerdeg, centerfit = centerfit,
-				centroid = centroid, gaussth=gaussth, height=height,
-				inmask=inmask, plottype = plottype, shifth=shifth,
-				shmask = shmask, spec = spec, tracemask=tracemask,
-				varim=varim, verbose = verbose, widthth = widthth,
-				widthv = widthv, x1=x1, x2=x2)
+		shiftv, widthv, height, shmask = findshift(dataim, centerfit = centerfit,
+				centroid = centroid, gaussth = gaussth, inmask = inmask,
+				shiftth = shiftth, spec = spec, tracedeg = tracedeg,
+				tracemask = tracemask, varim = varim, verbose = verbose,
+				widthth = widthth, x1 = x1, x2 = x2)
 Inputs:
 		dataim: sky-subtracted processed image, the horizontal direction as the
 				spatial direction, and the vertical as the wavelength
 Keyword Arguments:
 		General
 		varim: the variance image for weighting of the polynomial fit
-		inmask: the mask used for all functions
+				(default: the absolute value of the data)
+		inmask: the mask used for all functions (default: every pixel good)
 		spec: array holding extracted spectra, same dimension as vertical of dataim
-		x1,x2: boundaries in x which contain the spectrum
-		verbose:
-
-		#TODO FINISH DOCS
+		x1,x2: boundaries in x which contain the spectrum (inclusive)
+		verbose: level of output to screen (0)
+
+		Center and width finding
+		tracemask: array, same shape as dataim, to receive the mask of bad
+				pixels found during center estimation
+		centroid: set to use the center of mass of each row instead of
+				fitting a Gaussian
+		gaussth: the absolute value of allowable error when fitting a
+				Gaussian to the data (0.03)
+
+		Center and width correction
+		centerfit: set to return the fitted trace for every row, rather than
+				only for the rows whose center was rejected
+		tracedeg: degree of the polynomial fitted to the centers (4), also
+				accepted as centerdeg
+		shiftth: the absolute allowable error between a row's center and the
+				fitted trace (0.5 pixels)
+		widthth: the absolute allowable error between a row's width and the
+				median width (0.5 pixels). Widths further off are replaced by
+				the median.
+		reject: "worst" (default) rejects one center per pass of the trace
+				fit, as procvect does, "all" every center above shiftth (see
+				procblock)
 
 Outputs:
+		shiftv: the center of the trace at each row, in the columns of dataim
+		widthv: the Gaussian width of each row's profile (1 with centroid)
+		height: the Gaussian height of each row's profile (0 with centroid)
+		shmask: 0 for each row whose center appears to be miscalculated
+
+		Every row is fitted at once: the Gaussians by procblock with
+		gaussfunc_batch and the trace by procblock with polyfunc_batch, so the
+		results are those of fitting the rows one by one with procvect.
 
 History:
 
 Created on 9/22/2021$
 """
 
-from lib.misc import rebin_nd
-from lib.fitting.centermass import centermass
-from lib.fitting.gaussfunc import gaussfunc
-from lib.procvect import procvect
+from lib.procblock import procblock
 from lib.excep import *
+from lib.utils import constant_value
 import numpy as np
 
 def findshift(dataim, **kwargs):
 
-	#TODO FUNC: findshift
 	nx = np.shape(dataim)[1]
 	ny = np.shape(dataim)[0]
 
@@ -50,82 +75,93 @@ def findshift(dataim, **kwargs):
 	gaussth = kwargs.get('gaussth', 0.03)
 	shiftth = kwargs.get('shiftth', 0.5)
 	widthth = kwargs.get('widthth', 0.5)
-	tracedeg = kwargs.get('tracedeg', 4)
+	tracedeg = kwargs.get('tracedeg', kwargs.get('centerdeg', 4))
 	verbose = kwargs.get('verbose', 0)
-	plottype = kwargs.get('plottype', 0)
-	varim = kwargs.get('varim', abs(dataim))
-	inmask = kwargs.get('inmask', np.ones((nx, ny)))
-	spec = kwargs.get('spec', np.sum(dataim, 1))
+	varim = kwargs.get('varim')
+	inmask = kwargs.get('inmask')
+	spec = kwargs.get('spec')
+	if spec is None:
+		spec = np.sum(dataim, 1)
 	x1 = kwargs.get('x1', 0)
 	x2 = kwargs.get('x2', nx-1)
-	gotovect = kwargs.get('gotovect', -1)
 	centroid = kwargs.get('centroid', False)
-
-
-	# ; Checks
-	# str = ""
-	# str += n_elements(spec) ne ny                             ? "spec "   : ""
-	# str += x1 lt 0 || x1 gt x2                                ? "x1 "     : ""
-	# str += x2 gt nx - 1 || x2 lt x1                           ? "x2 "     : ""
-	# str += (size(varim ))[1] ne nx || (size(varim ))[2] ne ny ? "varim "  : ""
-	# str += (size(inmask))[1] ne nx || (size(inmask))[2] ne ny ? "inmask " : ""
-	# str += 4 ne n_elements(plottype)                          ? "plottype" : ""
-	# if str ne "" then message, "Poorly formed inputs: " + str
+	centerfit = kwargs.get('centerfit', False)
+	tracemask = kwargs.get('tracemask')
+	reject = kwargs.get('reject', 'worst')
+
+	if len(spec) != ny:
+		raise VectorLengthException("spec", "dataim")
+	if x1 < 0 or x1 > x2:
+		raise ParameterException("x1 must be between 0 and x2.")
+	if x2 > nx - 1:
+		raise ParameterException("x2 must be less than the width of dataim.")
+	if varim is not None and np.shape(varim) != (ny, nx):
+		raise VectorLengthException("varim", "dataim")
+	if inmask is not None and np.shape(inmask) != (ny, nx):
+		raise VectorLengthException("inmask", "dataim")
 
 	shiftv = np.zeros(ny)   # the center of each row's profile
 	widthv = np.zeros(ny)   # the width of each row's profile
 	height = np.zeros(ny)   # the height of each row's profile
 	xrange = np.arange(x2-x1+1) + x1 # the range of pixel values to examine
-	shmask = np.ones(nx)
-	tracemask = inmask
-
-	for i in range(ny):
-		mainmv = inmask[i, x1:x2]
-		datav = dataim[i, x1:x2] > 0
-		varv = varim[i, x1:x2] * mainmv
-		specv = spec[i]
-
-		if i == gotovect:
-			verbose = 5
-		if centroid:
- 			shiftv[i] = centermass(datav, datav, varv, specv)
-			widthv[i] = 1
-			if verbose == 5:
-				input("Stopping at center mass. Press enter to continue.")
-		else:
-			# TODO findshift plotting
-			# if plottype[1] or (verbose eq 5) then begin
-            #     device, window_state = ws
-            #     if not ws[12] then window, 12 else wset, 12
-            #     !p.multi = [0, 1, 2, 1, 1]
-            #     plot, datav,   title = 'Data Vector for Finding Center', /ystyle
-            #     plot, mainmv,   title = 'Input Mask', yrange = [-0.1, 1.1]
-            #     !p.multi = 0
-            #     wait, 0.01
-            #     endif
-			if verbose == 5:
-				input("Stopping at gassfunc")
-			func = 'gaussfunc'
-			parm = 1
-			foo, _, coeff = procvect(datav, varv=varv, noupdate=True, thresh=gaussth, maskv=mainmv,
-			               func = func, parm=parm, verbose=verbose, plottype=plottype,
-			               multv=specv, vectnum=i, absthresh=True)
-			tracemask[i, x1:x2] = mainmv
-			foo = gaussfunc()
-			if coeff[0] == 0:
-				shmask[i] = 0
-			else:
-				shmask[i] = 1
-				shiftv[i] = coeff[1]
-				widthv[i] = coeff[2]
-				height[i] = coeff[0]
-
-	varv = np.zeros(ny) + (1.0/10)**2
-	func = 'polyfunc'
-	parm = tracedeg
-
-	#TODO finish findshift
-	if rc.centroid:
-		brows = np.where(sum(rc.inmask[:, xrange], 1) < len(xrange), rcount)
-
-	return
\ No newline at end of file
+	shmask = np.ones(ny)    # mask of bad estimates of profile
+
+	# Cut the aperture of every row out at once. Without varim the variance
+	# is the data, and without inmask (or with a constant mask of 1) every
+	# pixel is good, so neither is made over the whole frame.
+	datab = np.maximum(dataim[:, x1:x2+1], 0)
+	if varim is None:
+		varb = abs(dataim[:, x1:x2+1])
+	else:
+		varb = varim[:, x1:x2+1]
+	if inmask is None or constant_value(inmask) == 1:
+		mainmb = np.ones(np.shape(datab))
+	else:
+		mainmb = np.array(inmask[:, x1:x2+1], np.double)
+		varb = varb * mainmb
+	specb = np.broadcast_to(np.asarray(spec, np.double)[:, None], np.shape(datab))
+
+	if centroid:
+		# The center of mass of each row, as centermass
+		with np.errstate(divide="ignore", invalid="ignore"):
+			weight = datab / specb
+			shiftv = np.sum(xrange * weight, 1) / np.sum(weight, 1)
+		widthv[:] = 1
+		shmask[np.sum(mainmb, 1) < len(xrange)] = 0
+		shmask[~np.isfinite(shiftv)] = 0
+		shiftv[shmask == 0] = 0
+	else:
+		# Fit a Gaussian to every row, rejecting pixels off by more than gaussth
+		fiteval, mainmb, errflag, coeffb = procblock(datab, varb=varb, noupdate=True, thresh=gaussth,
+		                                             maskb=mainmb, func="gaussfunc", parm=1, multb=specb,
+		                                             absthresh=True, counts=kwargs.get('counts'))
+		if tracemask is not None:
+			tracemask[:, x1:x2+1] = mainmb
+
+		good = coeffb[:, 0] != 0
+		shmask[~good] = 0
+		shiftv[good] = coeffb[good, 1] + x1
+		widthv[good] = coeffb[good, 2]
+		height[good] = coeffb[good, 0]
+
+	if verbose == 5:
+		input("Stopping at trace fitting. Press enter to continue.")
+
+	# Fit the trace to the centers, rejecting those off by more than shiftth
+	shiftest, shmaskb, errflag, coeff = procblock(shiftv[None, :], varb=np.zeros((1, ny)) + (1.0/10)**2,
+	                                              noupdate=True, thresh=shiftth, maskb=shmask[None, :],
+	                                              func="polyfunc", parm=tracedeg, absthresh=True,
+	                                              reject=reject, counts=kwargs.get('counts'))
+	shiftest = shiftest[0]
+	shmask = shmaskb[0]
+
+	if centerfit:
+		shiftfinal = shiftest
+	else:
+		shiftfinal = shiftv * shmask + shiftest * (1 - shmask)
+
+	if widthth is not None:
+		medw = np.median(widthv)
+		widthv[abs(widthv - medw) > widthth] = medw
+
+	return shiftfinal, widthv, height, shmask
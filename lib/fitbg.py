@@ -14,11 +14,16 @@ Inputs:
 
 Optional Inputs:
 	nobgfit: set True to not fit a background and assume the average
+	skywidth: number of columns either side of x1..x2 to fit the sky over
+		(default: every column outside the spectrum)
 	
 	Cut into rows and passed to procvect.py:
-	inmask: the main mask used by all functions
+	inmask: the input mask, 1 for good pixels. Without quality, it is made
+		into a quality plane, and updated in place with the sky pixels
+		rejected.
 	varim: the array that contains the variance of the locations
-	skyvar: the variance image for the sky subtraction
+	skyvar: the variance image for the sky subtraction (default 0, which
+		is left out of the variance rather than made into an image)
 	
 	Passed through to procvect.py:
 	bgdeg: degree of polynomial interpolation (default is 1)
@@ -28,19 +33,61 @@ Optional Inputs:
 	bpct: the percentage of bad pixels that kicks out of an interation
 	
 	Made from procvect.py:
-	bgres: the residuals for cosmic ray rejection
+	bgres: array, same shape as dataim, to receive the residuals for cosmic ray rejection
 	bgmask: the output mask of the cosmic rays found
 	
+	Precision:
+	dtype: float32 or float64, for the variance image, when not passed, and
+		the mask returned. The background image is made in the type of dataim.
+
 	Debugging:
+	stats: a Stats to count the vectors fitted, clipping iterations,
+		rejected pixels and errflag rows into, as stage "fitbg"
 	verbose: level of printed output
 	plottype: level of plot to show (0-4)
 	gotovect: the row at which to stop the loop
-	errvect: will contain the rows that exited with bad pixels
+	errvect: array of ny ones, set to 0 for the rows that exited with bad pixels
+
+	Quality:
+	quality: a quality plane (see quality.py), the shape of dataim, made from
+		the input mask. The row fits read their masks from it, and SKY_CR is
+		set on the sky pixels rejected and SKY_FAIL on the rows whose fit
+		stopped, in place.
+
+	Batch fitting:
+	batch: set True to fit every row at once with fitbg_batch instead of
+		calling procvect row by row. The results match the row loop.
+	reject: with batch, "all" masks every pixel above bthresh on each pass
+		instead of only the worst one (see procblock)
+
+	Parallel fitting:
+	workers: number of processes to fit blocks of rows in (default 1). The
+		images are shared with the workers through shared memory and the
+		results are identical to fitting in one process.
+	chunks: number of blocks of rows to split the frame into (default 4 per worker)
+
+	Surface fitting:
+	bgsurface: set True to fit the whole frame with one smooth surface, an
+		amplitude per row for the sky lines plus bgdeg across the slit by
+		bgydeg along the wavelength axis, instead of a polynomial per row
+		(see bgsurface.py). Pixels above bthresh are clipped over the whole
+		frame on each pass. workers and bgseed do not apply.
+	bgydeg: the degree of the surface along the wavelength axis (default 3)
+	bgiter: the largest number of clipping passes of the surface (default 20)
+
+	Warm start:
+	bgseed: a BackgroundSeed carried from frame to frame. The fit starts
+		from the previous frame's sky coefficients, with the sky pixels that
+		deviate from them masked up front, and the pixels the previous frame
+		rejected only as cosmic rays fitted again. The convergence
+		statistics of the frame are left in bgseed.last (see bgseed.py).
 
 Outputs:
 	an array of size dataim in which, for each wavelength, the spectrum
 	from x1 to x2 has been removed, interpolated over (with coefficients coeffs) 
-	and polynomial has been evaluated at all x values
+	and polynomial has been evaluated at all x values, the variance image,
+	and the mask: the quality plane when passed one without inmask,
+	otherwise the mask of the pixels left in (inmask, when passed)
 
 History:
 
@@ -50,8 +97,14 @@ Created on 9/19/2021$
 import numpy as np
 from lib.excep import *
 from lib.misc import *
-from lib.procvect import procvect
-from lib.utils import save_fits
+from lib.procvect import PreparedVect
+from lib.procblock import procblock
+from lib.bgsurface import fitbg_surface
+from lib.parallel import parmap
+from lib.utils import save_fits, sky_bounds, constant_plane, constant_value, plane_dtype
+from lib.quality import quality_plane, quality_mask, mark, mark_rows, REJECTED, SKY_CR, SKY_FAIL
+from lib.stats import NOSTATS
+from collections import Counter
 
 
 def fitbg(dataim, x1, x2, **kwargs):
@@ -69,51 +122,172 @@ def fitbg(dataim, x1, x2, **kwargs):
 	verbose = kwargs.get("verbose", 0)
 	plottype = kwargs.get("plottype", 0)
 	gotovect = kwargs.get("gotovect", -1)
-	inmask = kwargs.get("inmask", np.ones((nx, ny)))
-	varim = kwargs.get("varim", np.ones((nx, ny)))
-	skyvar = kwargs.get("skyvar", np.zeros((nx, ny)))
+	dtype = plane_dtype(kwargs.get("dtype"))
+	varim = kwargs.get("varim")
+	if varim is None:
+		varim = np.ones((ny, nx), dtype)
+	skyvar = kwargs.get("skyvar")
+	if skyvar is None:
+		skyvar = constant_plane(0., (ny, nx))
 
 	if (x2 > nx - 1) or (x2 < x1):
 		raise ParameterException("x2 cannot be greater than nx-1 or greater than x1.")
-	if (np.shape(varim)[0] != nx) or (np.shape(varim)[1] != ny):
+	if (np.shape(varim)[1] != nx) or (np.shape(varim)[0] != ny):
 		raise ParameterException("Dimensions of varim do not match dataim.")
-	if (np.shape(inmask)[0] != nx) or (np.shape(inmask)[1] != ny):
-		raise ParameterException("Dimensions of inmask do not match dataim.")
-	if (np.shape(skyvar)[0] != nx) or (np.shape(skyvar)[1] != ny):
+	if (np.shape(skyvar)[1] != nx) or (np.shape(skyvar)[0] != ny):
 		raise ParameterException("Dimensions of skyvar do not match dataim.")
 
-	xvals1 = np.arange(x1)
-	xvals2 = np.arange(nx - 1 - x2) + x2 + 1
+	# The fits read their masks from the quality plane and mark it. An inmask
+	# passed without one is made into a plane here, and given back updated.
+	inmask = kwargs.get("inmask")
+	if inmask is not None and np.shape(inmask) != (ny, nx):
+		raise ParameterException("Dimensions of inmask do not match dataim.")
+	quality = kwargs.get("quality")
+	if quality is None:
+		quality = quality_plane(inmask, (ny, nx))
+	elif np.shape(quality) != (ny, nx):
+		raise ParameterException("Dimensions of quality do not match dataim.")
+
+	c1, c2 = sky_bounds(x1, x2, nx, kwargs.get("skywidth"))
+	xvals1 = np.arange(c1, x1)
+	xvals2 = np.arange(x2 + 1, c2)
 	xvals = np.array([*xvals1, *xvals2])
 
 	# Subtract bias
 	nobgfit = kwargs.get("nobgfit", False)
 
 	if nobgfit:
-		bgim = (np.ones((nx, ny))) * np.median(dataim[:, xvals])
+		bgim = np.full((ny, nx), np.median(dataim[:, xvals]))
 		return bgim
 
-	# Prepare for row by row fitting
-	yvals = np.arange(ny)
+	# Only scalar options are passed on to the row fits and worker processes
+	opts = {k: v for k, v in kwargs.items() if not isinstance(v, np.ndarray)
+	        and k not in ("workers", "chunks", "stats", "bgseed")}
+	stats = kwargs.get("stats") or NOSTATS
+	bgseed = kwargs.get("bgseed")
+
 	bgim = np.copy(dataim)
-	bgres = np.zeros((nx, ny), np.single)
-	bgmask = np.ones((nx, ny), np.byte)
-	errvect = np.ones(ny)
-	bgim[:, x1:x2] = 0
-	allx = np.arange(nx)
+	bgres = kwargs.get("bgres")
+	if bgres is None:
+		bgres = np.zeros((ny, nx), np.single)
+	errvect = kwargs.get("errvect")
+	if errvect is None:
+		errvect = np.ones(ny)
+	arrays = dict(dataim=dataim, quality=quality, varim=varim, skyvar=skyvar,
+	              bgim=bgim, bgres=bgres, errvect=errvect)
+	outputs = ("quality", "varim", "bgim", "bgres", "errvect")
+
+	# FIT A SURFACE
+	# Fit one smooth surface, with an amplitude per row, to the whole frame
+	if kwargs.get("bgsurface", False):
+		counts = stats.counter() if stats.enabled else None
+		bgim[:, :], quality, errvect[:] = fitbg_surface(dataim, x1, x2, xvals=xvals, quality=quality, varim=varim,
+		                                                skyvar=skyvar, bgres=bgres, counts=counts,
+		                                                **{k: v for k, v in opts.items() if k not in arrays})
+		stats.merge("fitbg", counts)
+		mark_rows(quality, errvect, SKY_FAIL)
+		return bgim, varim, _mask_out(quality, inmask, kwargs.get("quality"), dtype)
+
+	# WARM START
+	# Start from the previous frame's sky: mask the sky pixels that deviate
+	# from it before the first pass, and keep the coefficients of this frame
+	# for the next one.
+	premask = None
+	if bgseed is not None:
+		startmask = (quality[:, xvals] & REJECTED) == 0
+		premask = bgseed.seed(dataim, varim, quality, xvals, bthresh, kwargs.get("absthresh", False))
+		if premask is not None:
+			mark(quality, premask, SKY_CR, xvals)
+			arrays["start"] = bgseed.start
+		arrays["coeffb"] = np.zeros((ny, bgseed.ncoeff))
+		outputs = outputs + ("coeffb",)
 
 	# FIT BY ROW
 	# Cut up the data into rows and pass each to procvect. Tell procvect
 	# to use polyfunc to estimate the background. Procvect will handle
-	# bad pixel rejection, and return the polynomial over all x
+	# bad pixel rejection, and return the polynomial over all x. With
+	# workers, blocks of rows are fitted in a process pool.
+
+	if kwargs.get("batch", False):
+		rowfunc = _fitbg_batch_rows
+	else:
+		rowfunc = _fitbg_rows
+	counts = parmap(rowfunc, ny, arrays, workers=kwargs.get("workers", 1), chunks=kwargs.get("chunks"),
+	                outputs=outputs, x1=x1, x2=x2, xvals=xvals,
+	                counts=stats.enabled or bgseed is not None, **opts)
+
+	# Unmask the premasked pixels the fit accepts, which a cold start would
+	# have kept, and fit their rows again
+	if premask is not None:
+		falsemask = bgseed.restore(dataim, varim, bgim, xvals, bthresh, kwargs.get("absthresh", False))
+		for i in np.flatnonzero(np.any(falsemask, 1)):
+			_restart_row(quality, errvect, i, xvals, startmask[i], premask[i] & ~falsemask[i])
+			counts.append(rowfunc(i, i + 1, arrays, x1=x1, x2=x2, xvals=xvals, counts=True, **opts))
+	stats.merge("fitbg", counts)
+
+	if bgseed is not None:
+		bgseed.store(dataim, quality, startmask, arrays["coeffb"], xvals,
+		             sum((c for c in counts if c is not None), Counter()))
+
+	return bgim, varim, _mask_out(quality, inmask, kwargs.get("quality"), dtype)
+
+
+def _mask_out(quality, inmask, given, dtype):
+	# The mask fitbg returns: a quality plane passed in, or else the mask of
+	# the pixels left in, written back into the inmask passed
+	if given is not None and inmask is None:
+		return quality
+	if inmask is None:
+		return quality_mask(quality, dtype=dtype)
+	np.copyto(inmask, quality_mask(quality), casting="unsafe")
+	return inmask
+
+
+def _mark_sky(quality, before, after, errvect):
+	# Record in the quality plane the sky pixels rejected, good before the
+	# fit and bad after, and the rows whose fit stopped
+	mark(quality, (before == 1) & (after != 1), SKY_CR)
+	mark_rows(quality, errvect, SKY_FAIL)
+
+
+def _restart_row(quality, errvect, i, xvals, startgood, premask):
+	# Return the sky of row i to where its fit started, with only the pixels
+	# of premask masked up front
+	quality[i, xvals[startgood]] &= np.uint8(0xff ^ SKY_CR)
+	quality[i, xvals[premask]] |= SKY_CR
+	if errvect[i] == 0:
+		errvect[i] = 1
+		quality[i] &= np.uint8(0xff ^ SKY_FAIL)
 
-	for i in range(ny):
-		print("Fitting row ", i)
+
+def _fitbg_rows(lo, hi, arrays, x1, x2, xvals, counts=False, **kwargs):
+	# Fit rows lo..hi-1 of the background one at a time with procvect,
+	# returning the Counter of the fits if counts is set
+
+	dataim = arrays["dataim"]
+	quality = arrays["quality"]
+	varim = arrays["varim"]
+	skyvar = arrays["skyvar"]
+	bgim = arrays["bgim"]
+	bgres = arrays["bgres"]
+	errvect = arrays["errvect"]
+	nx = np.shape(dataim)[1]
+
+	bgdeg = kwargs.get("bgdeg", 1)
+	bthresh = kwargs.get("bthresh", 5)
+	gotovect = kwargs.get("gotovect", -1)
+	counts = Counter() if counts else None
+	start = arrays.get("start")
+	fitter = PreparedVect(nx, xvals=xvals, thresh=bthresh, **kwargs)
+	# A sky variance of 0 everywhere (none was passed) is left out of the fits
+	noskyvar = constant_value(skyvar) == 0
+
+	for i in range(lo, hi):
 		datav = dataim[i, :]
-		maskv = inmask[i, :]
+		maskv = quality_mask(quality[i])
 		varv = varim[i, :]
 		bcrv = bgres[i, :]
-		skyvarv = skyvar[i, :]
+		skyvarv = None if noskyvar else skyvar[i, :]
 
 		if (sum(maskv[0:x1]) < 2) or (sum(maskv[x2 + 1:nx]) < 2):
 			parm = 0
@@ -121,15 +295,122 @@ def fitbg(dataim, x1, x2, **kwargs):
 			parm = bgdeg
 
 		if i == gotovect:
-			verbose = 5
+			fitter.verbose = 5
 
 		# plot_fitbg(datav, maskv, varv, skyvarv, kwargs['output_dir'])
 
-		bgim[i, :], inmask[i, :], errflag, coeffv = procvect(datav, varv=varv, maskv=maskv, crv=bcrv, thresh=bthresh,
-		                                                     xvals=xvals,
-		                                                     skyvarv=skyvarv, vectnum=i, parm=parm, **kwargs)
+		bgim[i, :], newmask, errflag, coeffv = fitter(datav, varv=varv, maskv=np.copy(maskv), crv=bcrv,
+		                                              skyvarv=skyvarv, parm=parm, vectnum=i, counts=counts,
+		                                              coeffv=None if start is None else start[i])
+		quality[i, (maskv == 1) & (newmask != 1)] |= SKY_CR
 
 		if errflag:
 			errvect[i] = 0  # There was a problem fitting this row
+			quality[i] |= SKY_FAIL
+		if "coeffb" in arrays and coeffv is not None:
+			arrays["coeffb"][i, :len(coeffv)] = coeffv
+
+	return counts
+
+
+def _fitbg_batch_rows(lo, hi, arrays, x1, x2, xvals, counts=False, **kwargs):
+	# Fit rows lo..hi-1 of the background together with fitbg_batch
+
+	rows = slice(lo, hi)
+	counts = Counter() if counts else None
+	coeffb = arrays["coeffb"][rows] if "coeffb" in arrays else None
+	start = arrays["start"][rows] if "start" in arrays else None
+	before = quality_mask(arrays["quality"][rows], dtype=np.byte)
+	bgim, after, errvect = fitbg_batch(arrays["dataim"][rows], x1, x2, xvals=xvals,
+	                                   inmask=np.copy(before), varim=arrays["varim"][rows],
+	                                   skyvar=arrays["skyvar"][rows], bgres=arrays["bgres"][rows],
+	                                   counts=counts, coeffb=coeffb, start=start, **kwargs)
+	arrays["bgim"][rows] = bgim
+	arrays["errvect"][rows] = errvect
+	_mark_sky(arrays["quality"][rows], before, after, errvect)
+
+	return counts
+
+
+def fitbg_batch(dataim, x1, x2, **kwargs):
+	"""
+	Fits the sky background of every row at once. This is the batched engine
+	behind fitbg(batch=True): rather than one procvect call per row, the whole
+	frame is passed to procblock, which fits the sky polynomials of all rows
+	in a single weighted least squares solve over one stacked Vandermonde
+	matrix, with the per-row masks as weights.
+
+	Inputs:
+		dataim: The data image, with spectrum
+		x1, x2: boundaries in x which contain spectrum
+
+	Optional Inputs:
+		xvals:  the sky x values to fit (default: the columns within skywidth
+				of x1..x2, or all columns outside x1..x2)
+		inmask, varim, skyvar, bgdeg, bthresh, q, v0, bpct, absthresh, noupdate:
+				as for fitbg. inmask and varim are updated in place, as the row
+				loop does through procvect.
+		bgres:  array, same shape as dataim, to receive the rejection residuals
+		reject: passed to procblock; "worst" (default) matches the row loop
+		counts: a Counter for procblock to count the fits into
+		coeffb: array, dimension (ny, ncoeff), to receive the sky coefficients
+				of each row
+		start:  the sky coefficients each row starts from, dimension
+				(ny, ncoeff), passed to procblock
+
+	Outputs:
+		bgim:    the background image
+		inmask:  the updated mask
+		errvect: 0 for rows that exited with too many bad pixels, 1 otherwise
+	"""
+	ny, nx = np.shape(dataim)
+
+	xvals = kwargs.get("xvals")
+	if xvals is None:
+		c1, c2 = sky_bounds(x1, x2, nx, kwargs.get("skywidth"))
+		xvals = np.array([*np.arange(c1, x1), *np.arange(x2 + 1, c2)])
+	inmask = kwargs.get("inmask")
+	if inmask is None:
+		inmask = np.ones((ny, nx))
+	varim = kwargs.get("varim")
+	if varim is None:
+		varim = np.ones((ny, nx))
+	bgres = kwargs.get("bgres")
+	if bgres is None:
+		bgres = np.zeros((ny, nx), np.single)
+
+	# The row loop fits the rows with a thin sky window, fewer than 2 good
+	# pixels on either side, with parm=0, which polyfunc reads as its default
+	# degree. Fit each group of rows of one degree together to match it.
+	bgdeg = kwargs.get("bgdeg", 1)
+	thin = (np.sum(inmask[:, :x1], 1) < 2) | (np.sum(inmask[:, x2 + 1:], 1) < 2)
+	parms = np.where(thin, 0, bgdeg)
+	groups = np.unique(parms)
+
+	bgim = np.copy(dataim)
+	errvect = np.ones(ny, np.byte)
+	skyvar = kwargs.get("skyvar")
+	start = kwargs.get("start")
+	for parm in groups:
+		# One group works on the frame in place, several on copies of their rows
+		rows = slice(None) if len(groups) == 1 else np.flatnonzero(parms == parm)
+		maskb, varb, crb = inmask[rows], varim[rows], bgres[rows]
+		fiteval, maskb, errflag, coeffb = procblock(dataim[rows], xvals=xvals, varb=varb, maskb=maskb,
+		                                            coeffb=None if start is None else start[rows],
+		                                            skyvarb=None if skyvar is None else skyvar[rows], crb=crb,
+		                                            thresh=kwargs.get("bthresh", 5), parm=parm, func="polyfunc",
+		                                            q=kwargs.get("q", 1), v0=kwargs.get("v0", 0),
+		                                            bpct=kwargs.get("bpct", 0.5),
+		                                            absthresh=kwargs.get("absthresh", False),
+		                                            noupdate=kwargs.get("noupdate", False),
+		                                            reject=kwargs.get("reject", "worst"),
+		                                            counts=kwargs.get("counts"))
+		if len(groups) > 1:
+			inmask[rows], varim[rows], bgres[rows] = maskb, varb, crb
+		bgim[rows] = fiteval
+		errvect[rows] = 1 - errflag
+		if kwargs.get("coeffb") is not None:
+			ncoeff = min(np.shape(coeffb)[1], np.shape(kwargs["coeffb"])[1])
+			kwargs["coeffb"][rows, :ncoeff] = coeffb[:, :ncoeff]
 
-	return bgim, varim, inmask
+	return bgim, inmask, errvect
@@ -1,9 +1,190 @@
 from lib.excep import *
+from lib.utils import fill_bad
 import numpy as np
-from scipy.ndimage.filters import uniform_filter1d as smooth
-from scipy.interpolate import interp1d as interpol
+from numpy.lib.stride_tricks import sliding_window_view
 
-def boxcarfunc(xvals, datav, varv, specv, coeffv, boxcarhw):
+
+def _chunks(hw):
+	# The chunk length, a power of two, and the number of windows each chunk
+	# of a running median answers
+	length = 1 << int(np.ceil(np.log2(4 * hw + 2)))
+	return length, length - 2 * hw
+
+
+def running_median(datab, maskb, hw):
+	"""
+		Function: running_median
+
+		Description:
+			The masked running median of every row of a block, over the
+			window of 2*hw+1 pixels centered on each pixel. Masked pixels,
+			and pixels past the ends of a row, are left out of the windows.
+
+		Parameters:
+			datab:  the block of vectors, dimension (nvect, n)
+			maskb:  boolean block, True for the good pixels
+			hw:     the halfwidth of the window
+
+		Outputs:
+			The median block, and the count of good pixels in each window.
+			Windows without good pixels have a median of 0.
+
+		Procedure:
+			Each row is cut into overlapping chunks of a power of two L >=
+			4*hw+2 pixels, which answer the windows of L-2*hw pixels. The
+			pixels of a chunk are replaced by their ranks, masked pixels
+			ranked last, and a wavelet matrix of the ranks is built, which
+			finds the k-th smallest of any window in log2(L) steps. Every
+			chunk of every row is built and queried at once, one bit at a
+			time, so the cost is O(n log hw) per row with log2(L) passes
+			over the block.
+		"""
+	datab = np.atleast_2d(datab)
+	nvect, n = np.shape(datab)
+	width = 2 * hw + 1
+	length, step = _chunks(hw)
+	nchunk = -(-n // step)
+	nbits = int(np.log2(length))
+
+	# Pad each row with masked pixels and cut it into chunks of length
+	# pixels, step apart, M of them in all
+	total = nchunk * step + 2 * hw
+	good = np.zeros((nvect, total), bool)
+	good[:, hw:hw + n] = np.asarray(maskb, bool) & np.isfinite(datab)
+	key = np.full((nvect, total), np.inf)
+	key[:, hw:hw + n] = np.where(good[:, hw:hw + n], datab, np.inf)
+	key = sliding_window_view(key, length, 1)[:, ::step].reshape(-1, length)
+	good = sliding_window_view(good, length, 1)[:, ::step].reshape(-1, length)
+	nrow = len(key)
+
+	# Sort each chunk and rank its pixels
+	order = np.argsort(key, 1, kind="stable")
+	values = np.take_along_axis(key, order, 1)
+	ranks = np.empty_like(order)
+	np.put_along_axis(ranks, order, np.arange(length)[None, :], 1)
+
+	# Build the wavelet matrix: at each level, from the top bit down, the
+	# count of zero bits before each position, then a stable partition of
+	# the ranks by the bit
+	zeros = np.empty((nbits, nrow, length + 1), np.intp)
+	zeros[:, :, 0] = 0
+	positions = np.arange(length)[None, :]
+	cur = ranks
+	for level in range(nbits):
+		bit = (cur >> (nbits - 1 - level)) & 1
+		np.cumsum(bit == 0, 1, out=zeros[level, :, 1:])
+		nzero = zeros[level, :, -1:]
+		dest = np.where(bit == 0, zeros[level, :, :-1], nzero + positions - zeros[level, :, :-1])
+		nxt = np.empty_like(cur)
+		np.put_along_axis(nxt, dest, cur, 1)
+		cur = nxt
+
+	# The window of query j of a chunk is [j, j + width), with ngood good
+	# pixels. Ask for the lower and upper middle ranks together.
+	counts = np.concatenate([np.zeros((nrow, 1), np.intp), np.cumsum(good, 1)], 1)
+	ngood = counts[:, width:width + step] - counts[:, :step]
+	lo = np.tile(np.arange(step), (nrow, 2))
+	hi = lo + width
+	k = np.concatenate([(ngood - 1) // 2, ngood // 2], 1).clip(0)
+	rank = np.zeros_like(lo)
+	for level in range(nbits):
+		zl = np.take_along_axis(zeros[level], lo, 1)
+		zh = np.take_along_axis(zeros[level], hi, 1)
+		nzero = zeros[level, :, -1:]
+		inzero = zh - zl
+		down = k < inzero
+		lo = np.where(down, zl, nzero + lo - zl)
+		hi = np.where(down, zh, nzero + hi - zh)
+		k = np.where(down, k, k - inzero)
+		rank |= (~down).astype(rank.dtype) << (nbits - 1 - level)
+
+	middle = np.take_along_axis(values, rank, 1)
+	median = (middle[:, :step] + middle[:, step:]) / 2
+	median[ngood == 0] = 0.
+
+	median = median.reshape(nvect, nchunk * step)[:, :n]
+	ngood = ngood.reshape(nvect, nchunk * step)[:, :n]
+	return median, ngood
+
+
+def running_mean(datab, maskb, hw):
+	"""
+		Function: running_mean
+
+		Description:
+			The masked running mean of every row of a block, over the window
+			of 2*hw+1 pixels centered on each pixel, by cumulative sums.
+			Returns the mean block and the count of good pixels in each
+			window. Windows without good pixels have a mean of 0.
+		"""
+	datab = np.atleast_2d(datab)
+	nvect, n = np.shape(datab)
+	good = np.asarray(maskb, bool) & np.isfinite(datab)
+	padded = np.zeros((nvect, n + 2 * hw + 1))
+	padded[:, hw + 1:hw + 1 + n] = np.where(good, datab, 0.)
+	npadded = np.zeros((nvect, n + 2 * hw + 1), np.intp)
+	npadded[:, hw + 1:hw + 1 + n] = good
+	sums = np.cumsum(padded, 1)
+	counts = np.cumsum(npadded, 1)
+	width = 2 * hw + 1
+	total = sums[:, width:] - sums[:, :-width]
+	ngood = counts[:, width:] - counts[:, :-width]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		mean = np.where(ngood > 0, total / ngood, 0.)
+	return mean, ngood
+
+
+def boxcarfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, boxcarhw):
+	"""
+		Function: boxcarfunc_batch
+
+		Description:
+			Block form of boxcarfunc, smoothing every row of a block of
+			vectors at once. Used by procblock, and so by
+			fitprof(fitboxcar=True) to smooth every column of the profile
+			image along the wavelength axis in one call.
+
+		Parameters:
+			xvals:     The x values of the columns of datab
+			datab:     The block of vectors to fit, dimension (nvect, nx)
+			varb:      The variance block
+			specb:     The spectrum block. Bad pixels have a specb of 0
+			maskb:     Boolean block, True for the pixels each row may fit
+			eval:      Set to True to evaluate the inputs
+			coeffb:    A filler in this routine
+			boxcarhw:  The halfwidth of the median or smooth filter
+
+		Outputs:
+			The estimate block and the average of datab / specb of each row.
+			If eval is not set the estimate is the masked running median of
+			datab / specb. If eval is set it is the masked running mean of
+			the good pixels, with the bad pixels interpolated from their
+			neighbors.
+		"""
+	nx = len(xvals)
+	if np.shape(datab)[-1] != nx:
+		raise VectorLengthException("datab", "xvals")
+	if np.shape(varb) != np.shape(datab):
+		raise VectorLengthException("varb", "datab")
+	if not boxcarhw or boxcarhw < 1:
+		raise ParameterException("boxcarhw must be an int >= 1.")
+
+	good = np.broadcast_to(np.asarray(maskb, bool), np.shape(datab)) & (specb != 0)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		datas = np.where(good, datab / specb, 0.)
+	coeffb = (np.sum(datas, 1) / np.maximum(np.sum(good, 1), 1))[:, None]
+
+	# Fit Data
+	if not eval:
+		est, ngood = running_median(datas, good, boxcarhw)
+		return fill_bad(est, ngood > 0), coeffb
+
+	# Evaluate
+	est, ngood = running_mean(datas, good, boxcarhw)
+	return fill_bad(est, good), coeffb
+
+
+def boxcarfunc(xvals, datav, varv, specv, eval, coeffv, boxcarhw):
 	"""
 		Function: boxcarfunc
 
@@ -34,6 +215,7 @@ def boxcarfunc(xvals, datav, varv, specv, coeffv, boxcarhw):
 		Procedure:
 			If eval == False, then do a median filter over the datav / specv. Else,
 			smooth over the good pixels and interpolate over the bad pixels.
+			This is boxcarfunc_batch on a block of one vector.
 
 		Example:
 
@@ -53,29 +235,6 @@ def boxcarfunc(xvals, datav, varv, specv, coeffv, boxcarhw):
 	if len(specv) != nx:
 		raise VectorLengthException("specv", "xvals")
 
-	coeffv = [np.average(datav / specv)]
-
-	# Fit Data
-	if not eval:
-		return np.median(datav / specv, boxcarhw * 2 + 1)
-
-	# Evaluate
-	if np.count_nonzero == 0:
-		return np.zeros(nx)
-
-	gv = specv.nonzero()
-
-	goodx = xvals[gv]
-
-	estg = smooth(datav[gv] / specv[gv], boxcarhw * 2 + 1)
-	fiteval = np.zeros(nx)
-	bv = np.where(specv == 0)[0]
-	if len(bv) != 0:
-		badx = xvals[bv]
-		estb_func = interpol(goodx, estg, kind='linear')
-		estb = estb_func(badx)
-		fiteval[badx] = estb
-
-	fiteval[goodx] = estg
-
-	return fiteval
\ No newline at end of file
+	est, coeffb = boxcarfunc_batch(xvals, np.atleast_2d(datav), np.atleast_2d(varv), np.atleast_2d(specv),
+	                               np.ones((1, nx), bool), eval, None, boxcarhw)
+	return est[0], coeffb[0]
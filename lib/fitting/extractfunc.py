@@ -0,0 +1,105 @@
+"""
+Name:
+	extractfunc.py
+
+Purpose:
+	A function which extracts the optimal spectrum from a vector.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Vector fitting functions
+
+Calling Example:
+	est, coeffv = extractfunc(xvals, datav, varv, profv, eval, coeffv, parm)
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.excep import *
+
+
+def extractfunc(xvals, datav, varv, profv, eval, coeffv, parm):
+	"""
+	Inputs:
+		xvals:  The x values for the data (not used)
+		datav:  The sky subtracted data vector
+		varv:   The variance vector
+		profv:  The profile vector. 0 at bad pixel locations.
+		eval:   (Not used, the spectrum is always extracted)
+		coeffv: (Not used)
+		parm:   (Not used)
+
+	Outputs:
+		The optimal spectrum repeated at every pixel, so procvect can compare it
+		to the data through the profile, and coeffv holding [optimal spectrum,
+		variance of the optimal spectrum].
+
+	Restrictions:
+		All vectors must be the same length.
+	"""
+	# Check Inputs
+
+	nx = len(datav)
+
+	if nx != len(profv):
+		raise VectorLengthException("datav", "profv")
+	if nx != len(varv):
+		raise VectorLengthException("datav", "varv")
+
+	# Always Extract
+
+	# A vector without profile is extracted as 0, and counted by extrspec
+	gl = np.where(profv != 0)[0]
+	if len(gl) == 0:
+		return np.zeros(nx), [0., 0.]
+
+	denom = np.sum((profv[gl] * profv[gl]) / varv[gl], dtype=np.double)  # avoid recalc
+	opt = np.sum((profv[gl] * datav[gl]) / varv[gl], dtype=np.double) / denom
+	opvar = np.sum(profv[gl], dtype=np.double) / denom
+
+	return np.zeros(nx) + opt, [opt, opvar]
+
+
+def extractfunc_batch(xvals, datab, varb, profb, maskb, eval, coeffb, parm):
+	"""
+	Block form of extractfunc, for procblock. Extracts every row of a block at
+	once with the Horne weighted sums sum(P*D/V) / sum(P^2/V) taken over the
+	pixels that are in maskb and have a non-zero profile.
+
+	Inputs:
+		xvals:  The x values for the data (not used)
+		datab:  The sky subtracted data block, dimension (nvect, nx)
+		varb:   The variance block
+		profb:  The profile block. 0 at bad pixel locations.
+		maskb:  Boolean block of the pixels to extract from
+		eval:   (Not used, the spectrum is always extracted)
+		coeffb: (Not used)
+		parm:   (Not used)
+
+	Outputs:
+		The optimal spectrum of each row repeated across the row, and coeffb
+		of dimension (nvect, 2) holding the optimal spectrum and its variance.
+		Rows without good pixels return 0s.
+	"""
+	# Check Inputs
+
+	if np.shape(profb) != np.shape(datab):
+		raise VectorLengthException("datab", "profb")
+	if np.shape(varb) != np.shape(datab):
+		raise VectorLengthException("datab", "varb")
+
+	# Always Extract
+
+	gl = maskb & (profb != 0)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		weight = np.where(gl, profb / varb, 0.)
+		denom = np.sum(weight * profb, 1, dtype=np.double)
+		opt = np.sum(weight * datab, 1, dtype=np.double) / denom
+		opvar = np.sum(np.where(gl, profb, 0.), 1, dtype=np.double) / denom
+
+	empty = ~np.any(gl, 1)
+	opt[empty] = 0.
+	opvar[empty] = 0.
+
+	return np.zeros(np.shape(datab)) + opt[:, None], np.stack((opt, opvar), 1)
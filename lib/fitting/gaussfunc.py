@@ -1,25 +1,27 @@
 """
-Name: 
+Name:
 	gaussfunc.py
 
-Purpose: 
+Purpose:
 	Function for estimating a Gaussian curve to the data
 
-Category: 
+Category:
 	Vector Fitting Functions
 
 Calling Example:
-	result = gaussfunc(xvals, datav, varv, specv, coeff, reest)
-	
+	est, coeffv = gaussfunc(xvals, datav, varv, specv, eval, coeffv, reest)
+	est, coeffb = gaussfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, reest)
+	specb = newton_cotes_batch(xvals, datab, maskb)
+	coeffb, status = gaussfit_batch(xvals, datab, weightb, coeffb)
+
 Created on 10/5/2021$
 """
 
 from lib.excep import *
 import numpy as np
 from numpy import exp
-from scipy.ndimage.filters import uniform_filter1d as smooth
+from scipy.ndimage import uniform_filter1d as smooth, median_filter
 from scipy.interpolate import CubicSpline
-from scipy.optimize import curve_fit, OptimizeWarning
 
 def newton_cotes(xvals, datav):
 
@@ -28,7 +30,7 @@ def newton_cotes(xvals, datav):
 	Purpose: Implementation of Newton-Cotes integration using Boole's rule.
 
 	:param xvals: xvals of data vector
-	:param datav: data vector
+	:param datav: data vector, or a block of them sharing xvals along the last axis
 	:return:
 	"""
 
@@ -42,33 +44,53 @@ def newton_cotes(xvals, datav):
 
 		return bl
 
-	# check for sorted array
-	if not all(xvals[i] <= xvals[i + 1] for i in range(len(xvals) - 1)):
+	xvals = np.asarray(xvals, np.double)
+	datav = np.asarray(datav, np.double)
 
-		zipped_lists = zip(xvals, datav)
-		sort_pairs = sorted(zipped_lists)
-		tups = zip(*sort_pairs)
-		xvals, datav = [list(tup) for tup in tups]
+	# check for sorted array
+	if np.any(np.diff(xvals) < 0):
+		order = np.argsort(xvals, kind="stable")
+		xvals = xvals[order]
+		datav = datav[..., order]
 
-	# Divide the xvals into 5 equally spaced points
+	# Divide the xvals into equally spaced segments, a multiple of 4 of them
+	# and at least as many as the data has, as int_tabulated does
 
-	a = min(xvals)
-	b = max(xvals)
-	h = (b - a) / 4
+	a = xvals[0]
+	b = xvals[-1]
+	nseg = 4 * max(int(np.ceil((len(xvals) - 1) / 4.)), 1)
+	h = (b - a) / nseg
 
-	xvals_new = [a, a + h, a + 2 * h, a + 3 * h, b]
-	print(xvals_new)
+	xvals_new = a + h * np.arange(nseg + 1)
 
 	# Use cubic spline interpolation to calculate datav points at those values
-	f = CubicSpline(xvals, datav)
+	f = CubicSpline(xvals, datav, axis=-1)
 	datav_new = f(xvals_new)
-	print(datav_new)
 
-	# Perform Boole's Rule
-	bl = booles_rule(datav_new, h)
+	# Perform Boole's Rule on each group of 4 segments
+	groups = [datav_new[..., i:nseg - 3 + i:4] for i in range(4)] + [datav_new[..., 4::4]]
+	bl = np.sum(booles_rule(groups, h), -1)
 
 	return bl
 
+def newton_cotes_batch(xvals, datab, maskb):
+
+	"""
+	Name: newton_cotes_batch
+	Purpose: The newton_cotes integral of each row of datab over its good
+	pixels. Rows with the same mask are integrated together.
+	"""
+
+	maskb = np.asarray(maskb, bool)
+	masks, group = np.unique(maskb, axis=0, return_inverse=True)
+	group = np.ravel(group)
+	total = np.zeros(len(datab))
+	for g, m in enumerate(masks):
+		rows = np.flatnonzero(group == g)
+		if np.sum(m) > 1:
+			total[rows] = newton_cotes(xvals[m], datab[rows][:, m])
+	return total
+
 def simple_gauss(x,a):
 
 	z = (x - a[1]) / a[2]
@@ -78,41 +100,267 @@ def simple_gauss(x,a):
 	return f
 
 def gausseval(x,a, p=None):
-	
+
 	"""
 	Name: gausseval
 	Purpose: Small helper function for evaluating a Gaussian.
+
+	a may hold one set of coefficients [height, center, width] or a block of
+	them, dimension (nvect, 3), evaluated at the same x. With p set the
+	partial derivatives with respect to each coefficient are returned too,
+	with a last axis of length 3.
 	"""
 
-	z = (x - a[1]) / a[2]
+	a = np.asarray(a, np.double)
+	z = (x - a[..., 1, None]) / a[..., 2, None]
 
-	f = a[0] * exp(-z ** 2 / 2)
+	g = exp(-z ** 2 / 2)
+	f = a[..., 0, None] * g
 
-	if not p:
+	if p is None or p is False:
 		return f
 	else:
-		p = np.zeros((len(x), 3))
-		# 
-		p[:, 0] = f / a[0]
-		p[:, 1] = f * z / a[2]
-		p[:, 2] = p[:, 1] * z
+		p = np.zeros(np.shape(f) + (3,))
+		#
+		p[..., 0] = g
+		p[..., 1] = f * z / a[..., 2, None]
+		p[..., 2] = p[..., 1] * z
 
 	return f, p
 
-def gaussfunc(xvals, datav, varv, specv, coeff, reest, eval=False):
-	
+def gauss_estimate_batch(xvals, datab, maskb):
+
+	"""
+	Name: gauss_estimate_batch
+	Purpose: Starting coefficients [height, center, fwhm/2] for the Gaussian
+	of each row of datab, estimated as gaussfunc always has: the extreme of
+	the smoothed data is the center, the data there the height, and the
+	pixels above height/e give the width. Masked pixels are left out.
+	"""
+
+	datab = np.where(maskb, datab, 0.)
+	nvect, nx = np.shape(datab)
+	rows = np.arange(nvect)
+
+	hbw = max(min(4, nx // 2 - 1), 0)  # half box width for estimation
+	sdata = smooth(datab, 2 * hbw + 1, axis=1, mode="nearest")  # estimate gauss
+	chi = np.argmax(sdata, 1)
+	cli = np.argmin(sdata, 1)
+	ci = np.where(abs(sdata[rows, chi]) > abs(sdata[rows, cli]), chi, cli)
+
+	hi = np.maximum(datab, sdata)[rows, ci]  # estimated gaussian height
+	center = xvals[ci]  # estimated gaussian center
+	top = maskb & (abs(datab) > abs(hi / exp(1))[:, None])
+	with np.errstate(invalid="ignore"):
+		xtop = np.where(top, xvals, np.nan)
+		fwhm = np.where(np.any(top, 1), np.nanmax(xtop, 1) - np.nanmin(xtop, 1) + 1, 1.)  # estimated gaussian FWHM
+
+	return np.stack([hi, center, fwhm / 2], 1)
+
+def gaussfit_batch(xvals, datab, weightb, coeffb, itmax=10, tol=1e-6):
+
+	"""
+	Name: gaussfit_batch
+	Purpose: Weighted least squares fits of a Gaussian to every row of a
+	block of vectors at once, by Levenberg-Marquardt iteration with the
+	analytic partial derivatives of gausseval.
+
+	Inputs:
+		xvals:   the x values shared by every row, length nx
+		datab:   the data block to fit, dimension (nvect, nx)
+		weightb: the weight of each pixel, 0 to leave it out
+		coeffb:  the starting coefficients of each row, dimension (nvect, 3)
+		itmax:   the most iterations to take (default 10, as curvefit in the
+				 IDL gaussfunc)
+		tol:     the relative decrease in chi squared at which a row has
+				 converged (default 1e-6)
+
+	Outputs:
+		coeffb: the fitted coefficients of each row
+		status: 0 for the rows that converged, 1 for those that did not in
+				itmax iterations and 2 for those whose fit broke down
+	"""
+
+	xvals = np.asarray(xvals, np.double)
+	datab = np.atleast_2d(datab)
+	weightb = np.atleast_2d(weightb)
+	coeffb = np.array(coeffb, np.double).reshape(-1, 3)
+	nvect = len(datab)
+
+	with np.errstate(all="ignore"):
+		f, pder = gausseval(xvals, coeffb, True)
+		chisq = np.sum(weightb * (datab - f) ** 2, 1)
+
+		lam = np.full(nvect, 1e-3)
+		status = np.ones(nvect, int)
+		status[~np.isfinite(chisq)] = 2
+		rows = np.flatnonzero(status == 1)
+
+		for it in range(itmax):
+			if len(rows) == 0:
+				break
+
+			# Normal equations of every active row, from the analytic partials
+			wpder = pder[rows] * weightb[rows, :, None]
+			alpha = np.swapaxes(wpder, 1, 2) @ pder[rows]
+			beta = (np.swapaxes(wpder, 1, 2) @ (datab[rows] - f[rows])[:, :, None])[:, :, 0]
+
+			diag = np.diagonal(alpha, axis1=1, axis2=2)
+			curv = alpha + (lam[rows, None] * diag)[:, :, None] * np.identity(3)
+			try:
+				step = np.linalg.solve(curv, beta[:, :, None])[:, :, 0]
+			except np.linalg.LinAlgError:
+				step = (np.linalg.pinv(curv) @ beta[:, :, None])[:, :, 0]
+
+			trial = coeffb[rows] + step
+			ftrial, ptrial = gausseval(xvals, trial, True)
+			chitrial = np.sum(weightb[rows] * (datab[rows] - ftrial) ** 2, 1)
+
+			better = np.isfinite(chitrial) & (chitrial <= chisq[rows])
+			done = better & (chisq[rows] - chitrial <= tol * chitrial)
+
+			take = rows[better]
+			coeffb[take] = trial[better]
+			f[take] = ftrial[better]
+			pder[take] = ptrial[better]
+			chisq[take] = chitrial[better]
+			lam[take] /= 10.
+			lam[rows[~better]] *= 10.
+
+			status[rows[done]] = 0
+			status[rows[~np.all(np.isfinite(step), 1)]] = 2
+			rows = rows[status[rows] == 1]
+
+	status[(status == 0) & ~((coeffb[:, 2] != 0) & np.all(np.isfinite(coeffb), 1))] = 2
+
+	return coeffb, status
+
+# Every NEIGHBOUR_STRIDE-th row without coefficients of its own is fitted
+# first, and the rest start from the solution of the nearest of them
+NEIGHBOUR_STRIDE = 8
+
+def _neighbour_starts(coeffb, ok):
+	# The coefficients of the nearest row that fitted, for each row
+	good = np.flatnonzero(ok)
+	pos = np.clip(np.searchsorted(good, np.arange(len(ok))), 1, len(good) - 1) if len(good) > 1 else 0
+	if len(good) > 1:
+		below = good[pos - 1]
+		above = good[pos]
+		nearest = np.where(np.arange(len(ok)) - below <= above - np.arange(len(ok)), below, above)
+	else:
+		nearest = np.zeros(len(ok), int) + good[0]
+	return coeffb[nearest]
+
+def _better_starts(xvals, datab, weightb, starts, others):
+	# For each row, whichever of starts and others fits datab better
+	with np.errstate(all="ignore"):
+		chis = np.sum(weightb * (datab - gausseval(xvals, starts)) ** 2, 1)
+		chio = np.sum(weightb * (datab - gausseval(xvals, others)) ** 2, 1)
+	return np.where(((chio < chis) | ~np.isfinite(chis))[:, None], others, starts)
+
+def gaussfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, reest):
+
+	"""
+	Inputs:
+		xvals:  The x values shared by every row, length nx
+		datab:  The block of vectors to fit, dimension (nvect, nx)
+		varb:   The variance block, pixels not to fit have a 0.
+		specb:  The spectrum at each point, broadcastable against datab.
+		maskb:  Boolean block, True for the pixels each row may fit.
+		eval:   Do not fit, instead, evaluate based on provided coeffb.
+		coeffb: The coefficients of each row from a previous fit, used to
+				start the fit from when they are valid, dimension (nvect, 3)
+		reest:  Set to reestimate the spectrum after bad pixel rejection.
+	Outputs:
+		The estimate of each row by a fitted Gaussian, and the fitted
+		coefficients. Of the rows without valid coefficients to start from,
+		every NEIGHBOUR_STRIDE-th is fitted first from its estimate, as in
+		gaussfunc. The others start from the solution of the nearest of those
+		rows, or from their own estimate where it fits them better. Rows
+		whose fit does not converge are fitted again from the solution of
+		the nearest row that did, and failing that, to the median smoothed
+		data, as gaussfunc does.
+	"""
+	xvals = np.asarray(xvals, np.double)
+	datab = np.atleast_2d(datab)
+	nvect, nx = np.shape(datab)
+
+	if nx != len(xvals):
+		raise VectorLengthException("xvals", "datab")
+	if np.shape(varb) != np.shape(datab):
+		raise VectorLengthException("varb", "datab")
+	if nx <= 4:
+		raise ParameterException("datab has less than 4 elements per row.")
+
+	# Evaluate Coefficients
+	if eval:
+		return gausseval(xvals, coeffb), coeffb
+
+	specb = np.broadcast_to(specb, (nvect, nx))
+	maskb = np.broadcast_to(maskb, (nvect, nx))
+	if reest:
+		specb = np.broadcast_to(newton_cotes_batch(xvals, datab, maskb)[:, None], (nvect, nx))  # reestimate spectrum
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		datas = datab / specb
+		weightb = np.where(maskb & (varb != 0), np.maximum(specb ** 2 / varb, 1e-8), 0.)
+	fitdata = np.where(weightb != 0, datas, 0.)
+
+	# Start from the previous coefficients where they are usable
+	estimate = gauss_estimate_batch(xvals, fitdata, weightb != 0)
+	start = estimate
+	usable = np.zeros(nvect, bool)
+	if np.shape(coeffb) == (nvect, 3):
+		usable = np.all(np.isfinite(coeffb), 1) & (coeffb[:, 0] != 0) & (coeffb[:, 2] != 0)
+		start = np.where(usable[:, None], coeffb, estimate)
+
+	# Fit those and every NEIGHBOUR_STRIDE-th of the other rows, then start
+	# the rest from their nearest neighbour's solution
+	lead = usable | (np.arange(nvect) % NEIGHBOUR_STRIDE == 0)
+	coeffb = np.array(start)
+	status = np.zeros(nvect, int)
+	coeffb[lead], status[lead] = gaussfit_batch(xvals, fitdata[lead], weightb[lead], start[lead])
+	rest = ~lead
+	if np.any(rest):
+		if np.any(lead & (status == 0)):
+			start[rest] = _better_starts(xvals, fitdata[rest], weightb[rest], estimate[rest],
+			                             _neighbour_starts(coeffb, lead & (status == 0))[rest])
+		coeffb[rest], status[rest] = gaussfit_batch(xvals, fitdata[rest], weightb[rest], start[rest])
+
+	failed = status != 0
+	if np.any(failed) and not np.all(failed):
+		retry, rstatus = gaussfit_batch(xvals, fitdata[failed], weightb[failed],
+		                                _neighbour_starts(coeffb, ~failed)[failed])
+		coeffb[failed] = np.where((rstatus == 0)[:, None], retry, coeffb[failed])
+		failed[np.flatnonzero(failed)[rstatus == 0]] = False
+
+	if np.any(failed):  # estimation wrong so use median instead
+		hbw = max(min(4, nx // 2 - 1), 0)
+		mdata = median_filter(fitdata[failed], size=(1, 2 * hbw + 1), mode="nearest")
+		retry, rstatus = gaussfit_batch(xvals, mdata, weightb[failed], estimate[failed])
+		coeffb[failed] = retry
+
+	est = np.where(varb != 0, gausseval(xvals, coeffb), datas)
+
+	return est, coeffb
+
+def gaussfunc(xvals, datav, varv, specv, eval, coeffv, reest):
+
 	"""
 	Inputs:
 		xvals: The x values for the data.
 		datav: The vector with cosmic rays to be fitted.
 		varv: The variance vector, pixels not to fit have a 0.
 		specv: The spectrum at that point, bad pixels have a 0.
-		coeff: Will contain the coefficients of the fit. 
+		eval: Do not fit, instead, evaluate based on provided coeffv.
+		coeffv: Will contain the coefficients of the fit. Coefficients from a
+			previous fit of the vector, as procvect passes on each pass, are
+			the starting point of the fit.
 		reest: Set to reestimate the spectrum after bad pixel rejection.
-		eval: Do not fit, instead, evaluate based on provided coeff.
 	Outputs:
-		An estimation of the data by fitting a Gaussian. If a good fit is not found quickly 
-		to the data, the Gaussian is fitted to the data smoothed instead.
+		An estimation of the data by fitting a Gaussian, and its coefficients
+		[height, center, width]. If a good fit is not found quickly to the
+		data, the Gaussian is fitted to the data smoothed instead.
 		If eval is set it simply evaluates the Gaussian coefficients passed in at all points.
 	"""
 	# Check Inputs
@@ -122,54 +370,19 @@ def gaussfunc(xvals, datav, varv, specv, coeff, reest, eval=False):
 		raise VectorLengthException("x_vals", "data_v")
 	if nx != len(varv):
 		raise VectorLengthException("x_vals", "var_v")
-	if nx != len(specv) and len(specv) != 1:
+	if nx != np.size(specv) and np.size(specv) != 1:
 		raise VectorLengthException("x_vals", "spec_v")
 	if nx <= 4:
 		raise ParameterException("data_v has less than 4 elements.")
-	
+
 	# Evaluate Coefficients
 	if eval:
-		f = gausseval(xvals, coeff)
-		return f
-	
-	# Prepare Fitting
-	if reest:
-		specv = newton_cotes(xvals, datav)  # reestimate spectrum
-
-	hbw = 4 < nx / 2 - 1  # half box width for estimation
-	sdata = smooth(datav / specv, 2 * hbw + 1)  # estimate gauss
-	shi = max(sdata)
-	chi = np.argmax(sdata)
-	slo = min(sdata)
-	cli = np.argmin(sdata)
-
-	if abs(shi) > abs(slo):
-		ci = chi
-	else:
-		ci = cli
-
-	hi = (datav / specv > sdata)[chi]  # estimated gaussian height
-	center = xvals[ci]  # estimated gaussian center
-	top = np.where(abs(datav / specv) > abs(hi / exp(1)))[0]
-	fwhm = max(xvals[top]) - min(xvals[top]) + 1  # estimated gaussian FWHM
-	base = np.median(sdata)  # estimated base level
-
-	coeff = [hi, center, fwhm / 2]  # coefficients for estimate
-
-	nz = np.where(varv != 0)[0]  # locations to fit
-
-	est = datav / specv
-	origcoeff = coeff
-
+		f = gausseval(np.asarray(xvals, np.double), coeffv)
+		return f, coeffv
 
-	try:
-		parameters, covariance = curve_fit(simple_gauss, xvals[nz], datav[nz], coeff)
-		for i in nz:
-			est[i] = gausseval(i, parameters)
-	except OptimizeWarning:
-		mdata = np.median(datav/specv, 2*hbw+1)
-		parameters, covariance = curve_fit(simple_gauss, xvals[nz], datav[nz], coeff)
-		for i in nz:
-			est[i] = gausseval(i, parameters)
+	# Fit Data, as a block of one vector
+	coeffb = np.reshape(coeffv, (1, 3)) if np.size(coeffv) == 3 else None
+	est, coeffb = gaussfunc_batch(xvals, np.reshape(datav, (1, nx)), np.reshape(varv, (1, nx)),
+	                              np.reshape(specv, (1, -1)), True, False, coeffb, reest)
 
-	return est, coeff
\ No newline at end of file
+	return est[0], coeffb[0]
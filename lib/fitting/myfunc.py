@@ -1,21 +1,63 @@
 """
 Name:
+	myfunc.py
 
 Purpose:
+	A template for a user-defined fitting function. procvect(func="myfunc")
+	and procblock(func="myfunc") find myfunc, and myfunc_batch if it is
+	defined, through the fitting registry. This one fits the weighted mean
+	of each vector. Without myfunc_batch, procblock would call myfunc row
+	by row.
 
 Category:
+	Optimal Spectrum Extraction Package
+		- Vector fitting functions
 
 Calling Example:
-
-Inputs:
-
-Outputs:
-
-History:
+	est, coeffv = myfunc(xvals, datav, varv, specv, eval, coeffv, parm)
+	est, coeffb = myfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, parm)
 
 Created on 9/19/2021$
 """
 
-
-def myfunc(foo, bar):
-	print("myfunc", foo, bar)
+import numpy as np
+from lib.excep import *
+
+
+def myfunc(xvals, datav, varv, specv, eval, coeffv, parm):
+	"""
+	Inputs:
+		xvals:  indices of the datav
+		datav:  the data vector to fit, must be the same size as xvals
+		varv:   the variance vector
+		specv:  the spectrum vector. 0 at bad pixel locations when evaluating.
+		eval:   set to evaluate coeffv instead of fitting
+		coeffv: the weighted mean, when evaluating
+		parm:   (Not used)
+
+	Outputs:
+		The estimate of datav / specv at every pixel, and coeffv holding the
+		weighted mean.
+	"""
+	est, coeffb = myfunc_batch(xvals, np.atleast_2d(datav), np.atleast_2d(varv), np.atleast_2d(specv),
+	                           np.ones((1, len(xvals)), bool), eval, np.atleast_2d(coeffv), parm)
+	return est[0], coeffb[0]
+
+
+def myfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, parm):
+	"""
+	Block form of myfunc, fitting every row of datab, dimension (nvect, nx),
+	over the pixels of maskb at once.
+	"""
+	if np.shape(datab)[-1] != len(xvals):
+		raise VectorLengthException("datab", "xvals")
+
+	if eval:
+		return np.zeros(np.shape(datab)) + np.asarray(coeffb)[:, :1], coeffb
+
+	good = maskb & (specb != 0) & (varb > 0)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		weight = np.where(good, specb * specb / varb, 0.)
+		mean = np.sum(weight * np.where(good, datab / specb, 0.), 1) / np.sum(weight, 1)
+	mean = np.where(np.any(good, 1), mean, 0.)
+	return np.zeros(np.shape(datab)) + mean[:, None], mean[:, None]
@@ -18,8 +18,150 @@ Created on 9/19/2021$
 
 import numpy as np
 from numpy.polynomial import polynomial as poly
+from math import comb
+from collections import OrderedDict
+from functools import cached_property
 from lib.excep import *
 
+# Number of (x grid, degree) solvers kept by poly_solver
+SOLVER_CACHE_SIZE = 32
+_solvers = OrderedDict()
+
+
+class PolySolver:
+	"""
+	Name:
+		PolySolver
+
+	Purpose:
+		Least squares polynomial fits of a fixed degree on a fixed x grid. The
+		design matrix is built once, so a fully weighted vector is fitted with
+		one product against its pseudo-inverse. The normal equations of a
+		vector with masked or down-weighted pixels are one product of its
+		weights with the outer products of the design matrix rows, rather
+		than a new design matrix and factorization. Both are made on first
+		use, as most grids procvect fits are used once.
+
+	Calling Example:
+		solver = poly_solver(xvals, deg)
+		coeffb = solver.fit(datab, weightb)
+
+	Procedure:
+		The x values are mapped onto [-1, 1] to keep the normal equations well
+		conditioned, and the coefficients are mapped back to x. A fit depends
+		only on its grid, never on which solvers are cached.
+	"""
+
+	def __init__(self, xvals, deg):
+		self.grid = np.array(xvals, np.double)
+		self.deg = deg
+		self.nx = len(self.grid)
+		self.ncoeff = ncoeff = deg + 1
+
+		off = (self.grid.max() + self.grid.min()) / 2.
+		scl = (self.grid.max() - self.grid.min()) / 2.
+		if scl == 0:
+			scl = 1.
+		# The design matrix, built by powers as polyvander does
+		t = (self.grid - off) / scl
+		self.vander = np.empty((self.nx, ncoeff))
+		self.vander[:, 0] = 1.
+		for k in range(1, ncoeff):
+			self.vander[:, k] = self.vander[:, k - 1] * t
+
+		# Map coefficients in t = (x - off) / scl back to coefficients in x
+		self.trans = np.zeros((ncoeff, ncoeff))
+		for k in range(ncoeff):
+			for j in range(k + 1):
+				self.trans[j, k] = comb(k, j) * (-off) ** (k - j) / scl ** k
+
+	@cached_property
+	def outer(self):
+		# The outer product of each pixel's row of the design matrix, so the
+		# normal matrix of any weighting is one product with the weights
+		return (self.vander[:, :, None] * self.vander[:, None, :]).reshape(self.nx, self.ncoeff ** 2)
+
+	@cached_property
+	def pinvt(self):
+		# Pseudo-inverse of the full grid, transposed: coefft = datav @ pinvt,
+		# from the normal equations of the scaled grid
+		if self.nx < self.ncoeff:
+			return None
+		try:
+			return self.vander @ np.linalg.inv(self.vander.T @ self.vander)
+		except np.linalg.LinAlgError:
+			return np.linalg.pinv(self.vander).T
+
+	def fit(self, datab, weightb=None):
+		"""
+		Fits every row of datab, dimension (nvect, nx) or (nx), with the pixel
+		weights weightb of the same shape (default 1). A weight of 0 removes a
+		pixel. Returns the x coefficients of each row, dimension
+		(nvect, deg + 1), lowest order first. Rows without enough weighted
+		pixels to constrain the fit return 0s. The data are fitted in double.
+		"""
+		datab = np.atleast_2d(np.asarray(datab, np.double))
+		ncoeff = self.ncoeff
+		coefft = np.zeros((len(datab), ncoeff))
+
+		if weightb is None:
+			full = np.ones(len(datab), bool)
+		else:
+			weightb = np.atleast_2d(weightb).astype(np.double)
+			full = np.all(weightb == 1, 1)
+		if self.pinvt is None:
+			full[:] = False
+
+		# Products are stacked one row each, so a row's result does not depend
+		# on how many rows are fitted alongside it
+		if np.any(full):
+			coefft[full] = (datab[full][:, None, :] @ self.pinvt)[:, 0, :]
+
+		part = ~full
+		if np.any(part):
+			weights = weightb[part] if weightb is not None else np.ones((np.sum(part), self.nx))
+			alpha = (weights[:, None, :] @ self.outer).reshape(-1, ncoeff, ncoeff)
+			beta = ((weights * datab[part])[:, None, :] @ self.vander)[:, 0, :]
+
+			# Rows that cannot constrain the fit are solved as identity, giving 0s
+			singular = np.count_nonzero(weights, 1) < ncoeff
+			alpha[singular] = np.identity(ncoeff)
+			beta[singular] = 0.
+			coefft[part] = np.linalg.solve(alpha, beta[:, :, None])[:, :, 0]
+
+		return coefft @ self.trans.T
+
+	def fit_vector(self, datav):
+		"""
+		Fits a single vector datav over the whole grid with the precomputed
+		pseudo-inverse. Returns the x coefficients.
+		"""
+		if self.pinvt is None:
+			return np.zeros(self.ncoeff)
+		return (np.asarray(datav, np.double) @ self.pinvt) @ self.trans.T
+
+
+def poly_solver(xvals, deg):
+	"""
+	Returns the PolySolver for the x grid xvals and degree deg, building it on
+	first use. The SOLVER_CACHE_SIZE most recently used solvers are kept.
+	"""
+	xvals = np.ascontiguousarray(xvals, np.double)
+	key = (deg, xvals.tobytes())
+	solver = _solvers.get(key)
+	if solver is None:
+		solver = PolySolver(xvals, deg)
+		_solvers[key] = solver
+		while len(_solvers) > SOLVER_CACHE_SIZE:
+			_solvers.popitem(last=False)
+	else:
+		_solvers.move_to_end(key)
+	return solver
+
+
+def clear_solver_cache():
+	_solvers.clear()
+
 
 def polyeval(coeffs, xvals):
 	# TODO DOCS: polyeval
@@ -129,13 +271,140 @@ def polyfunc(xvals, datav, varv, specv, eval, coeffv, deg):
 			est[nz] = mn
 			coeffv = [mn, 0]  # correct for right length
 		else:
-			merrors = varv / specv ** 2 > 1E-8  # use all errors for estimation
-			if deg == 1:
-				coeffv = poly.polyfit(xvals, datav / specv, 1)
-				estz = poly.polyval(xvals, coeffv)
-			else:
-				coeffv = poly.polyfit(xvals, datav / specv, deg)
-				estz = poly.polyval(xvals, coeffv)
+			# Reuse the factored design matrix of these xvals
+			coeffv = poly_solver(xvals, deg).fit_vector(datav / specv)
+			estz = poly.polyval(xvals, coeffv)
 			est[nz] = estz[nz]
 
 	return est, coeffv
+
+
+def polyfit_batch(xvals, datab, weightb, deg):
+	"""
+	Name:
+		polyfit_batch
+
+	Purpose:
+		Fits a polynomial of the same degree to every row of a block of
+		vectors sharing one set of x values, in a single weighted least
+		squares solve.
+
+	Calling Example:
+		coeffb = polyfit_batch(xvals, datab, weightb, deg)
+
+	Inputs:
+		xvals:   the x values shared by every row, length nx
+		datab:   the data block to fit, dimension (nvect, nx)
+		weightb: the weight of each pixel, dimension (nvect, nx). A weight of
+				 0 removes the pixel from the fit, so a 0/1 mask may be passed.
+		deg:     the degree of fit
+
+	Outputs:
+		Returns an array of dimension (nvect, deg + 1) holding the polynomial
+		coefficients of each row, lowest order first, as from poly.polyfit.
+		Rows without enough weighted pixels to constrain the fit return 0s.
+
+	Procedure:
+		The fit is done by the cached PolySolver of xvals and deg, so the
+		Vandermonde matrix of a grid is built and factored once. Rows with
+		every weight 1 are fitted with one product against its pseudo-inverse.
+		The normal equations of the other rows are updated for their weights
+		and solved together.
+	"""
+
+	xvals = np.asarray(xvals, np.double)
+	datab = np.atleast_2d(datab)
+	weightb = np.atleast_2d(weightb).astype(np.double)
+	nx = len(xvals)
+
+	if np.shape(datab)[1] != nx:
+		raise VectorLengthException("datab", "xvals")
+	if np.shape(weightb) != np.shape(datab):
+		raise VectorLengthException("weightb", "datab")
+	if deg < 0:
+		raise ParameterException("Degree cannot be < 0.")
+
+	return poly_solver(xvals, deg).fit(datab, weightb)
+
+
+def polyeval_batch(coeffb, xvals):
+	"""
+	Name:
+		polyeval_batch
+
+	Purpose:
+		Evaluates a block of polynomial coefficients, one set per row, at a
+		shared set of x values.
+
+	Calling Example:
+		result = polyeval_batch(coeffb, xvals)
+
+	Inputs:
+		coeffb: an array of dimension (nvect, deg + 1) of coefficients
+		xvals:  locations to evaluate, length nx
+
+	Outputs:
+		Returns an array of dimension (nvect, nx)
+	"""
+
+	coeffb = np.atleast_2d(coeffb)
+	vander = poly.polyvander(np.asarray(xvals, np.double), np.shape(coeffb)[-1] - 1)
+
+	# Stacked one row each, as in polyfit_batch, so rows evaluate independently
+	return (coeffb[:, None, :] @ vander.T)[:, 0, :]
+
+
+def polyfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, deg):
+	"""
+	Name:
+		polyfunc_batch
+
+	Purpose:
+		Block form of polyfunc, fitting every row of a block of vectors that
+		share one set of x values at once.
+
+	Calling Example:
+		est, coeffb = polyfunc_batch(xvals, datab, varb, specb, maskb, eval, coeffb, deg)
+
+	Inputs:
+		xvals:  indices of the columns of datab, length nx
+		datab:  the data block to fit, dimension (nvect, nx)
+		varb:   the variance block
+		specb:  the spectrum block, broadcastable against datab
+		maskb:  boolean block, True for the pixels each row may fit
+		eval:   set to evaluate coeffb instead of fitting
+		coeffb: coefficients of each row, dimension (nvect, deg + 1)
+		deg:    the degree of fit
+
+	Outputs:
+		The estimate block and the coefficients of each row, as polyfunc
+		returns for a single vector.
+	"""
+
+	nx = len(xvals)
+
+	if not deg:
+		deg = 2
+
+	if np.shape(datab)[-1] != nx:
+		raise VectorLengthException(nx, np.shape(datab)[-1])
+	if np.shape(varb) != np.shape(datab):
+		raise VectorLengthException(np.shape(varb), np.shape(datab))
+	if deg < 0:
+		raise ParameterException("Degree cannot be < 0.")
+	if nx <= deg:
+		raise ParameterException("Number of xvals must be greater than degree.")
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		datas = datab / specb
+
+	# Evaluate Coefficients, using the actual data at varb 0 locations
+	if eval:
+		fiteval = polyeval_batch(coeffb, xvals)
+		return np.where(varb == 0., datas, fiteval), coeffb
+
+	# Fit Data
+	coeffb = polyfit_batch(xvals, np.where(maskb, datas, 0.), maskb, deg)
+	est = np.where(varb != 0., polyeval_batch(coeffb, xvals), datas)
+
+	return est, coeffb
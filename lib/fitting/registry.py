@@ -0,0 +1,122 @@
+"""
+Name:
+	registry.py
+
+Purpose:
+	The registry of vector fitting functions. A fitter is resolved once, by
+	name, and then called through one convention by procvect and procblock:
+
+		est, coeffv = fitter(xvals, datav, varv, specv, eval, coeffv, parm)
+		est, coeffb = fitter.batch(xvals, datab, varb, specb, maskb, eval, coeffb, parm)
+
+	batch fits a block of stacked vectors at once. It calls the fitter's
+	fit_batch when it has one, and otherwise loops over the vectors with the
+	per-vector function, so that every fitter works with procblock.
+
+	A fitter not yet registered is looked up as <name> in the module
+	lib.fitting.<name>, with <name>_batch in the same module as its fit_batch
+	if it is defined there. A user-defined fitter opts into batching by
+	defining <name>_batch next to it (see myfunc.py), or by registering both
+	functions under any name with register_fitter.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Vector fitting functions
+
+Calling Example:
+	fitter = get_fitter("polyfunc")
+	est, coeffb = fitter.batch(xvals, datab, varb, specb, maskb, False, coeffb, 2)
+
+	register_fitter("linefit", linefit, linefit_batch)
+	procblock(datab, func="linefit", ...)
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from importlib import import_module
+from lib.excep import *
+
+_fitters = {}
+
+
+class Fitter:
+	def __init__(self, name, fit, fit_batch=None):
+		self.name = name
+		self.fit = fit
+		self.fit_batch = fit_batch
+
+	def __repr__(self):
+		return "Fitter(%s%s)" % (self.name, ", batched" if self.batched else "")
+
+	@property
+	def batched(self):
+		return self.fit_batch is not None
+
+	def __call__(self, xvals, datav, varv, specv, eval, coeffv, parm):
+		return self.fit(xvals, datav, varv, specv, eval, coeffv, parm)
+
+	def batch(self, xvals, datab, varb, specb, maskb, eval, coeffb, parm):
+		"""
+		Fits (or with eval, evaluates) every row of datab, dimension (nvect,
+		nx), using the pixels of maskb. Returns the estimate block and the
+		coefficients of each row.
+		"""
+		if self.fit_batch is not None:
+			return self.fit_batch(xvals, datab, varb, specb, maskb, eval, coeffb, parm)
+		return self._loop(xvals, datab, varb, specb, maskb, eval, coeffb, parm)
+
+	def _loop(self, xvals, datab, varb, specb, maskb, eval, coeffb, parm):
+		# Fit the rows one at a time, as procvect would: a fit is given only
+		# the good pixels of its row, so the estimate is left 0 elsewhere
+		xvals = np.asarray(xvals)
+		nvect = len(datab)
+		specb = np.broadcast_to(specb, np.shape(datab))
+		maskb = np.broadcast_to(maskb, np.shape(datab))
+		est = np.zeros(np.shape(datab))
+		coeffs = []
+		for i in range(nvect):
+			coeffv = coeffb[i] if coeffb is not None and len(coeffb) == nvect else None
+			if eval:
+				est[i], coeffv = self.fit(xvals, datab[i], varb[i], specb[i], True, coeffv, parm)
+			else:
+				good = maskb[i]
+				est[i, good], coeffv = self.fit(xvals[good], datab[i, good], varb[i, good], specb[i, good],
+				                                False, coeffv, parm)
+			coeffs.append(np.atleast_1d(np.asarray(coeffv if coeffv is not None else 0., np.double)))
+
+		ncoeff = max(len(c) for c in coeffs) if coeffs else 1
+		coeffb = np.zeros((nvect, ncoeff))
+		for i, c in enumerate(coeffs):
+			coeffb[i, :len(c)] = c
+		return est, coeffb
+
+
+def register_fitter(name, fit, fit_batch=None):
+	"""
+	Registers fit, and optionally its block form fit_batch, as the fitter
+	name, replacing any fitter of that name. Returns the Fitter.
+	"""
+	if not callable(fit) or (fit_batch is not None and not callable(fit_batch)):
+		raise ParameterException("A fitter must be callable.")
+	fitter = Fitter(name, fit, fit_batch)
+	_fitters[name] = fitter
+	return fitter
+
+
+def get_fitter(func):
+	"""
+	Returns the Fitter of func, a registered name, the name of a module of
+	lib.fitting, or a Fitter, which is returned as it is.
+	"""
+	if isinstance(func, Fitter):
+		return func
+	fitter = _fitters.get(func)
+	if fitter is None:
+		try:
+			module = import_module("lib.fitting." + func)
+			fit = getattr(module, func)
+		except (ImportError, AttributeError):
+			raise ParameterException("There is no fitting function named " + str(func) + ".")
+		fitter = register_fitter(func, fit, getattr(module, func + "_batch", None))
+	return fitter
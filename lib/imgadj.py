@@ -1,136 +1,147 @@
-#TODO DOCS: imgadj
-
 """
 This module contains functions for the adjustment of profile images.
 
 Created on 5/25/2021$
 """
 import numpy as np
+from lib.excep import *
+from lib.findshift import findshift
+from lib.sampleshift import sampleshift_operator, resample
+from lib.quality import quality_mask
+
+
+def _option(options, name, default=None):
+	# An option of a dict of options, read from the configuration with nulls
+	value = (options or {}).get(name)
+	return default if value is None else value
+
 
-def adjgauss(rc):
-	#TODO DOCS: adjgauss
+def _revert_operator(origx, adjx, level, degcontr):
+	# If there is less than 3 in pixels per output pixel then the polynomials
+	# formed for estimation will be weird. Use splines instead.
+	return sampleshift_operator(adjx, origx, degcontr=degcontr, fitpoly=level > 2, fitspline=level <= 2)
+
+
+def adjgauss(inarray, optinfo, adjparms=None, adjoptions=None, revert=False):
 	"""
 	Standardize the pixel locations for a Gaussian profile image with quickly changing center and/or height.
 
 	Calling Example:
-		result = adjgauss(inarray, optinfo, adj_parms=adj_parms, adj_options=adj_options, revert=revert)
+		outarray = adjgauss(inarray, optinfo, adjparms=adjparms, adjoptions=adjoptions)
+		outarr = adjgauss(inarray, optinfo, adjparms=adjparms, adjoptions=adjoptions, revert=True)
 
 	Inputs:
-
+		inarray:    the images to adjust, dimension (ny, nx, nimage), cut
+					from the columns x1..x2 of the frame as fitprof does
+		optinfo:    a Config of what is known of the frame: dataim, varim,
+					inmask or quality, spec, x1, x2 and verbose
+
+	Keyword Parameters:
+		adjparms:   dict to receive the parameters of the adjustment: origx,
+					adjx, traceest, widthest, mask (of the columns x1..x2
+					after the center estimation) and the compiled
+					resampling operators forward and revert. Reverting
+					requires the adjparms of the adjustment.
+		adjoptions: dict of options (unset or None take the default)
+			level:      the amount to expand the array (7)
+			center:     set to line up the center of each row (1)
+			width:      set to scale each row by its Gaussian width (0)
+			degcontr:   degree of fit when contracting the array (2)
+			centroid, gaussth, shiftth, centerdeg, centerfit, widthth:
+						passed to findshift
+		revert:     set to return the images, in the adjusted geometry, to
+					the original one
 
 	Outputs:
+		The adjusted images, dimension (ny, nx*level, nimage), or with revert
+		the images in the original geometry, dimension (ny, nx, nimage).
+
+		The geometry is found once, by findshift, and compiled into a sparse
+		resampling operator and its approximate inverse, which are kept in
+		adjparms. Every image is then resampled by one sparse product, and
+		reverting reuses the compiled inverse.
 
 	History:
 
 	Created on 4/17/2021$
 	"""
-	#TODO FUNC: adjgauss
-
-	# Initialize and check inputs
-
-	# array sizes
-	nx = np.shape(rc.inarray)[2]
-	ny = np.shape(rc.inarray)[1]
-	nimage = np.shape(rc.inarray)[0]
-
-	#TODO Error checking and option defualts
-
-	# if in ("INMASK", otagn) then inmask = OptInfo.Inmask
-	# if in ("SKYVAR", otagn) then skyvar = OptInfo.Skyvar
-	# if in ("BGIM", otagn) then bgim   = OptInfo.Bgim
-	# if in ("X1", otagn) then X1     = OptInfo.X1
-	# if in ("X2", otagn) then X2     = OptInfo.X2
-	# if in ("SPEC", otagn) then Spec   = OptInfo.Spec
-	#
-	# ; Unpack
-	# Adjustment
-	# Procedure
-	# Options
-	# atagn = keyword_defined(AdjOptions) ? Tag_Names(AdjOptions): [""]
-	# if in ("LEVEL", atagn) then level     = AdjOptions.Level else level  = 7
-	# if in ("CENTER", atagn) then center    = AdjOptions.Center else center = 1
-	# if in ("WIDTH", atagn) then width     = AdjOptions.Width else width  = 0
-	# if in ("CENTROID", atagn) then centroid  = AdjOptions.Centroid
-	# if in ("GAUSSTH", atagn) then gausth    = AdjOptions.Gaussth
-	# if in ("SHIFTTH", atagn) then shiftth   = AdjOptions.Shiftth
-	# if in ("CENTERDEG", atagn) then centerdeg = AdjOptions.Centerdeg
-	# if in ("CENTERFIT", atagn) then centerfit = AdjOptions.Centerfit
-	# if in ("WIDTHTH", atagn) then widthth   = AdjOptions.Widthth
-	# if in ("DEGCONTR", atagn) then degcontr  = AdjOptions.Degcontr
-
-	# ; Check
-	# inputs
-	# if level lt 1 then message, "Level must be greater or equal to 1"
+	inarray = np.asarray(inarray, np.double)
+	if np.ndim(inarray) == 2:
+		inarray = inarray[:, :, None]
+	ny, nx = np.shape(inarray)[:2]
+	if adjparms is None:
+		adjparms = {}
+
+	level = _option(adjoptions, "level", 7)
+	center = _option(adjoptions, "center", 1)
+	width = _option(adjoptions, "width", 0)
+	degcontr = _option(adjoptions, "degcontr", 2)
+
+	if level < 1:
+		raise ParameterException("Level must be greater or equal to 1")
 
 	# Revert To Original Image Specifications
-	# Grab the old geometry's coordinate array and the new coordinate array and
-	# use sample shift to estimate the pixel value at the old geometry using
-	# closest pixels in the new geometry.
-
-	if rc.adjoptions.revert == True:
-		origx = rc.adjparms.origx
-		adjx = rc.adjparms.adjx
-		nxo = np.shape(origx)[2]
-		outarr = np.zeros((nimage, nxo, ny))
-		if rc.adjoptions.level <= 2:
-			fitpoly = False
-			fitspline = True
-		else:
-			fitspline = False
-			fitpoly = True
-		for i in range(nimage):
-			outarr[i, :, :] = sampleshift(inarray[i, :, :], adjx, origx,
-			                              fitpoly, degcontr, fitspline)
-
-		return outarr
+	# Use the inverse of the adjustment, compiled from the old geometry's
+	# coordinate array and the new coordinate array, to estimate the pixel
+	# values at the old geometry using the closest pixels in the new geometry.
+
+	if revert:
+		if adjparms.get("revert") is None:
+			if adjparms.get("origx") is None:
+				raise ParameterException("Reverting requires the adjparms of the adjustment.")
+			adjparms["revert"] = _revert_operator(adjparms["origx"], adjparms["adjx"], level, degcontr)
+		return resample(adjparms["revert"], inarray)
 
 	# FIND THE PROFILE'S CENTER AND WIDTH
 	# Findshift will return the center and width for each row. Center value is the
 	# x value in the data array
-	traceest = findshift(rc)
-
-	if verbose == 5:
-		input("Process stopped at findshift. Press any key to continue.")
+	dataim = optinfo.dataim
+	x1 = optinfo.x1 if optinfo.x1 is not None else 0
+	x2 = optinfo.x2 if optinfo.x2 is not None else np.shape(dataim)[1] - 1
+	cols = np.arange(nx) + (x1 if nx == x2 - x1 + 1 else 0)
+
+	# Findshift only reads the columns x1..x2, so only they are cut out, with
+	# their mask read from the quality plane when there is one
+	cut = slice(x1, x2 + 1)
+	if optinfo.quality is not None:
+		apmask = quality_mask(optinfo.quality[:, cut])
+	elif optinfo.inmask is not None:
+		apmask = optinfo.inmask[:, cut]
+	else:
+		apmask = None
+	tracemask = np.ones((np.shape(dataim)[0], x2 - x1 + 1)) if apmask is None else np.array(apmask, np.double)
+	shiftopts = {name: adjoptions[name] for name in ("centroid", "gaussth", "shiftth", "centerdeg",
+	                                                 "centerfit", "widthth")
+	             if _option(adjoptions, name) is not None}
+	traceest, widthv, height, shmask = findshift(dataim[:, cut],
+	                                             varim=None if optinfo.varim is None else optinfo.varim[:, cut],
+	                                             inmask=apmask, spec=optinfo.spec, tracemask=tracemask,
+	                                             verbose=optinfo.verbose or 0, **shiftopts)
+	traceest = traceest + x1
 
 	# Check and see if the user wants to adjust row by row
-	if not rc.adjoptions.center:
-		traceest = np.zeros(ny) + nx/2
-	if not rc.adjoptions.width:
+	if not center:
+		traceest = np.zeros(ny) + cols[0] + nx // 2
+	if not width:
 		widthv = np.zeros(ny) + np.mean(widthv)
+	widthv = np.where(widthv > 0, widthv, np.median(widthv[widthv > 0]) if np.any(widthv > 0) else 1.)
 
 	# ADJUST THE GEOMETRY OF THE FRAMES
 
 	# Create the coordinate grids
 	nxo = nx * level
-	origx = (np.matmul(np.arange(nx), np.ones(ny)) - np.matmul(np.ones(nx), traceest)) / np.matmul(np.ones(nx), widthv)
-	maxx = max(origx)
-	minx = min(origx)
-	adjx = np.arange(nxo, ny) % nxo / nxo * (maxx-minx) + minx
-
-	#TODO AdjGauss plotting
-
-	# if plottype[1] then begin
-	# device, window_state = ws
-	# if not ws[12] then window, 12 else wset, 12
-	# !p.multi = [0, 1, 2, 1, 1]
-	# origy = findgen(ny)  ## (fltarr(nx) + 1)
-	# adjy = findgen(ny)  ## (fltarr(nxo) + 1)
-	# plot, origy, origx, psym = 3, title = 'Old X coordinates', / ystyle
-	# plot, adjy, adjx, psym = 3, title = 'New X coordinates', / ystyle
-	# !p.multi = 0
-	# wait, 1.5
-	# endif
-
-	# Adjust the images in InArray
-	outarray = np.zeros(nimage, nxo, ny)
-	for i in range(nimage):
-		outarray[1, :, :] = sampleshift(inarray[1,:, :], origx, adjx, fitspline)
+	origx = (cols[None, :] - traceest[:, None]) / widthv[:, None]
+	maxx = np.max(origx)
+	minx = np.min(origx)
+	adjx = np.broadcast_to(np.arange(nxo) / nxo * (maxx - minx) + minx, (ny, nxo))
+
+	# Compile the adjustment and its inverse once, and adjust all the images
+	# in inarray with one product
+	forward = sampleshift_operator(origx, adjx, fitspline=True)
+	outarray = resample(forward, inarray)
 
 	# Pack up parameters of adjustment
-	rc.adjparms.traceest = traceest
-	rc.adjparms.widthest = widthv
-	rc.adjparms.mask = tracemask
+	adjparms.update(origx=origx, adjx=adjx, traceest=traceest, widthest=widthv, mask=tracemask,
+	                forward=forward, revert=_revert_operator(origx, adjx, level, degcontr))
 
 	return outarray
-
-	return
\ No newline at end of file
@@ -7,49 +7,193 @@ Purpose:
 Category:
 
 Calling Example:
+	optspec = optspecextr("config.yaml")
+	optspec, stats = optspecextr("config.yaml", return_stats=True)
+	report = optspecextr_batch("config.yaml", ["night1/*.fits"], workers=8)
 
 Inputs:
+	config_file: YAML configuration of the reduction. For optspecextr its
+				 data_file is the frame reduced. With its section option set,
+				 frames are memory mapped and only the columns of the
+				 aperture and the skywidth sky windows are read, so output
+				 images cover those columns, starting at column xoffset.
+				 With its stream option set (and no adjfunc), the frame is
+				 reduced blockrows rows at a time by streamextr, and the
+				 saved images cover only the aperture columns.
+
+	return_stats: set to also return the Stats of the reduction, the time of
+				 each stage and the counts of its vector fits. Stats are also
+				 collected when the configuration sets stats or statsfile, or
+				 verbose. statsfile names a JSON (or, ending in .csv, CSV) file
+				 in the output directory to write them to, with the frame's
+				 prefix in a batch.
+
+Batch Inputs:
+	frames:   list of FITS files or glob patterns, all reduced with the same
+			  configuration (default: the configuration's data_file)
+	workers:  number of frames to reduce at once in a process pool (default 1)
+	prefetch: number of frames read ahead of the reduction (default 2)
+	output_dir: directory for the outputs (default: the configuration's)
+
+	With the configuration's profreuse option set, the profile is fitted once,
+	from the median stack of the profref frames or else the first frame, and
+	reused for every frame whose trace centroids are within profdrift pixels
+	of the reference's (see ProfileCache). A frame that drifted further has
+	its profile fitted, and becomes the reference for the frames after it.
+	Streamed frames fit their own profiles. In a process pool, frames already
+	running when a frame fits a new profile are checked against the old one.
+
+	With the configuration's dtype option set to float32, each frame is
+	converted to single precision and its image planes are stored and worked
+	on in single precision, halving their memory traffic (see plane_dtype).
+	See lib/benchmarks/precision.py for its speed and accuracy against
+	float64.
+
+	With bgwarm set, the background fit of each frame starts from the sky
+	fitted in the frame before it (see BackgroundSeed), so that the clipping
+	converges in about one pass per row. In a process pool, a frame starts
+	from the last frame finished when it is submitted. Streamed frames start
+	cold.
 
 Outputs:
+	optspecextr returns the optimally extracted spectrum. optspecextr_batch
+	returns one report per frame, a dict with the frame, the output prefix,
+	ok, the read and reduction times in seconds, the error of a failed
+	frame and, with stats configured, the stats of the frame as a dict. With
+	profreuse, profile is "fit" or "reused" and drift is the trace drift in
+	pixels from the reference. With bgwarm, bgwarm is the convergence
+	statistics of the frame's background fit.
+
+	The products of each frame are written by a background FrameWriter (see
+	output.py) to the output directory, as the extensions of one file,
+	products.fits: the background subtracted data, background, profile,
+	variance and quality images, and the standard and optimal spectra and
+	their variances. stdspec.png plots the standard spectrum. The quality
+	plane holds the bits of why each pixel was rejected (see quality.py). The
+	configuration's compress option tile compresses the images, and
+	writequeue bounds the products waiting to be written. Outputs of each
+	frame are written with its own prefix, so frames do not overwrite each
+	other, and a failed frame does not stop the batch. A frame whose products
+	could not be written is reported failed.
 
 History:
 
 Created on 4/17/2021$
 """
-from lib.vectsetup import fitprof
+from lib.vectsetup import fitprof, extrspec
 from lib.fitbg import fitbg
-from lib.utils import load_config, save_fits
+from lib.utils import read_config, load_frame, plane_dtype, Config
+from lib.stats import Stats, NOSTATS
+from lib.profcache import ProfileCache
+from lib.bgseed import BackgroundSeed
 from lib.stdextr import stdextr
-from lib.display import interactive_jose
+from lib.quality import quality_plane, quality_cards
+from lib.output import frame_writer
+from lib.excep import OutputException
+from lib.stream import streamextr
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
 import numpy as np
-import os, sys
-from matplotlib import pyplot as plt
+import os, sys, glob, time, traceback
 
 
-def optspecextr(config_file):
+def optspecextr(config_file, return_stats=False):
 	# Set up run configuration for variables
-	data, opts = load_config(config_file)
+	opts = read_config(config_file)
+	stats = Stats() if return_stats or _wants_stats(opts) else NOSTATS
+
+	with stats.stage("load"):
+		data, opts = load_frame(opts['data_file'], opts)
+
+	optspec = reduce_frame(data, opts, stats=stats)
+
+	if opts.get('verbose', 0) > 0:
+		print(stats.summary())
+	dump_stats(stats, opts)
+
+	if return_stats:
+		return optspec, stats
+	return optspec
+
+
+def _wants_stats(opts):
+	return bool(opts.get('stats') or opts.get('statsfile') or opts.get('verbose', 0) > 0)
+
+
+def dump_stats(stats, opts, prefix=None):
+	"""
+	Writes stats to the configured statsfile in the output directory, with
+	prefix, if the configuration has one.
+	"""
+	if stats.enabled and opts.get('statsfile'):
+		output_dir = opts.get('output_dir', './output')
+		os.makedirs(output_dir, exist_ok=True)
+		stats.dump(os.path.join(output_dir, (prefix + "_" if prefix else "") + opts['statsfile']))
+
 
+def _frame_opts(opts, stats):
+	opts = dict(opts)
+	opts['stats'] = stats
 	opts['v0'] = opts['rn'] ** 2
-	opts['x1'] = np.round(opts['x1'])
-	opts['x2'] = np.round(opts['x2'])
+	opts['x1'] = int(np.round(opts['x1']))
+	opts['x2'] = int(np.round(opts['x2']))
+	return opts
 
+
+def _frame_data(data, opts):
+	# With the dtype option, the frame is converted to it, and the planes made
+	# from it (background, subtracted data) follow
+	if opts.get('dtype'):
+		return np.asarray(data, plane_dtype(opts['dtype']))
+	return data
+
+
+def _frame_variance(data, opts):
 	if "var" in opts:
-		varim = opts['var']
-	else:
-		varim = np.copy(data)
-		varim = abs(varim) / opts['q'] + opts['rn']**2
+		return opts['var']
+	# Build the variance in one new array rather than copying data first
+	varim = np.abs(data, dtype=plane_dtype(opts.get('dtype')))
+	varim /= opts['q']
+	varim += opts['rn']**2
+	return varim
+
+
+def reduce_frame(data, opts, prefix=None, stats=NOSTATS, profcache=None, bgseed=None, writer=None):
+	# Run the extraction pipeline on one frame, writing outputs with prefix.
+	# With a ProfileCache, its profile is used unless the trace drifted. With
+	# a BackgroundSeed, the background fit starts from the previous frame's.
+	# The products are queued on writer, a FrameWriter, as they are made, and
+	# written in the background. Without one, the frame's own writer is
+	# waited for before returning.
+	if writer is None:
+		with frame_writer(opts) as writer:
+			optspec = reduce_frame(data, opts, prefix, stats, profcache, bgseed, writer)
+		if prefix in writer.errors:
+			raise OutputException(prefix, writer.errors[prefix])
+		return optspec
+
+	opts = _frame_opts(opts, stats)
+
+	if opts.get('stream') and not opts.get('adjfunc'):
+		return _reduce_frame_stream(data, opts, prefix, stats, writer)
+
+	data = _frame_data(data, opts)
+	varim = _frame_variance(data, opts)
+	# The quality plane every stage records its rejections in
+	quality = quality_plane(opts.pop('inmask', None), np.shape(data))
 	if opts['verbose'] == 5:
 		input("Stopping at fitting sky background, press enter to continue.")
 
 
 	if opts['plottype'] == 5:
+		from lib.display import interactive_jose
 		interactive_jose(data)
 
 	verbose = opts['verbose']
 	plottype = opts['plottype']
 	#Fit Background
-	bgim, varim, opts['inmask'] = fitbg(data, varim=varim, **opts)
+	with stats.stage("fitbg"):
+		bgim, varim, quality = fitbg(data, varim=varim, bgseed=bgseed, quality=quality, **opts)
 
 	opts['verbose'] = verbose
 	opts['plottype'] = plottype
@@ -59,31 +203,49 @@ def optspecextr(config_file):
 	if opts['plottype'] == 5:
 		interactive_jose(dataim)
 
-	save_fits(dataim, 'bg_subtracted')
-	save_fits(data, 'original_data')
-	save_fits(bgim, 'bg_img')
+	with stats.stage("save"):
+		writer.add(prefix, "BGSUB", dataim)
+		writer.add(prefix, "BGIM", bgim)
 
-	stdspec, stdvar, adjspec, dataim = stdextr(dataim, varim, **opts)
+	with stats.stage("stdextr"):
+		stdspec, stdvar, adjspec, dataim = stdextr(dataim, varim, quality=quality, **opts)
 
-	plt.plot(stdspec)
-	plt.savefig("./output/stdspec.png")
+	with stats.stage("save"):
+		writer.plot(prefix, "stdspec", stdspec)
 
-	if opts['integrate'] == True:
+	if opts.get('integrate') == True:
 		spec = adjspec
 	else:
 		spec = stdspec
 
 	if opts['verbose'] == 5:
 		cont = input("Stopping at profile fitting. Press any key to continue or (q) to quit.")
-		if cont == 'q' or "Q":
+		if cont in ('q', 'Q'):
 			sys.exit(0)
 
-	profim = fitprof(rc)
+	rc = Config(**opts)
+	rc.dataim = dataim
+	rc.varim = varim
+	rc.bgim = bgim
+	rc.spec = spec
+	rc.quality = quality
+
+	if profcache is not None:
+		with stats.stage("profcheck"):
+			refit = profcache.needs_fit(dataim, rc.x1, rc.x2)
+	if profcache is None or refit:
+		with stats.stage("fitprof"):
+			profim = fitprof(rc)
+		if profcache is not None:
+			profcache.store(rc)
+	else:
+		profim = profcache.apply(rc)
 	#
 	# verbose = save_verbose
 	# plot_type = save_plottype
 	#
-	optspec = extrspec(rc)
+	with stats.stage("extrspec"):
+		optspec = extrspec(rc)
 	#
 	# varout = varim
 	#
@@ -93,4 +255,237 @@ def optspecextr(config_file):
 	# #        berrvect, perrvect, eerrvect, $
 	# #        verbose, plottype, adjparms = adjparms, debughead = debughead
 
+	with stats.stage("save"):
+		_add_products(writer, prefix, rc, stdspec, stdvar)
+		writer.write(prefix, dict(X1=rc.x1, X2=rc.x2, XOFFSET=opts.get('xoffset') or 0))
+
 	return optspec
+
+
+def _reduce_frame_stream(data, opts, prefix, stats, writer):
+	# Run the pipeline a block of rows at a time. Only the aperture columns of
+	# the intermediate images are kept, so those are what is saved.
+	rc = streamextr(data, opts)
+
+	with stats.stage("save"):
+		writer.add(prefix, "BGSUB", rc.bgsub)
+		writer.add(prefix, "BGIM", rc.bgim)
+		writer.plot(prefix, "stdspec", rc.stdspec)
+		_add_products(writer, prefix, rc, rc.stdspec, rc.stdvar)
+		writer.write(prefix, dict(X1=rc.x1, X2=rc.x2, XOFFSET=rc.xoffset))
+
+	return rc.optspec
+
+
+def _add_products(writer, prefix, rc, stdspec, stdvar):
+	# Queue the products made from the profile fit on, once no stage changes
+	# them (fitprof and extrspec update varim in place)
+	writer.add(prefix, "PROFILE", rc.profim)
+	writer.add(prefix, "VARIANCE", rc.varim)
+	writer.add(prefix, "QUALITY", rc.quality, quality_cards())
+	writer.add(prefix, "STDSPEC", stdspec)
+	writer.add(prefix, "STDVAR", stdvar)
+	writer.add(prefix, "OPTSPEC", rc.optspec)
+	writer.add(prefix, "OPVAR", rc.opvar)
+
+
+def frame_list(frames):
+	"""
+	Expands a FITS file name, glob pattern, or list of them into a sorted list
+	of files, keeping the order the patterns were given in.
+	"""
+	if isinstance(frames, str):
+		frames = [frames]
+
+	paths = []
+	for pattern in frames:
+		matches = sorted(glob.glob(pattern))
+		paths.extend(matches if matches else [pattern])  # keep missing files to report them
+	return paths
+
+
+def frame_prefixes(paths):
+	"""
+	Returns an output prefix for each frame: the file name without extension,
+	with a counter appended when two frames share a name.
+	"""
+	prefixes = []
+	seen = {}
+	for path in paths:
+		stem = os.path.basename(path)
+		for ext in (".gz", ".fz", ".fits", ".fit", ".fts"):
+			if stem.endswith(ext):
+				stem = stem[:-len(ext)]
+		seen[stem] = seen.get(stem, 0) + 1
+		prefixes.append(stem if seen[stem] == 1 else stem + "_" + str(seen[stem] - 1))
+	return prefixes
+
+
+def fit_reference(data, opts, profcache, stats=NOSTATS):
+	"""
+	Fits the profile of data, a reference frame or a median stack of frames,
+	through the background fit and standard extraction, and stores it in
+	profcache. Nothing is saved.
+	"""
+	opts = _frame_opts(opts, stats)
+	data = _frame_data(data, opts)
+	quality = quality_plane(opts.pop('inmask', None), np.shape(data))
+	with stats.stage("fitbg"):
+		bgim, varim, quality = fitbg(data, varim=_frame_variance(data, opts), quality=quality, **opts)
+	with stats.stage("stdextr"):
+		stdspec, stdvar, adjspec, dataim = stdextr(data - bgim, varim, quality=quality, **opts)
+
+	rc = Config(**opts)
+	rc.dataim = dataim
+	rc.varim = varim
+	rc.bgim = bgim
+	rc.spec = adjspec if opts.get('integrate') == True else stdspec
+	rc.quality = quality
+	with stats.stage("fitprof"):
+		fitprof(rc)
+	profcache.store(rc)
+	return rc.profim
+
+
+def _reduce_batch_frame(data, opts, prefix, read_time=0., profcache=None, bgseed=None, writer=None):
+	# Reduce one frame of a batch, catching its failure for the report. The
+	# profile cache is returned when the frame fitted a new profile, and the
+	# background seed after every frame, so that a process pool can pass them
+	# on to later frames. With a writer, the frame's products are left queued
+	# on it.
+	stats = Stats() if _wants_stats(opts) else NOSTATS
+	stats.times['load'] = read_time
+	fits = profcache.fits if profcache is not None else 0
+	start = time.perf_counter()
+	try:
+		reduce_frame(data, opts, prefix, stats, profcache, bgseed, writer)
+		dump_stats(stats, opts, prefix)
+		error = None
+	except Exception:
+		error = traceback.format_exc(limit=3)
+		if writer is not None:
+			writer.discard(prefix)
+
+	result = dict(error=error, time=time.perf_counter() - start,
+	              stats=stats.as_dict() if stats.enabled else None)
+	if profcache is not None and error is None:
+		refit = profcache.fits > fits
+		result.update(profile="fit" if refit else "reused", drift=profcache.drift,
+		              profcache=profcache if refit else None)
+	if bgseed is not None and error is None:
+		result.update(bgwarm=bgseed.last, bgseed=bgseed)
+	return result
+
+
+def _read_batch_frame(path, opts):
+	start = time.perf_counter()
+	data, opts = load_frame(path, opts)
+	return np.asarray(data), opts, time.perf_counter() - start
+
+
+def optspecextr_batch(config_file, frames=None, workers=1, prefetch=2, output_dir=None):
+	# Parse the shared configuration once
+	opts = read_config(config_file)
+	if output_dir is not None:
+		opts['output_dir'] = output_dir
+	opts.setdefault('output_dir', './output')
+
+	paths = frame_list(frames if frames is not None else opts['data_file'])
+	prefixes = frame_prefixes(paths)
+	reports = [dict(frame=path, prefix=prefix, ok=False, read_time=0., time=0., error=None)
+	           for path, prefix in zip(paths, prefixes)]
+
+	# Fit the reused profile before any frame is reduced, so that every
+	# worker starts from it
+	profcache = None
+	if opts.get('profreuse') and paths and not (opts.get('stream') and not opts.get('adjfunc')):
+		profcache = ProfileCache(tol=opts.get('profdrift', 0.1))
+		refpaths = frame_list(opts['profref']) if opts.get('profref') else paths[:1]
+		refs = [load_frame(path, opts) for path in refpaths]
+		refdata = np.median([np.asarray(data) for data, refopts in refs], 0) if len(refs) > 1 else refs[0][0]
+		fit_reference(refdata, refs[0][1], profcache)
+
+	bgseed = None
+	if opts.get('bgwarm') and not opts.get('bgsurface') and paths and \
+			not (opts.get('stream') and not opts.get('adjfunc')):
+		bgseed = BackgroundSeed(opts.get('bgdeg', 1))
+
+	# Frames are read by a background thread, at most prefetch ahead of the
+	# reduction, and reduced in this process or in a pool of workers. Frames
+	# reduced in this process are written by one background writer, while
+	# the next frames are reduced; each worker of a pool writes its own.
+	reader = ThreadPoolExecutor(max_workers=1)
+	pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+	writer = frame_writer(opts) if pool is None else None
+	reads = deque()
+	running = deque()
+	nextread = 0
+
+	def collect(item):
+		nonlocal profcache, bgseed
+		i, result = item
+		result = result.result() if pool else result
+		error, seconds = result['error'], result['time']
+		reports[i].update(ok=error is None, time=seconds, error=error)
+		if result['stats'] is not None:
+			reports[i]['stats'] = result['stats']
+		if 'profile' in result:
+			reports[i].update(profile=result['profile'], drift=result['drift'])
+			if pool and result['profcache'] is not None:
+				profcache = result['profcache']
+		if 'bgwarm' in result:
+			reports[i]['bgwarm'] = result['bgwarm']
+			if pool:
+				bgseed = result['bgseed']
+		if opts.get('verbose', 0) > 0:
+			status = "ok" if error is None else "FAILED"
+			print("%s: %s in %.2f s" % (paths[i], status, seconds))
+
+	try:
+		while nextread < len(paths) or reads or running:
+			while nextread < len(paths) and len(reads) < max(prefetch, 1):
+				reads.append((nextread, reader.submit(_read_batch_frame, paths[nextread], opts)))
+				nextread += 1
+
+			if reads:
+				i, future = reads.popleft()
+				try:
+					data, frameopts, seconds = future.result()
+					reports[i]['read_time'] = seconds
+				except Exception:
+					reports[i]['error'] = traceback.format_exc(limit=3)
+					if opts.get('verbose', 0) > 0:
+						print("%s: FAILED to read" % paths[i])
+					continue
+
+				if pool:
+					running.append((i, pool.submit(_reduce_batch_frame, data, frameopts, prefixes[i],
+					                               seconds, profcache, bgseed)))
+					if len(running) < 2 * workers:
+						continue
+				else:
+					running.append((i, _reduce_batch_frame(data, frameopts, prefixes[i], seconds, profcache,
+					                                               bgseed, writer)))
+
+			collect(running.popleft())
+	finally:
+		reader.shutdown()
+		if pool:
+			pool.shutdown()
+		if writer:
+			writer.close()
+
+	# Frames whose products failed to write failed
+	if writer:
+		for report in reports:
+			if report['ok'] and report['prefix'] in writer.errors:
+				report.update(ok=False, error=writer.errors[report['prefix']])
+				if opts.get('verbose', 0) > 0:
+					print("%s: FAILED to write" % report['frame'])
+
+	if opts.get('verbose', 0) > 0:
+		nfail = sum(not r['ok'] for r in reports)
+		print("Reduced %d frames, %d failed, in %.2f s of reduction time" %
+		      (len(reports), nfail, sum(r['time'] for r in reports)))
+
+	return reports
@@ -0,0 +1,199 @@
+"""
+Name: output.py
+
+Purpose: Writing of the products of a reduction off the compute path. A
+FrameWriter takes the images, spectra and plots of each frame as they are
+made and hands them to a background thread through a bounded queue, so the
+pipeline only waits on disk when the queue is full. The products of a frame
+go into one multi-extension FITS file, prefix_products.fits, with an empty
+primary HDU and one extension per product, optionally tile compressed.
+
+	Extension  Product
+	BGSUB      background subtracted data
+	BGIM       background image
+	PROFILE    spatial profile image
+	VARIANCE   final variance image
+	QUALITY    quality plane, with the meaning of its bits (see quality.py)
+	STDSPEC    standard spectrum
+	STDVAR     variance of the standard spectrum
+	OPTSPEC    optimal spectrum
+	OPVAR      variance of the optimal spectrum
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Utilities
+
+Calling Example:
+	writer = FrameWriter("./output", compress="GZIP_2")
+	writer.add("frame1", "BGSUB", dataim)
+	writer.plot("frame1", "stdspec", stdspec)
+	writer.write("frame1", header=dict(X1=x1, X2=x2))
+	errors = writer.close()
+
+Inputs:
+	output_dir: the directory the files are written to (default ./output)
+	compress:   the tile compression of the image extensions: a compression
+				type of astropy's CompImageHDU, e.g. GZIP_1, GZIP_2, RICE_1 or
+				HCOMPRESS_1, or True for GZIP_2. Spectra are not compressed.
+				default: None, no compression
+	quantize:   the quantize level of compressed floating point images. The
+				GZIP types keep them exactly by default. RICE_1 and
+				HCOMPRESS_1 always quantize floating point images
+				(default 16, astropy's). Integer images are kept exactly.
+	maxqueue:   the largest number of products queued before add waits for
+				the writer (default 8)
+
+Outputs:
+	close returns the errors of the frames whose products failed to write,
+	{prefix: traceback}, also kept in errors. A failed frame does not stop the
+	writing of the others.
+
+Restrictions:
+	The arrays added are written as they are when the writer gets to them,
+	so they must not be changed after they are added.
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+import os
+import queue
+import threading
+import traceback
+from astropy.io import fits
+from matplotlib.figure import Figure
+from lib.excep import ParameterException
+
+PRODUCTS = ("BGSUB", "BGIM", "PROFILE", "VARIANCE", "QUALITY", "STDSPEC", "STDVAR", "OPTSPEC", "OPVAR")
+COMPRESSION = ("GZIP_1", "GZIP_2", "RICE_1", "HCOMPRESS_1", "PLIO_1")
+
+
+class FrameWriter:
+	def __init__(self, output_dir="./output", compress=None, quantize=None, maxqueue=8):
+		self.output_dir = output_dir
+		self.compress = "GZIP_2" if compress is True else compress or None
+		# astropy falls back to RICE_1, which quantizes, on an unknown type
+		if self.compress is not None and self.compress not in COMPRESSION:
+			raise ParameterException("compress must be one of %s." % ", ".join(COMPRESSION))
+		self.quantize = quantize
+		self.errors = {}
+		self._hdus = {}
+		self._queue = queue.Queue(maxsize=max(int(maxqueue), 1))
+		self._thread = threading.Thread(target=self._run, name="FrameWriter", daemon=True)
+		self._thread.start()
+
+	def add(self, prefix, name, arr, header=None):
+		"""
+		Queues arr as extension name of the products of frame prefix, with
+		the extra header cards of the dict header.
+		"""
+		self._queue.put(("add", prefix, name, arr, header))
+
+	def plot(self, prefix, name, y):
+		"""
+		Queues a line plot of y, written as prefix_name.png.
+		"""
+		self._queue.put(("plot", prefix, name, y, None))
+
+	def write(self, prefix, header=None):
+		"""
+		Queues the writing of the products added for frame prefix to
+		prefix_products.fits, with the cards of header in the primary HDU.
+		"""
+		self._queue.put(("write", prefix, None, None, header))
+
+	def discard(self, prefix):
+		"""
+		Queues the dropping of the products added for frame prefix, for a
+		frame that failed before they were written.
+		"""
+		self._queue.put(("discard", prefix, None, None, None))
+
+	def flush(self):
+		"""
+		Waits for everything queued to be written.
+		"""
+		self._queue.join()
+
+	def close(self):
+		"""
+		Waits for everything queued to be written, stops the writer, and
+		returns the errors of the frames that failed.
+		"""
+		if self._thread.is_alive():
+			self._queue.put(None)
+			self._thread.join()
+		return self.errors
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def path(self, prefix, name):
+		return os.path.join(self.output_dir, (prefix + "_" if prefix else "") + name)
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			try:
+				if item is None:
+					return
+				action, prefix, name, arr, header = item
+				if prefix in self.errors:
+					continue  # the frame failed already
+				try:
+					if action == "add":
+						self._hdus.setdefault(prefix, []).append(self._hdu(name, arr, header))
+					elif action == "plot":
+						self._plot(prefix, name, arr)
+					elif action == "discard":
+						self._hdus.pop(prefix, None)
+					else:
+						self._write(prefix, header)
+				except Exception:
+					self.errors[prefix] = traceback.format_exc(limit=3)
+					self._hdus.pop(prefix, None)
+			finally:
+				self._queue.task_done()
+
+	def _hdu(self, name, arr, header):
+		if self.compress and np.ndim(arr) == 2:
+			quantize = self.quantize
+			if quantize is None:
+				quantize = 0. if self.compress.startswith("GZIP") else 16.
+			hdu = fits.CompImageHDU(np.asarray(arr), name=name, compression_type=self.compress,
+			                        quantize_level=quantize)
+		else:
+			hdu = fits.ImageHDU(np.asarray(arr), name=name)
+		for key, value in (header or {}).items():
+			hdu.header[key] = value
+		return hdu
+
+	def _plot(self, prefix, name, y):
+		# Figure without pyplot, which is not safe to use outside the main thread
+		os.makedirs(self.output_dir, exist_ok=True)
+		fig = Figure()
+		ax = fig.subplots()
+		ax.plot(y)
+		fig.savefig(self.path(prefix, name + ".png"))
+
+	def _write(self, prefix, header):
+		os.makedirs(self.output_dir, exist_ok=True)
+		primary = fits.PrimaryHDU()
+		for key, value in (header or {}).items():
+			primary.header[key] = value
+		hdus = fits.HDUList([primary] + self._hdus.pop(prefix, []))
+		hdus.writeto(self.path(prefix, "products.fits"), overwrite=True)
+
+
+def frame_writer(opts):
+	"""
+	Returns a FrameWriter set up by the configuration opts: its output_dir,
+	compress, quantize and writequeue options.
+	"""
+	return FrameWriter(opts.get('output_dir', './output'), compress=opts.get('compress'),
+	                   quantize=opts.get('quantize'), maxqueue=opts.get('writequeue') or 8)
@@ -0,0 +1,114 @@
+"""
+Name: parallel.py
+
+Purpose: Runs the row (or column) loops of the pipeline stages in a process
+pool. The images a loop reads and writes are copied once into shared memory
+(a constant plane, see utils.constant_plane, is sent as its value instead),
+each worker attaches to them when it starts, and the loop is split into
+chunks of vectors that the workers run through the same code as the serial
+path. Results are therefore identical to running the loop in one process.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Utilities
+
+Calling Example:
+	parmap(_fitbg_rows, ny, arrays, workers=8, outputs=("bgim", "inmask"), **opts)
+
+Inputs:
+	vectfunc: module level function called as vectfunc(lo, hi, arrays, **kwargs),
+			  processing vectors lo..hi-1 and writing its results into arrays
+	nvect:    the number of vectors in the loop
+	arrays:   dict of name: ndarray for every image the loop uses
+
+Keyword Arguments:
+	workers:  number of worker processes. 1 or fewer runs vectfunc in this
+			  process on arrays directly.
+	outputs:  names of the arrays vectfunc writes, copied back into arrays when
+			  the pool finishes
+	chunks:   number of chunks to split the vectors into (default 4 per worker)
+	Any other keywords are passed on to vectfunc.
+
+Outputs:
+	The list of values returned by vectfunc for each chunk, in order.
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from lib.excep import ParameterException
+from lib.utils import constant_value
+
+# Shared arrays attached by a worker process, name: (SharedMemory, ndarray)
+_attached = {}
+
+
+def _attach(descr):
+	for name, (shmname, shape, dtype, value) in descr.items():
+		if shmname is None:
+			_attached[name] = (None, np.broadcast_to(np.asarray(value, dtype), shape))
+			continue
+		shm = shared_memory.SharedMemory(name=shmname)
+		_attached[name] = (shm, np.ndarray(shape, dtype, buffer=shm.buf))
+
+
+def _run_chunk(vectfunc, lo, hi, kwargs):
+	arrays = {name: arr for name, (shm, arr) in _attached.items()}
+	return vectfunc(lo, hi, arrays, **kwargs)
+
+
+def chunk_ranges(nvect, nchunk):
+	"""
+	Splits range(nvect) into nchunk contiguous (lo, hi) ranges of near equal length.
+	"""
+	nchunk = max(1, min(nchunk, nvect))
+	edges = np.linspace(0, nvect, nchunk + 1).astype(int)
+	return [(edges[i], edges[i + 1]) for i in range(nchunk) if edges[i] < edges[i + 1]]
+
+
+def parmap(vectfunc, nvect, arrays, workers=1, outputs=(), chunks=None, **kwargs):
+	arrays = {k: v for k, v in arrays.items() if v is not None}
+
+	if workers is None or workers <= 1:
+		return [vectfunc(0, nvect, arrays, **kwargs)]
+
+	for name in outputs:
+		if name not in arrays:
+			raise ParameterException("Output " + name + " is not one of the arrays.")
+
+	if chunks is None:
+		chunks = 4 * workers
+
+	shms = {}
+	descr = {}
+	try:
+		for name, arr in arrays.items():
+			arr = np.asarray(arr)
+			# A constant plane (see constant_plane) is sent as its value
+			value = constant_value(arr)
+			if value is not None and name not in outputs:
+				descr[name] = (None, arr.shape, arr.dtype, value)
+				continue
+			shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+			shms[name] = shm
+			np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+			descr[name] = (shm.name, arr.shape, arr.dtype, None)
+
+		with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(descr,)) as pool:
+			futures = [pool.submit(_run_chunk, vectfunc, lo, hi, kwargs)
+			           for lo, hi in chunk_ranges(nvect, chunks)]
+			results = [f.result() for f in futures]
+
+		for name in outputs:
+			shmname, shape, dtype, value = descr[name]
+			arrays[name][...] = np.ndarray(shape, dtype, buffer=shms[name].buf)
+	finally:
+		for shm in shms.values():
+			shm.close()
+			shm.unlink()
+
+	return results
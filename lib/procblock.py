@@ -0,0 +1,217 @@
+"""
+Name: procblock.py
+
+Purpose: Iterative sigma-clipping fits of a 2-D block of vectors. The block
+form of procvect: every row is fitted and clipped at once, and each pass only
+refits the rows that still have pixels above threshold.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Vector Processing
+
+Calling Example:
+	fiteval, maskb, errflag, coeffb = procblock(datab, xvals=xvals, varb=varb,
+	                                            maskb=maskb, func="polyfunc", parm=2)
+
+Inputs:
+	datab: the block of vectors to fit, dimension (nvect, nx)
+
+Keyword Arguments:
+	Cut from the same images procvect is passed rows of, dimension (nvect, nx):
+	varb:    the variance block, updated in place unless noupdate is set
+	multb:   the multiplier block (spectrum or profile), may be a scalar
+	maskb:   the mask block, good pixels are 1. Updated in place.
+	bgb:     the background block
+	skyvarb: the sky variance block
+	crb:     receives the rejection residuals
+
+	Passed as for procvect:
+	xvals, thresh, q, v0, bpct, func, parm, absthresh, noupdate, counts
+
+	reject: "worst" (default) masks only the worst pixel of each row on each
+			pass, which reproduces procvect exactly. "all" masks every pixel
+			above threshold on each pass, converging in fewer passes.
+	coeffb: the coefficients each row starts from, passed to the fitting
+			function on the first pass (default 0)
+
+Outputs:
+	fiteval: the evaluated fit of each row over all nx
+	maskb:   the updated mask block
+	errflag: 1 for the rows that exited with too many pixels rejected
+	coeffb:  the fit coefficients of each row
+
+Restrictions:
+	The block is worked on in double, or in single precision if datab and
+	varb are both float32.
+	func is looked up in the fitting registry (see lib/fitting/registry.py).
+	Its block fitting function, named <func>_batch in its lib.fitting module,
+	fits the rows together; a fitter without one is called row by row.
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.excep import *
+from lib.fitting.registry import get_fitter
+from lib.utils import constant_value
+
+
+def _block(arr, default, shape, writable=False):
+	# Return arr as a block of the given shape, or default if absent. A block
+	# only read is left a zero-stride view of a scalar.
+	if arr is None:
+		arr = np.asarray(default, np.double)
+	if np.ndim(arr) < 2:
+		arr = np.broadcast_to(arr, shape)
+		return np.array(arr) if writable else arr
+	if writable and not arr.flags.writeable:
+		return np.array(arr)
+	return arr
+
+
+def _columns(arr, xvals):
+	# arr[:, xvals], kept a zero-stride view if arr is a constant block
+	value = constant_value(arr)
+	if value is None:
+		return arr[:, xvals]
+	return np.broadcast_to(value, (len(arr), len(xvals)))
+
+
+def _take(arr, rows):
+	# arr[rows], or the value of a constant block, which broadcasts the same
+	value = constant_value(arr)
+	return arr[rows] if value is None else value
+
+
+def procblock(datab, **kwargs):
+	# Set Defaults and Check Inputs
+
+	datab = np.atleast_2d(datab)
+	nvect, nx = np.shape(datab)
+	shape = (nvect, nx)
+
+	xvals = kwargs.get("xvals")
+	if xvals is None:
+		xvals = np.arange(nx)
+	varb = _block(kwargs.get("varb"), 1., shape, True)
+	multb = _block(kwargs.get("multb"), 1., shape)
+	maskb = _block(kwargs.get("maskb"), 1., shape, True)
+	bgb = _block(kwargs.get("bgb"), 0., shape)
+	skyvarb = _block(kwargs.get("skyvarb"), 0., shape)
+	crb = _block(kwargs.get("crb"), 0., shape, True)
+	thresh = kwargs.get("thresh", 3)
+	q = kwargs.get("q", 1)
+	v0 = kwargs.get("v0", 0)
+	bpct = kwargs.get("bpct", 0.5)
+	func = kwargs.get("func", "polyfunc")
+	parm = kwargs.get("parm", {})
+	absthresh = kwargs.get("absthresh", False)
+	noupdate = kwargs.get("noupdate", False)
+	reject = kwargs.get("reject", "worst")
+	counts = kwargs.get("counts")
+
+	# Error checking
+	for name, arr in (("varb", varb), ("multb", multb), ("maskb", maskb),
+	                  ("bgb", bgb), ("skyvarb", skyvarb), ("crb", crb)):
+		if np.shape(arr) != shape:
+			raise VectorLengthException("datab", name)
+	if thresh < 0: raise ParameterException("Threshold cannot be less than 0.")
+	if q < 0: raise ParameterException("Q cannot be less than 0.")
+	if v0 < 0: raise ParameterException("v0 cannot be less than 0.")
+	if bpct > 1 or bpct < 0: raise ParameterException(
+			"bpct must be between 0 and 1.")
+	if reject not in ("worst", "all"):
+		raise ParameterException("reject must be 'worst' or 'all'.")
+
+	if absthresh:
+		vthresh = thresh
+	else:
+		vthresh = thresh * thresh
+
+	fit_func = get_fitter(func).batch
+
+	# Work on the xvals columns only, and write the results back at the end
+	dtype = np.float32 if datab.dtype.char == varb.dtype.char == "f" else np.double
+	datas = np.asarray(datab[:, xvals], dtype)
+	mults = _columns(multb, xvals)
+	bgs = _columns(bgb, xvals)
+	skyvars = _columns(skyvarb, xvals)
+	vars = np.array(varb[:, xvals], dtype)
+	goods = maskb[:, xvals] == 1
+	crs = np.array(crb[:, xvals])
+
+	errorthresh = np.maximum(np.sum(goods, 1) * (1 - bpct), max(len(xvals) * 0.10, 6))
+
+	errflag = np.zeros(nvect, np.byte)
+	coeffb = kwargs.get("coeffb")
+	coeffb = np.zeros((nvect, 1)) if coeffb is None else np.array(coeffb, np.double)
+	rows = np.arange(nvect)
+	ngood = np.sum(goods)
+	itercount = 0
+
+	# MAIN LOOP
+	# On each pass, drop the rows without enough good pixels left to fit. Fit
+	# the rest together, calculate each pixel's residual and, if needed,
+	# update the variance. Then mask the worst pixel above threshold in each
+	# row (or all of them, if reject is "all"). Only the rows that masked a
+	# pixel are refitted on the next pass.
+
+	while len(rows) > 0:
+		goodb = goods[rows]
+
+		failed = np.sum(goodb, 1) < errorthresh[rows]
+		if np.any(failed):
+			errflag[rows[failed]] = 1
+			rows = rows[~failed]
+			goodb = goodb[~failed]
+			if len(rows) == 0:
+				break
+
+		fitdata = datas[rows]
+		fitvar = vars[rows]
+		fitmult = mults[rows]
+
+		est, fitcoeff = fit_func(xvals, fitdata, fitvar, fitmult, goodb, False, coeffb[rows], parm)
+		itercount = itercount + len(rows)
+		if np.shape(coeffb)[1] != np.shape(fitcoeff)[1]:
+			coeffb = np.zeros((nvect, np.shape(fitcoeff)[1]))
+		coeffb[rows] = fitcoeff
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			if absthresh:
+				fitcr = abs(fitdata / fitmult - est)
+			else:
+				fitcr = (fitdata - fitmult * est) ** 2 / fitvar
+		# Cast through crb's type so comparisons match procvect's
+		fitcr = np.where(goodb, fitcr, crs[rows]).astype(crs.dtype)
+		crs[rows] = fitcr
+
+		if not noupdate:
+			vars[rows] = np.where(goodb, abs(fitmult * est + _take(bgs, rows)) / q + v0 + _take(skyvars, rows),
+			                      fitvar)
+
+		badb = goodb & (fitcr > vthresh)
+		hasbad = np.any(badb, 1)
+
+		if reject == "worst":
+			badcr = np.where(badb, fitcr, -np.inf)
+			badb &= badcr == np.max(badcr, 1)[:, None]  # only eliminate max pixel
+		goodb[badb] = False
+		goods[rows] = goodb
+
+		rows = rows[hasbad]
+
+	maskb[:, xvals] = np.where(goods, maskb[:, xvals], 0)
+	crb[:, xvals] = crs
+	if not noupdate:
+		varb[:, xvals] = vars
+
+	fiteval, coeffb = fit_func(np.arange(nx), datab, varb, multb * maskb, maskb == 1, True, coeffb, parm)
+
+	if counts is not None:
+		counts.update(vectors=nvect, iterations=itercount, rejected=int(ngood - np.sum(goods)),
+		              errflag=int(np.sum(errflag)))
+
+	return fiteval, maskb, errflag, coeffb
@@ -18,149 +18,269 @@ Created on 9/19/2021$
 
 import numpy as np
 from lib.excep import *
-from importlib import import_module
 from lib.fitting import *
+from lib.fitting.registry import get_fitter
+
+
+_VECTOR_ARGS = ("varv", "maskv", "crv", "multv", "bgv", "skyvarv", "vectnum", "counts")
+
+
+class PreparedVect:
+	"""
+	Name:
+		PreparedVect
+
+	Purpose:
+		procvect with its options checked once. A stage that fits many
+		vectors of the same length with the same options (fitbg, fitprof,
+		extrspec) builds one PreparedVect and calls it on each vector, rather
+		than passing every option to procvect again. The fitting function is
+		looked up once, and the good pixels, their x values, the residuals and
+		the working estimates of each pass go into buffers allocated once.
+
+	Calling Example:
+		fitter = PreparedVect(nx, xvals=xvals, func="polyfunc", parm=2, thresh=5)
+		for i in range(ny):
+			fiteval, maskv, errflag, coeffv = fitter(dataim[i], varv=varim[i], maskv=inmask[i])
+
+	Procedure:
+		The call does no checking of the vectors passed to it: they must be
+		the stage's length, as procvect checks. An absent multv is 1 and an
+		absent bgv or skyvarv is 0, which are left out of the sums rather
+		than made into arrays. An absent varv is 1, updated in the buffer
+		varv, and an absent maskv is 1, copied only once a pixel is masked
+		(the mask of a vector without any is returned read only).
+		An absent crv is the buffer crv, which holds the residuals of the
+		last vector fitted. The keyword options are
+		attributes and may be changed between calls (e.g. verbose).
+	"""
+
+	def __init__(self, nx, xvals=None, func="polyfunc", parm=None, thresh=3, q=1, v0=0, bpct=0.5,
+	             absthresh=False, noupdate=False, verbose=0, plottype=0, **kwargs):
+		# Options for single vectors (see _VECTOR_ARGS) and ones procvect does
+		# not use are accepted and ignored, so a stage can pass its keywords on
+		if thresh < 0: raise ParameterException("Threshold cannot be less than 0.")
+		if q < 0: raise ParameterException("Q cannot be less than 0.")
+		if v0 < 0: raise ParameterException("v0 cannot be less than 0.")
+		if bpct > 1 or bpct < 0: raise ParameterException(
+				"bpct must be between 0 and 1.")
+
+		self.nx = nx
+		self.xvals = np.arange(nx) if xvals is None else np.asarray(xvals)
+		self.func = func
+		self.parm = {} if parm is None else parm
+		self.thresh = thresh
+		self.q = q
+		self.v0 = v0
+		self.bpct = bpct
+		self.absthresh = absthresh
+		self.noupdate = noupdate
+		self.verbose = verbose
+		self.plottype = plottype
+
+		# If an absolute threshold is used, use that threshold.  Else, square
+		# the sigma threshold so it can be used with variance calculations
+		self.vthresh = thresh if absthresh else thresh * thresh
+
+		# Look up the fitting function in the registry, which imports it the
+		# first time incase it is user-defined. Function name must be the same
+		# as the module name. (i.e. myfunc.myfunc())
+		self.fit_func = get_fitter(func)
+
+		nfit = len(self.xvals)
+		self.full = nfit == nx and np.array_equal(self.xvals, np.arange(nx))
+		self.allx = np.arange(nx)
+		# The vectors of 1 an absent multv, varv or maskv starts as, read only
+		self.ones = np.ones(nx)
+		self.onemask = np.ones(nx, np.byte)
+		self.ones.flags.writeable = False
+		self.onemask.flags.writeable = False
+		self.varv = np.empty(nx)
+		self.crv = np.zeros(nx)
+		self.good = np.empty(nfit, bool)
+		self.bad = np.empty(nfit, bool)
+		self.fitx = np.empty(nfit, self.xvals.dtype)
+		self.res = np.empty(nfit)
+		self.upd = np.empty(nfit)
+
+	def check(self, datav, varv=None, maskv=None, crv=None, multv=None, bgv=None, skyvarv=None, **kwargs):
+		"""
+		Raises VectorLengthException if a vector passed is not the length of
+		the stage, as procvect does before each fit.
+		"""
+		nx = self.nx
+		if nx != len(datav): raise VectorLengthException("nx", "datav")
+		if varv is not None and nx != len(varv): raise VectorLengthException("nx", "varv")
+		if maskv is not None and nx != len(maskv): raise VectorLengthException("nx", "maskv")
+		if multv is not None and nx != len(multv) and len(multv) != 1:
+			raise VectorLengthException("nx", "multv")
+		if bgv is not None and nx != bgv.size: raise VectorLengthException("nx", "bgv")
+		if skyvarv is not None and nx != len(skyvarv): raise VectorLengthException("nx", "skyvarv")
+		if crv is not None and nx != len(crv): raise VectorLengthException("nx", "crv")
+
+	def __call__(self, datav, varv=None, maskv=None, crv=None, multv=None, bgv=None, skyvarv=None, parm=None,
+	             vectnum=None, counts=None, coeffv=None):
+		"""
+		Fits datav as procvect does, with parm overriding the stage's parm.
+		coeffv, when given, is passed to the fitting function on the first
+		pass as the coefficients to start from. varv, maskv and crv are
+		updated in place. Returns fiteval, maskv, errflag and coeffv.
+		"""
+		nx = self.nx
+		xvals = self.xvals
+		fit_func = self.fit_func
+		parm = self.parm if parm is None else parm
+		q = self.q
+		v0 = self.v0
+		vthresh = self.vthresh
+
+		# Single precision vectors are fitted in double (see plane_dtype), and
+		# the variance is written back on return
+		outvarv = None
+		if datav.dtype.char == "f":
+			datav = datav.astype(np.double)
+		if varv is None:
+			varv = self.ones
+			if not self.noupdate:
+				varv = self.varv
+				varv.fill(1.)
+		elif varv.dtype.char == "f":
+			outvarv, varv = varv, varv.astype(np.double)
+		if isinstance(multv, np.ndarray) and multv.dtype.char == "f":
+			multv = multv.astype(np.double)
+		if maskv is None:
+			maskv = self.onemask
+		if crv is None:
+			crv = self.crv
+			crv[:] = 0.
+		if multv is None:
+			multv = self.ones
+		elif len(multv) != nx:
+			multv = np.broadcast_to(multv, (nx,))
+
+		# Set the error threshold to be the greatest of 6 pixels, 10% of the
+		# total pixels, or the given percentage of good pixels passed in.
+		errorthresh = None
+
+		errflag = 0
+		if coeffv is None:
+			coeffv = 0
+		funcdone = 1
+		funccount = 0
+		itercount = 0
+
+		# MAIN LOOP
+		# On each iteration, first check to make sure there is enough good pixels left
+		# to fit the data. Next, pull out the good pixels and pass them to the function.
+		# Calculate the residuals of each pixel, using either the difference between
+		# actual and estimated, or if sigma rejection is used, the difference and
+		# divide by the variance of the pixel. If the user requests a summary plot,
+		# plot the estimated variance vs actual and the residual. If needed, update the
+		# variance to reflect the new estimation. Reject the pixel with the largest
+		# residual larger than the threshold. If no bad pixels are found, exit the loop.
+
+		while funcdone:
+			funcdone = 0
+			np.equal(maskv if self.full else maskv[xvals], 1, out=self.good)
+			ngood = np.count_nonzero(self.good)
+			if errorthresh is None:
+				errorthresh = max(ngood * (1 - self.bpct), len(xvals) * 0.10, 6)
+
+			if ngood < errorthresh:
+
+				fiteval, coeffv = fit_func(self.allx, datav, varv, multv * maskv, True, coeffv, parm)
+
+				if self.verbose > 2:
+					vectnum_s = "" if vectnum is None else " at Vector # " + str(vectnum)
+					print("Too many pixels rejected" + vectnum_s)
+				errflag = 1
+				if counts is not None:
+					counts.update(vectors=1, iterations=itercount, rejected=funccount, errflag=1)
+				if outvarv is not None:
+					outvarv[:] = varv
+				return fiteval, maskv, errflag, coeffv
+
+			fitx = np.compress(self.good, xvals, out=self.fitx[:ngood])
+			fitdata = datav[fitx]
+			fitvar = varv[fitx]
+			fitmult = multv[fitx]
+
+			est, coeffv = fit_func(fitx, fitdata, fitvar, fitmult, False, coeffv, parm)
+			itercount = itercount + 1
+			res = self.res[:ngood]
+			if self.absthresh:
+				np.divide(fitdata, fitmult, out=res)
+				np.subtract(res, est, out=res)
+				np.abs(res, out=res)
+			else:
+				np.multiply(fitmult, est, out=res)
+				np.subtract(fitdata, res, out=res)
+				np.square(res, out=res)
+				np.divide(res, fitvar, out=res)  # prevent divide by zero
+			crv[fitx] = res
+			if crv.dtype != res.dtype:
+				res = crv[fitx]
+			bad = np.greater(res, vthresh, out=self.bad[:ngood])  # get bad locations
+
+			# TODO Procvect plotting
+
+			# 	if plottype[2] or (verbose eq 5) then begin
+			#           device, window_state = ws
+			#           if not ws[13] then window, 13 else wset, 13
+			#           !p.multi = [0,1,2,1,1]
+			#           plot, fitx, fitdata, $
+			#             title='Actual vs. Fitted' + vectnum_s, $
+			#             ytitle='Data Values (if applicable / Spec)', $
+			#             xtitle='Pixel Locations', charsize=1.1
+			#           oplot, fitx, est * fitmult
+			#   if keyword_set(absthresh) then begin
+			#     plot, fitx, crv[fitx], title='Residual', $
+			#           ytitle='Abs of Data - Expected', $
+			#           xtitle='Pixel Locations', charsize=1.1, $
+			#           yrange = [0, max([thresh, max(crv[fitx])])]
+			#     oplot, fitx, fitdata/fitdata*thresh
+			#   endif else begin
+			#     plot, fitx, sqrt(crv[fitx]), title='Residuals', $
+			#           ytitle='Sigma Difference of Data vs. Expected', $
+			#           xtitle='Pixel Locations', charsize=1.1
+			#   endelse
+			#   !p.multi = 0
+			#   wait, 0.01
+			# endif
+
+			if not self.noupdate:
+				upd = np.multiply(fitmult, est, out=self.upd[:ngood])
+				if bgv is not None:
+					upd += bgv[fitx]
+				np.abs(upd, out=upd)
+				upd /= q
+				upd += v0
+				if skyvarv is not None:
+					upd += skyvarv[fitx]
+				varv[fitx] = upd
+			if np.any(bad):
+				badres = res[bad]
+				maxx = fitx[bad][badres == np.max(badres)]  # only eliminate max pixel
+				funccount = funccount + len(maxx)  # add count for bad pixels
+				if maskv is self.onemask:
+					maskv = np.array(maskv)
+				maskv[maxx] = 0  # mask bad pixel
+				funcdone = 1  # set so sequence loops
+
+		fiteval, coeffv = fit_func(self.allx, datav, varv, multv * maskv, True, coeffv, parm)
+
+		if counts is not None:
+			counts.update(vectors=1, iterations=itercount, rejected=funccount)
+		if outvarv is not None:
+			outvarv[:] = varv
+
+		return fiteval, maskv, errflag, coeffv
 
 
 def procvect(datav, **kwargs):
-	# Set Defaults and Check Inputs
-
-	nx = len(datav)
-
-	# Check if kwarg inputs exist, if not, set their defaults
-	xvals = kwargs.get("xvals", np.arange(nx))
-	varv = kwargs.get("varv", np.ones(nx))
-	multv = kwargs.get("multv", np.ones(nx))
-	maskv = kwargs.get("maskv", np.ones(nx, np.byte))
-	bgv = kwargs.get("bgv", np.zeros(nx))
-	skyvarv = kwargs.get('skyvarv', np.zeros(nx))
-	crv = kwargs.get("crv", np.zeros(nx))
-	thresh = kwargs.get("thresh", 3)
-	q = kwargs.get("q", 1)
-	v0 = kwargs.get("v0", 0)
-	bpct = kwargs.get("bpct", 0.5)
-	func = kwargs.get('func', "polyfunc")
-	verbose = kwargs.get("verbose", 0)
-	plottype = kwargs.get("plottype", 0)
-	parm = kwargs.get("parm", {})
-
-	# Error checking
-	if nx != len(varv): raise VectorLengthException("nx", "varv")
-	if nx != len(maskv): raise VectorLengthException("nx", "maskv")
-	if nx != len(multv) and len(multv) != 1:
-		raise VectorLengthException("nx", "multv")
-	if nx != bgv.size: raise VectorLengthException("nx", "bgv")
-	if nx != len(skyvarv): raise VectorLengthException("nx", "skyvarv")
-	if nx != len(crv): raise VectorLengthException("nx", "crv")
-	if thresh < 0: raise ParameterException("Threshold cannot be less than 0.")
-	if q < 0: raise ParameterException("Q cannot be less than 0.")
-	if v0 < 0: raise ParameterException("v0 cannot be less than 0.")
-	if bpct > 1 or bpct < 0: raise ParameterException(
-			"bpct must be between 0 and 1.")
-
-	if "vectnum" in kwargs:
-		vectnum_s = " at Vector # " + str(kwargs.get("vectnum"))
-	else:
-		vectnum_s = ""
-
-	# If an absolute threshold is used, use that threshold.  Else, square
-	# the sigma threshold so it can be used with variance calculations
-
-	absthresh = kwargs.get("absthresh", False)
-	if absthresh:
-		vthresh = thresh
-	else:
-		vthresh = thresh * thresh
-
-	# Set the error threshold to be the greatest of 6 pixels, 10% of the total pixels,
-	# or the given percentage of good pixels passed in.
-	errorthresh = max(len(maskv[xvals] == 1.) * (1 - bpct), len(xvals) * 0.10, 6)
-
-	errflag = 0
-	coeffv = 0
-	funcdone = 1
-	funccount = 0
-
-	noupdate = kwargs.get("noupdate", False)
-
-	# MAIN LOOP
-	# On each iteration, first check to make sure there is enough good pixels left
-	# to fit the data. Next, pull out the good pixels and pass them to the function.
-	# Calculate the residuals of each pixel, using either the difference between
-	# actual and estimated, or if sigma rejection is used, the difference and
-	# divide by the variance of the pixel. If the user requests a summary plot,
-	# plot the estimated variance vs actual and the residual. If needed, update the
-	# variance to reflect the new estimation. Reject the pixel with the largest
-	# residual larger than the threshold. If no bad pixels are found, exit the loop.
-
-	# Dynamically import the fitting function incase it is user-defined.
-	# Function name must be the same as the module name. (i.e. myfunc.myfunc())
-	fit_func = getattr(import_module("lib.fitting." + func), func)
-
-	while funcdone:
-		funcdone = 0
-		goodvals = maskv[xvals] == 1
-
-		if len(goodvals) < errorthresh:
-
-			fiteval = fit_func(np.arange(nx), datav, varv, multv * maskv, True, coeffv, parm)
-
-			if verbose > 2:
-				print("Too many pixels rejected" + vectnum_s)
-			errflag = 1
-			return fiteval, errflag
-
-		fitx = xvals[goodvals]
-		fitdata = datav[fitx]
-		fitvar = varv[fitx]
-		fitmult = multv[fitx]
-
-		est, coeffv = fit_func(fitx, fitdata, fitvar, fitmult, False, coeffv, parm)
-		if "absthresh" == True:
-			crv[fitx] = abs(fitdata / fitmult - est)
-		else:
-			crv[fitx] = (fitdata - fitmult * est) ** 2 / fitvar  # prevent divide by zero
-		badpix = np.where(crv[fitx] > vthresh)  # get bad locations
-
-		# TODO Procvect plotting
-
-		# 	if plottype[2] or (verbose eq 5) then begin
-		#           device, window_state = ws
-		#           if not ws[13] then window, 13 else wset, 13
-		#           !p.multi = [0,1,2,1,1]
-		#           plot, fitx, fitdata, $
-		#             title='Actual vs. Fitted' + vectnum_s, $
-		#             ytitle='Data Values (if applicable / Spec)', $
-		#             xtitle='Pixel Locations', charsize=1.1
-		#           oplot, fitx, est * fitmult
-		#   if keyword_set(absthresh) then begin
-		#     plot, fitx, crv[fitx], title='Residual', $
-		#           ytitle='Abs of Data - Expected', $
-		#           xtitle='Pixel Locations', charsize=1.1, $
-		#           yrange = [0, max([thresh, max(crv[fitx])])]
-		#     oplot, fitx, fitdata/fitdata*thresh
-		#   endif else begin
-		#     plot, fitx, sqrt(crv[fitx]), title='Residuals', $
-		#           ytitle='Sigma Difference of Data vs. Expected', $
-		#           xtitle='Pixel Locations', charsize=1.1
-		#   endelse
-		#   !p.multi = 0
-		#   wait, 0.01
-		# endif
-
-		if not noupdate:
-			varv[fitx] = (abs(fitmult * est + bgv[fitx])) / q + v0 + skyvarv[fitx]
-		if np.any(badpix):
-			badx = fitx[badpix]
-			maxpos = np.where(crv[badx] == max(crv[badx]))  # only eliminate max pixel
-			maxx = badx[maxpos]
-			funccount = funccount + len(maxx)  # add count for bad pixels
-			maskv[maxx] = 0  # mask bad pixel
-			funcdone = 1  # set so sequence loops
-
-	fiteval, coeffv = fit_func(np.arange(nx), datav, varv, multv*maskv, True, coeffv, parm)
-
-	if not noupdate:
-		varv = (abs(multv * fiteval + bgv)) / q + v0 + skyvarv # get var for all pixels
-
-	return fiteval, maskv, errflag, coeffv
\ No newline at end of file
+	# Check the options and vectors, then fit. A stage fitting many vectors
+	# should build a PreparedVect once and call it instead.
+	vect = {k: kwargs.pop(k) for k in _VECTOR_ARGS if k in kwargs}
+	fitter = PreparedVect(len(datav), **kwargs)
+	fitter.check(datav, **vect)
+	return fitter(datav, **vect)
@@ -0,0 +1,102 @@
+"""
+Name: profcache.py
+
+Purpose: Reuse of a fitted spatial profile across the frames of a time
+series. A ProfileCache holds the profim (and adjparms) fitted from a
+reference frame, or a median stack of frames, together with where the trace
+was. Each later frame is checked for trace drift by the centroids of the
+trace in a few blocks of rows, which costs one pass of sums over the
+aperture. Frames whose trace has not moved more than tol pixels take the
+cached profile, going straight from fitbg to extrspec, and a frame that
+drifted further is fitted and becomes the new reference.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Profile Fitting
+
+Calling Example:
+	cache = ProfileCache(tol=0.1)
+	for data in frames:
+		...
+		if cache.needs_fit(dataim, x1, x2):
+			fitprof(rc)
+			cache.store(rc)
+		else:
+			cache.apply(rc)
+
+Inputs:
+	tol:     the largest drift of the trace, in pixels, for which the
+			 cached profile is used (default 0.1)
+	nblocks: the number of blocks of rows the trace centroid is measured in,
+			 so that a tilt of the trace is seen as well as a shift
+			 (default 8)
+
+Outputs:
+	After needs_fit, drift holds the drift of the last frame checked, or None
+	when there was no profile to compare with. fits and reuses count the
+	frames fitted and those that took the cached profile.
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+
+NBLOCKS = 8
+
+
+def trace_centroids(dataim, x1, x2, nblocks=NBLOCKS):
+	"""
+	The centroid of the positive data between x1 and x2, in columns of
+	dataim, in each of nblocks blocks of rows.
+	"""
+	ny = np.shape(dataim)[0]
+	ap = np.maximum(dataim[:, x1:x2 + 1], 0)
+	edges = np.linspace(0, ny, min(nblocks, ny) + 1).astype(int)
+	colsum = np.add.reduceat(ap, edges[:-1], axis=0)
+	total = np.sum(colsum, 1)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		return np.sum(colsum * np.arange(x1, x2 + 1), 1) / total
+
+
+class ProfileCache:
+	def __init__(self, tol=0.1, nblocks=NBLOCKS):
+		self.tol = tol
+		self.nblocks = nblocks
+		self.profim = None
+		self.adjparms = None
+		self.centroids = None
+		self.aperture = None
+		self.drift = None
+		self.fits = 0
+		self.reuses = 0
+
+	def needs_fit(self, dataim, x1, x2):
+		"""
+		Returns True when the profile of dataim must be fitted: there is no
+		cached profile, the frame or aperture differ from the cached one, or
+		the trace drifted more than tol. Sets drift.
+		"""
+		self.drift = None
+		if self.profim is None or np.shape(dataim) != np.shape(self.profim) or (x1, x2) != self.aperture:
+			return True
+		centroids = trace_centroids(dataim, x1, x2, self.nblocks)
+		self.drift = float(np.nanmax(abs(centroids - self.centroids)))
+		return not self.drift <= self.tol
+
+	def store(self, rc):
+		# Keep the profile fitted for rc and where its trace was
+		self.profim = np.array(rc.profim)
+		self.adjparms = rc.adjparms
+		self.aperture = (rc.x1, rc.x2)
+		self.centroids = trace_centroids(rc.dataim, rc.x1, rc.x2, self.nblocks)
+		self.fits += 1
+
+	def apply(self, rc):
+		# Give rc the cached profile in place of fitting it
+		rc.profim = np.array(self.profim)
+		if self.adjparms is not None:
+			rc.adjparms = self.adjparms
+		self.reuses += 1
+		return rc.profim
@@ -0,0 +1,115 @@
+"""
+Name: quality.py
+
+Purpose: The quality plane of a frame: one uint8 image whose bits record why
+each pixel was left out, in place of reading the separate masks and error
+vectors of every stage. It is made from the input mask, and fitbg, stdextr,
+fitprof and extrspec read their masks from it, each deriving only the rows
+or aperture columns it fits, and set their bits in it in place. Downstream
+QA can then select pixels with bitwise operations on a single image.
+
+	Bit         Value  Set on
+	USER_BAD        1  pixels bad in the input mask
+	SKY_CR          2  sky pixels rejected by the background fit
+	PROF_CR         4  aperture pixels rejected by the profile fit
+	EXTR_CR         8  aperture pixels rejected by the optimal extraction
+	SKY_FAIL       16  rows whose background fit stopped (berrvect)
+	PROF_FAIL      32  the aperture of the rows or columns whose profile fit
+	                   stopped (perrvect)
+	EXTR_FAIL      64  the aperture of the rows whose extraction stopped
+	                   (eerrvect)
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Utilities
+
+Calling Example:
+	quality = quality_plane(inmask, np.shape(data))
+	bgim, varim, quality = fitbg(data, x1, x2, quality=quality, ...)
+	crs = (quality & (SKY_CR | EXTR_CR)) != 0
+	writer.add(prefix, "QUALITY", quality, quality_cards())
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+
+USER_BAD = 1
+SKY_CR = 2
+PROF_CR = 4
+EXTR_CR = 8
+SKY_FAIL = 16
+PROF_FAIL = 32
+EXTR_FAIL = 64
+
+# The bits, in order, with the description written to the FITS header
+QUALITY_BITS = (
+	("USER_BAD", USER_BAD, "bad in the input mask"),
+	("SKY_CR", SKY_CR, "rejected by the background fit"),
+	("PROF_CR", PROF_CR, "rejected by the profile fit"),
+	("EXTR_CR", EXTR_CR, "rejected by the optimal extraction"),
+	("SKY_FAIL", SKY_FAIL, "row background fit stopped"),
+	("PROF_FAIL", PROF_FAIL, "row or column profile fit stopped"),
+	("EXTR_FAIL", EXTR_FAIL, "row extraction stopped"),
+)
+
+# The bits that leave a pixel out of the fits that follow
+REJECTED = USER_BAD | SKY_CR
+
+
+def quality_plane(inmask=None, shape=None):
+	"""
+	Returns a new quality plane with USER_BAD set where inmask is not 1, or
+	of the given shape with no bits set without inmask.
+	"""
+	if inmask is None:
+		return np.zeros(shape, np.uint8)
+	return np.where(np.asarray(inmask) == 1, 0, USER_BAD).astype(np.uint8)
+
+
+def quality_mask(quality, bits=REJECTED, dtype=np.double):
+	"""
+	The mask of the pixels of quality without any of bits set: 1 for good
+	pixels, 0 for bad, as the stages read inmask.
+	"""
+	return ((quality & bits) == 0).astype(dtype)
+
+
+def mark(quality, where, bit, cols=slice(None)):
+	"""
+	Sets bit, in place, on the pixels of columns cols of quality where the
+	boolean image where, the shape of those columns, is True. cols is a
+	slice or an array of column numbers.
+	"""
+	quality[:, cols] |= np.where(where, bit, 0).astype(quality.dtype)
+
+
+def mark_rows(quality, errvect, bit, cols=slice(None), byrow=True):
+	"""
+	Sets bit, in place, on columns cols of the rows of quality where errvect
+	is 0, or without byrow, on the columns cols where it is 0.
+	"""
+	failed = np.asarray(errvect) == 0
+	if not np.any(failed):
+		return
+	if byrow:
+		mark(quality, failed[:, None], bit, cols)
+	else:
+		mark(quality, failed[None, :], bit, cols)
+
+
+def quality_counts(quality):
+	"""
+	Returns a dict of the number of pixels with each bit set.
+	"""
+	return {name: int(np.count_nonzero(quality & bit)) for name, bit, desc in QUALITY_BITS}
+
+
+def quality_cards():
+	"""
+	Returns the header cards of a quality extension, the meaning of each bit
+	as QBITn = (name, description).
+	"""
+	return {"QBIT%d" % n: (bitname, desc) for n, (bitname, bit, desc) in enumerate(QUALITY_BITS)}
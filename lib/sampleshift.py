@@ -1,17 +1,441 @@
 """
-Name:
+Name: sampleshift.py
 
-Purpose:
+Purpose: Shifts an array according to an input coordinate array, then
+resamples it onto an output coordinate array, to change the geometry of a
+profile image and to revert it.
 
 Category:
+	Optimal Spectrum Extraction Package
+		- Shifting Procedures
 
 Calling Example:
+	result = sampleshift(data, inx, outx, fitspline=True)
+	operator = sampleshift_operator(inx, outx, fitspline=True)
+	results = resample(operator, np.stack([data, varim], -1))
 
 Inputs:
+	data:   The array to be modified, dimension (ny, nxi), rows in wavelength.
+	inx:    Array of x positions in the reference frame for each pixel in
+			data, increasing (or decreasing) along each row.
+	outx:   The x position values for the output array, dimension (ny, nxo).
+
+Keyword Parameters:
+	fitsample:  Set to sample the data when changing shape.
+	fitinterp:  Set to use linear interpolation.
+	fitspline:  Set to use a spline when upsizing (the default).
+	fitaverage: Set to use nearest neighbor averaging when downsizing.
+	fitpoly:    Set to use polynomial fitting when downsizing.
+	fitcubic:   Set to use a cubic convolution.
+	degcontr:   Degree of fit to use when downsizing (2).
+
+	The first option set, in the order above, is used.
+
+	The spline is a natural cubic spline through each row (0 second
+	derivative at its ends). IDL's sampleshift called spline with a tension
+	of 0.1, which is close to a cubic spline, so the two differ slightly,
+	most near the ends of a row and around sharp features.
 
 Outputs:
+	Returns the data array, dimension (ny, nxo), that has been expanded or
+	contracted and/or shifted. Output coordinates outside a row's inx take
+	the data of the nearest end of the row.
+
+	Every mode works on all rows at once. The pixels of inx that bracket or
+	surround each output coordinate are found with np.searchsorted and the
+	data gathered from them, so memory goes as ny*nxo rather than the
+	ny*nxi*nxo of comparing every pair of coordinates.
+
+	Every mode is linear in the data, so the resampling of one geometry can
+	be compiled by sampleshift_operator into a sparse matrix, and applied to
+	any number of images by resample. The spline, whose weights reach every
+	pixel of a row, is compiled into a SplineOperator of its sparse parts,
+	whose tridiagonal solve is done when it is applied.
 
 History:
 
 Created on 10/5/2021$
 """
+
+from lib.excep import *
+import numpy as np
+
+MODES = ("fitsample", "fitinterp", "fitspline", "fitcubic", "fitaverage", "fitpoly")
+
+
+def searchsorted_rows(inx, outx, side="left"):
+	"""
+	np.searchsorted of each row of outx in the same row of inx, whose rows
+	must be increasing. The rows are offset from each other so that one call
+	searches them all.
+	"""
+	ny, nxi = np.shape(inx)
+	lo = min(np.min(inx), np.min(outx))
+	span = max(np.max(inx), np.max(outx)) - lo + 1.
+	rows = np.arange(ny)[:, None]
+	idx = np.searchsorted(np.ravel(inx - lo + rows * span), np.ravel(outx - lo + rows * span), side)
+	return np.reshape(idx, np.shape(outx)) - rows * nxi
+
+
+def _bracket(inx, outx):
+	# The pixels below and above each output coordinate, and the weight of the
+	# one above, clipped to the ends of the row
+	nxi = np.shape(inx)[1]
+	hi = np.clip(searchsorted_rows(inx, outx), 1, nxi - 1)
+	lo = hi - 1
+	xlo = np.take_along_axis(inx, lo, 1)
+	xhi = np.take_along_axis(inx, hi, 1)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		weight = np.clip(np.where(xhi != xlo, (outx - xlo) / (xhi - xlo), 0.), 0, 1)
+	return lo, hi, weight
+
+
+def _pad(idx, w, k):
+	# Pad the last axis of a gather out to k pixels of zero weight
+	extra = k - np.shape(idx)[-1]
+	if extra <= 0:
+		return idx, w
+	return (np.concatenate([idx, np.repeat(idx[..., -1:], extra, -1)], -1),
+	        np.concatenate([w, np.zeros(np.shape(w)[:-1] + (extra,))], -1))
+
+
+def _sample(inx, outx):
+	# The pixel with the closest coordinate, the lower one on a tie
+	lo, hi, weight = _bracket(inx, outx)
+	xlo = np.take_along_axis(inx, lo, 1)
+	xhi = np.take_along_axis(inx, hi, 1)
+	near = np.where(abs(outx - xlo) <= abs(xhi - outx), lo, hi)
+	return near[..., None], np.ones(np.shape(near) + (1,))
+
+
+def _interp(inx, outx):
+	# Linear interpolation between the closest coordinates above and below
+	lo, hi, weight = _bracket(inx, outx)
+	return np.stack([lo, hi], -1), np.stack([1 - weight, weight], -1)
+
+
+def _cubic(inx, outx):
+	# Cubic convolution of -0.5 on the pixel index of each output coordinate,
+	# taking the input coordinates of a row to be evenly spaced
+	nxi = np.shape(inx)[1]
+	minx = np.min(inx, 1)[:, None]
+	maxx = np.max(inx, 1)[:, None]
+	xvals = np.clip((outx - minx) / (maxx - minx) * (nxi - 1), 0, nxi - 1)
+	i0 = np.floor(xvals).astype(int)
+	t = xvals - i0
+
+	a = -0.5
+	d = abs(t[..., None] - np.arange(-1, 3))
+	w = np.where(d <= 1, (a + 2) * d ** 3 - (a + 3) * d ** 2 + 1,
+	             np.where(d < 2, a * d ** 3 - 5 * a * d ** 2 + 8 * a * d - 4 * a, 0.))
+	return np.clip(i0[..., None] + np.arange(-1, 3), 0, nxi - 1), w
+
+
+def _window(inx, outx, halfwidth):
+	# The first and one past the last pixel within halfwidth of each output
+	# coordinate
+	first = searchsorted_rows(inx, outx - halfwidth, "left")
+	last = searchsorted_rows(inx, outx + halfwidth, "right")
+	return first, last
+
+
+def _window_gather(first, last, nxi, sel):
+	# The pixels of the windows of the selected output coordinates, padded to
+	# the longest window, and which of them are in the window
+	nwin = max(np.max(last[sel] - first[sel]), 1)
+	idx = first[sel][:, None] + np.arange(nwin)
+	inside = idx < last[sel][:, None]
+	return np.minimum(idx, nxi - 1), inside
+
+
+def _average(inx, outx):
+	# The mean of the pixels within half the output spacing of each output
+	# coordinate. Coordinates without a pixel in range are interpolated.
+	ny, nxi = np.shape(inx)
+	nxo = np.shape(outx)[1]
+	halfwidth = np.mean(np.diff(outx, axis=1)) / 2 if nxo > 1 else 0.5
+	first, last = _window(inx, outx, abs(halfwidth))
+	count = last - first
+
+	idx, w = _interp(inx, outx)
+	some = count > 0
+	if np.any(some):
+		widx, inside = _window_gather(first, last, nxi, some)
+		k = max(np.shape(widx)[1], 2)
+		idx, w = _pad(idx, w, k)
+		idx[some], w[some] = _pad(widx, inside / count[some][:, None], k)
+	return idx, w
+
+
+def _poly(inx, outx, degcontr):
+	# A polynomial of degree degcontr fitted to the pixels within half the
+	# output spacing of each output coordinate, or a line if there are too
+	# few of them. With one pixel in range it is used, and with none the
+	# data is interpolated. The pixels of every window are gathered into one
+	# block, padded with zero weights, and all the fits solved at once. The
+	# fit at the output coordinate is a weighted sum of the window's pixels.
+	ny, nxi = np.shape(inx)
+	nxo = np.shape(outx)[1]
+	halfwidth = abs(np.mean(np.diff(outx, axis=1), 1) / 2)[:, None] if nxo > 1 else np.full((ny, 1), 0.5)
+	first, last = _window(inx, outx, halfwidth)
+	count = last - first
+
+	idx, w = _interp(inx, outx)
+	one = count == 1
+	idx[one] = np.minimum(first[one], nxi - 1)[:, None]
+	w[one] = [1., 0.]
+
+	fit = count >= 2
+	if np.any(fit):
+		widx, inside = _window_gather(first, last, nxi, fit)
+		rows = np.nonzero(fit)[0][:, None]
+		scale = np.maximum(np.broadcast_to(halfwidth, np.shape(outx))[fit][:, None], 1e-12)
+		xw = (inx[rows, widx] - outx[fit][:, None]) / scale
+
+		nfit = count[fit]
+		deg = np.where(nfit > degcontr, degcontr, 1)
+		fitw = np.zeros(np.shape(xw))
+		for d in np.unique(deg):
+			sel = deg == d
+			vander = xw[sel][:, :, None] ** np.arange(d + 1) * inside[sel][:, :, None]
+			alpha = np.swapaxes(vander, 1, 2) @ vander
+			# The fit at the output coordinate, x = 0, is its constant term
+			fitw[sel] = (np.linalg.pinv(alpha) @ np.swapaxes(vander, 1, 2))[:, 0, :]
+
+		k = max(np.shape(widx)[1], 2)
+		idx, w = _pad(idx, w, k)
+		idx[fit], w[fit] = _pad(widx, fitw, k)
+	return idx, w
+
+
+def _spline_second(inx, data):
+	# The second derivatives of the natural cubic spline through each row of
+	# data, which may have trailing axes, solved for every row together by
+	# the tridiagonal algorithm
+	ny, nxi = np.shape(inx)
+	trail = (slice(None), slice(None)) + (None,) * (np.ndim(data) - 2)
+	h = np.diff(inx, axis=1)
+	slope = np.diff(data, axis=1) / h[trail]
+	diag = 2 * (h[:, :-1] + h[:, 1:])
+	rhs = 6 * np.diff(slope, axis=1)
+
+	# Forward elimination and back substitution over the interior points
+	for i in range(1, nxi - 2):
+		factor = h[:, i] / diag[:, i - 1]
+		diag[:, i] -= factor * h[:, i]
+		rhs[:, i] -= factor[trail[:1] + trail[2:]] * rhs[:, i - 1]
+	m = np.zeros(np.shape(data))
+	m[:, nxi - 2] = rhs[:, -1] / diag[:, -1][trail[:1] + trail[2:]]
+	for i in range(nxi - 4, -1, -1):
+		m[:, i + 1] = ((rhs[:, i] - h[:, i + 1][trail[:1] + trail[2:]] * m[:, i + 2]) /
+		               diag[:, i][trail[:1] + trail[2:]])
+	return h, m
+
+
+def _spline_terms(inx, outx, h):
+	# The bracketing pixels of each output coordinate and the weights of their
+	# values and second derivatives in the spline
+	lo, hi, weight = _bracket(inx, outx)
+	hk = np.take_along_axis(h, lo, 1)
+	a = 1 - weight
+	b = weight
+	return lo, hi, a, b, (a ** 3 - a) * hk ** 2 / 6, (b ** 3 - b) * hk ** 2 / 6
+
+
+def _spline(data, inx, outx):
+	# A natural cubic spline through each row
+	if np.shape(inx)[1] < 3:
+		idx, w = _interp(inx, outx)
+		return _gather(data, idx, w)
+	h, m = _spline_second(inx, data)
+	lo, hi, a, b, clo, chi = _spline_terms(inx, outx, h)
+	take = lambda arr, i: np.take_along_axis(arr, i, 1)
+	return a * take(data, lo) + b * take(data, hi) + clo * take(m, lo) + chi * take(m, hi)
+
+
+def _gather(data, idx, w):
+	# Sum the weighted pixels of each output coordinate
+	rows = np.arange(np.shape(data)[0])[:, None, None]
+	return np.sum(w * data[rows, idx], -1)
+
+
+def _setup(inx, outx, kwargs):
+	# Check the options and coordinates, returning the mode, degcontr, the
+	# coordinates with increasing rows and the rows that were flipped
+	inx = np.asarray(inx, np.double)
+	outx = np.asarray(outx, np.double)
+
+	degcontr = kwargs.get("degcontr")
+	if degcontr is None:
+		degcontr = 2
+	if degcontr < 0:
+		raise ParameterException("Degree of fit must be >= 0.")
+	if np.shape(outx)[0] != np.shape(inx)[0]:
+		raise ParameterException("outx must have equal size y dimension to data")
+
+	mode = next((m for m in MODES if kwargs.get(m)), "fitspline")
+
+	# Work on rows of increasing coordinates
+	flip = inx[:, 0] > inx[:, -1]
+	if np.any(flip):
+		inx = np.where(flip[:, None], inx[:, ::-1], inx)
+	return mode, degcontr, inx, outx, flip
+
+
+def _weights(mode, inx, outx, degcontr):
+	# The pixels and weights of each output coordinate for mode
+	if mode == "fitsample":
+		idx, w = _sample(inx, outx)
+	elif mode == "fitinterp":
+		idx, w = _interp(inx, outx)
+	elif mode == "fitspline":
+		idx, w = _interp(inx, outx)  # rows too short for a spline
+	elif mode == "fitcubic":
+		idx, w = _cubic(inx, outx)
+	elif mode == "fitaverage":
+		idx, w = _average(inx, outx)
+	else:
+		idx, w = _poly(inx, outx, degcontr)
+
+	# Repeat the first or last pixel so that extrapolation does not occur
+	if mode in ("fitspline", "fitpoly"):
+		idx = np.array(idx)
+		for end, outside in ((0, outx <= inx[:, :1]), (np.shape(inx)[1] - 1, outx >= inx[:, -1:])):
+			idx[outside] = end
+			w[outside] = 0.
+			w[outside, 0] = 1.
+	return idx, w
+
+
+def sampleshift(data, inx, outx, **kwargs):
+
+	data = np.asarray(data, np.double)
+	ny, nxi = np.shape(data)
+	if np.shape(inx) != (ny, nxi):
+		raise ParameterException("inx must be equal in size to data")
+
+	mode, degcontr, inx, outx, flip = _setup(inx, outx, kwargs)
+	if np.any(flip):
+		data = np.where(flip[:, None], data[:, ::-1], data)
+
+	if mode == "fitspline":
+		# Solved directly rather than through the weights of every pixel
+		mdata = _spline(data, inx, outx)
+		below = outx <= inx[:, :1]
+		above = outx >= inx[:, -1:]
+		return np.where(below, data[:, :1], np.where(above, data[:, -1:], mdata))
+
+	idx, w = _weights(mode, inx, outx, degcontr)
+	return _gather(data, idx, w)
+
+
+def _sparse(rows, cols, w, shape, tol=0.):
+	# A csr matrix of the weights w at rows, cols, broadcast together,
+	# without the weights no larger than tol
+	from scipy.sparse import csr_matrix
+
+	rows, cols, w = np.broadcast_arrays(rows, cols, w)
+	keep = abs(w) > tol
+	return csr_matrix((w[keep], (rows[keep], cols[keep])), shape=shape)
+
+
+class SplineOperator:
+	"""
+	The natural cubic spline of sampleshift_operator, kept as its sparse
+	parts rather than as one matrix, whose rows would reach every pixel of
+	a row of data. Applied to data, the second derivatives m of the
+	interior pixels of each row are solved from rhs @ data by the
+	tridiagonal system of the row, held in bands, and the spline is
+	values @ data + second @ m. Each output coordinate takes 4 terms and
+	each input pixel 6.
+	"""
+
+	def __init__(self, values, second, rhs, bands):
+		self.values = values
+		self.second = second
+		self.rhs = rhs
+		self.bands = bands
+		self.shape = values.shape
+		self.nnz = values.nnz + second.nnz + rhs.nnz + np.count_nonzero(bands)
+
+	def __matmul__(self, data):
+		from scipy.linalg import solve_banded
+
+		m = solve_banded((1, 1), self.bands, self.rhs @ data)
+		return self.values @ data + self.second @ m
+
+
+def _spline_operator(inx, outx, flip, tol):
+	# The SplineOperator from inx to outx, whose flipped rows take the data
+	# in decreasing order
+	ny, nxi = np.shape(inx)
+	nxo = np.shape(outx)[1]
+	nm = nxi - 2
+	h = np.diff(inx, axis=1)
+	lo, hi, a, b, clo, chi = _spline_terms(inx, outx, h)
+
+	# Output coordinates outside the row take its nearest end pixel
+	below = outx <= inx[:, :1]
+	outside = below | (outx >= inx[:, -1:])
+	lo = np.where(outside, np.where(below, 0, nxi - 1), lo)
+	a = np.where(outside, 1., a)
+	b, clo, chi = (np.where(outside, 0., w) for w in (b, clo, chi))
+
+	def columns(j):
+		# The columns of the data of pixels j of each row
+		shape = (ny,) + (1,) * (np.ndim(j) - 1)
+		return np.where(flip.reshape(shape), nxi - 1 - j, j) + np.arange(ny).reshape(shape) * nxi
+
+	out = np.arange(ny * nxo).reshape(ny, nxo, 1)
+	pix = np.stack([lo, hi], -1)
+	values = _sparse(out, columns(pix), np.stack([a, b], -1), (ny * nxo, ny * nxi), tol)
+	interior = (pix > 0) & (pix < nxi - 1)
+	second = _sparse(out, np.arange(ny).reshape(ny, 1, 1) * nm + np.clip(pix - 1, 0, nm - 1),
+	                 np.where(interior, np.stack([clo, chi], -1), 0.), (ny * nxo, ny * nm), tol)
+
+	# Each interior pixel's equation, 6 times the change of slope across it
+	hl, hr = h[:, :-1], h[:, 1:]
+	k = np.arange(ny * nm).reshape(ny, nm, 1)
+	pix = np.broadcast_to(np.arange(nm)[:, None] + np.arange(3), (ny, nm, 3))
+	rhs = _sparse(k, columns(pix), 6 * np.stack([1 / hl, -1 / hl - 1 / hr, 1 / hr], -1), (ny * nm, ny * nxi))
+
+	# The tridiagonal systems of all rows, uncoupled, in solve_banded's form
+	bands = np.zeros((3, ny, nm))
+	bands[0, :, 1:] = h[:, 1:-1]
+	bands[1] = 2 * (hl + hr)
+	bands[2, :, :-1] = h[:, 1:-1]
+	return SplineOperator(values, second, rhs, np.reshape(bands, (3, ny * nm)))
+
+
+def sampleshift_operator(inx, outx, tol=1e-10, **kwargs):
+	"""
+	The resampling of sampleshift from the coordinates inx to outx, with the
+	same options, as a sparse matrix of shape (ny*nxo, ny*nxi), or for the
+	spline a SplineOperator of that shape. Weights smaller than tol are
+	dropped. The operator depends only on the coordinates, so one geometry
+	is compiled once and any number of images resampled with it by
+	resample.
+	"""
+	mode, degcontr, inx, outx, flip = _setup(inx, outx, kwargs)
+	ny, nxi = np.shape(inx)
+	nxo = np.shape(outx)[1]
+
+	if mode == "fitspline" and nxi >= 3:
+		return _spline_operator(inx, outx, flip, tol)
+
+	idx, w = _weights(mode, inx, outx, degcontr)
+	idx = np.where(flip[:, None, None], nxi - 1 - idx, idx)
+	return _sparse(np.arange(ny * nxo).reshape(ny, nxo, 1), idx + np.arange(ny)[:, None, None] * nxi, w,
+	               (ny * nxo, ny * nxi), tol)
+
+
+def resample(operator, data):
+	"""
+	Applies a sampleshift_operator to data of dimension (ny, nxi), or to a
+	stack of images (ny, nxi, nimage) in one sparse product, returning
+	(ny, nxo) or (ny, nxo, nimage).
+	"""
+	ny, nxi = np.shape(data)[:2]
+	nxo = operator.shape[0] // ny
+	out = operator @ np.reshape(data, (ny * nxi, -1))
+	return np.reshape(out, (ny, nxo) + np.shape(data)[2:])
@@ -0,0 +1,134 @@
+"""
+Name: stats.py
+
+Purpose: Timing and counters of a reduction. A Stats records the wall time of
+each stage of the pipeline and, for the stages that clip vectors, how many
+vectors were fitted, how many clipping iterations they took, how many pixels
+were rejected and how many vectors stopped with errflag set.
+
+Counting is done by procvect and procblock into a plain Counter passed as
+their counts keyword. Row loops run in worker processes return their
+Counters, which the stage merges into its Stats. With stats disabled, the
+stages get NOSTATS, whose methods do nothing, and procvect gets no counts.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Utilities
+
+Calling Example:
+	stats = Stats()
+	with stats.stage("fitbg"):
+		bgim, varim, inmask = fitbg(data, x1, x2, stats=stats)
+	stats.to_json("stats.json")
+
+Counters:
+	vectors:    procvect calls, or rows fitted by procblock
+	iterations: clipping fits of those vectors, not counting the final evaluation
+	rejected:   pixels masked by the clipping
+	errflag:    vectors that exited with too many pixels rejected
+	noprofile:  rows extracted without a good pixel of profile, given 0
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import csv
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+COUNTERS = ("vectors", "iterations", "rejected", "errflag", "noprofile")
+
+
+class Stats:
+	def __init__(self):
+		self.enabled = True
+		self.times = {}
+		self.counts = {}
+
+	@contextmanager
+	def stage(self, name):
+		"""
+		Times the body of the with statement as stage name. Repeated stages
+		add up.
+		"""
+		start = time.perf_counter()
+		try:
+			yield self
+		finally:
+			self.times[name] = self.times.get(name, 0.) + time.perf_counter() - start
+
+	def counter(self):
+		# A new Counter for procvect or procblock to count into
+		return Counter()
+
+	def merge(self, name, counts):
+		"""
+		Adds a Counter, or a list of them as returned by parmap, to the
+		counters of stage name. None entries are skipped.
+		"""
+		if isinstance(counts, Counter):
+			counts = [counts]
+		total = self.counts.setdefault(name, Counter())
+		for c in counts:
+			if c is not None:
+				total.update(c)
+
+	def as_dict(self):
+		"""
+		Returns {stage: {"time": seconds, counter: count, ...}} over every
+		stage timed or counted, in the order they were first seen.
+		"""
+		out = {}
+		for name in list(self.times) + [n for n in self.counts if n not in self.times]:
+			entry = {"time": self.times.get(name)}
+			entry.update({c: self.counts.get(name, {}).get(c, 0) for c in COUNTERS})
+			out[name] = entry
+		return out
+
+	def summary(self):
+		# A table of the stages, one line each
+		lines = ["%-10s %10s" % ("stage", "time (s)") + "".join("%12s" % c for c in COUNTERS)]
+		for name, entry in self.as_dict().items():
+			time_s = "%10.3f" % entry["time"] if entry["time"] is not None else "%10s" % "-"
+			lines.append("%-10s %s" % (name, time_s) + "".join("%12d" % entry[c] for c in COUNTERS))
+		return "\n".join(lines)
+
+	def to_json(self, path):
+		with open(path, "w") as f:
+			json.dump(self.as_dict(), f, indent=1)
+
+	def to_csv(self, path):
+		with open(path, "w", newline="") as f:
+			writer = csv.writer(f)
+			writer.writerow(("stage", "time") + COUNTERS)
+			for name, entry in self.as_dict().items():
+				writer.writerow([name, entry["time"]] + [entry[c] for c in COUNTERS])
+
+	def dump(self, path):
+		# Write to path as CSV if it ends with .csv, else as JSON
+		if path.lower().endswith(".csv"):
+			self.to_csv(path)
+		else:
+			self.to_json(path)
+
+
+class _NoStats(Stats):
+	# Stats that records nothing, for reductions run without stats
+	def __init__(self):
+		super().__init__()
+		self.enabled = False
+
+	def stage(self, name):
+		return nullcontext(self)
+
+	def counter(self):
+		return None
+
+	def merge(self, name, counts):
+		pass
+
+
+NOSTATS = _NoStats()
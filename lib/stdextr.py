@@ -17,9 +17,13 @@ Inputs:
 	x1,x2: boundaries in x over which spectrum will be summed
 	
 	Optional Inputs:
-	inmask: the cosmic ray mask for the data image
+	inmask: the cosmic ray mask for the data image (default: every pixel good)
+	quality: a quality plane (see quality.py) to read the mask of the aperture
+			from instead of inmask
 	adjspec: set to linearly interpolate the data, then extract the standard spectrum. Only useful if input mask has
 			bad pixels.
+	inplace: with adjspec, set to write the interpolated pixels into dataim itself. Otherwise dataim is left
+			untouched and the returned image is a copy.
 	
 
 Outputs:
@@ -27,6 +31,8 @@ Outputs:
 	Returns stdspec, an array of length n containing extracted spectra, where n is the number of wavelengths of the 
 	image (vertical direction).
 	stdvar: variance of extracted spectra, length n where n is the number of wavelengths taken of the image (vertical direction)
+	adjspec: with adjspec, the sum of the interpolated aperture of each row, otherwise False
+	dataim: the data image, with the bad pixels of the aperture interpolated if adjspec is set
 
 	
 Restrictions:
@@ -38,8 +44,26 @@ Created on 9/19/2021$
 """
 
 from lib.excep import ParameterException
+from lib.utils import fill_bad, constant_plane, constant_value
+from lib.quality import quality_mask
 import numpy as np
-from scipy import interpolate
+
+
+def repair_aperture(dataim, inmask, x1, x2):
+	"""
+	Linearly interpolates over the bad pixels of the aperture x1..x2 of every
+	row at once, the rows being filled from the nearest good pixels either
+	side, or the nearest one past the ends. Returns the repaired aperture
+	and its sum, the adjusted spectrum. dataim is not changed.
+	"""
+	cols = slice(x1, x2 + 1)
+	return _repair(dataim[:, cols], inmask[:, cols])
+
+
+def _repair(aperture, apmask):
+	aperture = fill_bad(np.asarray(aperture, np.double), apmask == 1)
+	return aperture, np.sum(aperture, 1)
+
 
 def stdextr(dataim, varim, x1, x2, **kwargs):
 
@@ -47,8 +71,10 @@ def stdextr(dataim, varim, x1, x2, **kwargs):
 	ny = np.shape(dataim)[0]
 	nx = np.shape(dataim)[1]
 
-	inmask = kwargs.get("inmask", np.ones((nx, ny)))
-
+	inmask = kwargs.get("inmask")
+	quality = kwargs.get("quality")
+	if inmask is None:
+		inmask = constant_plane(1., (ny, nx))
 
 	if x1 < 0 or x1 > x2:
 		raise ParameterException("x1 must be greater than 0 and less than x2.")
@@ -56,23 +82,37 @@ def stdextr(dataim, varim, x1, x2, **kwargs):
 		raise ParameterException("x2 must be less than nx-1 and greater than x1.")
 	if np.shape(varim)[1] != nx or np.shape(varim)[0] != ny:
 		raise ParameterException("varim must be the same shape as dataim.")
-	if np.shape(inmask)[1] != nx or np.shape(inmask)[0] != ny:
+	if np.shape(inmask if quality is None else quality) != (ny, nx):
 		raise ParameterException("inmask must be the same shape as dataim.")
 
+	# With no mask, or a constant mask of 1, every pixel is good: there is
+	# nothing to interpolate over and the sums need no masking. The mask of
+	# the aperture is read from the quality plane when there is one.
+	cols = slice(x1, x2 + 1)
+	if quality is not None:
+		apmask = quality_mask(quality[:, cols], dtype=np.byte)
+		allgood = False
+	else:
+		apmask = inmask[:, cols]
+		allgood = constant_value(inmask) == 1
+
 	# Interpolate over bad pixels
 	adjspec = kwargs.get("adjspec", False)
 	if adjspec:
-		adjspec = np.zeros(ny)
-		for i in range(ny):
-			bv = np.where(inmask[i, x1:x2] == 0)[0]
-			gv = np.where(inmask[i, x1:x2] == 1)[0]
-			datav = dataim[i, x1:x2]
-			if len(bv) > 0:
-				interpfunc = interpolate.interp1d(gv, datav[gv],  kind='linear')
-				datav[bv] = interpfunc(bv)
-			adjspec[i] = np.sum(datav)
-
-	stdspec = np.sum((dataim * inmask)[:, x1:x2], 1)
-	stdvar = np.sum((varim * inmask)[:, x1:x2], 1)
-
-	return stdspec, stdvar, adjspec, dataim
\ No newline at end of file
+		if allgood:
+			adjspec = np.sum(dataim[:, cols], 1, dtype=np.result_type(dataim, np.double))
+		else:
+			aperture, adjspec = _repair(dataim[:, cols], apmask)
+		if not kwargs.get("inplace", False):
+			dataim = np.array(dataim, np.result_type(dataim, np.double))
+		if not allgood:
+			dataim[:, cols] = aperture
+
+	if allgood:
+		stdspec = np.sum(dataim[:, cols], 1, dtype=np.result_type(dataim, np.double))
+		stdvar = np.sum(varim[:, cols], 1, dtype=np.result_type(varim, np.double))
+	else:
+		stdspec = np.sum(dataim[:, cols] * apmask, 1, dtype=np.result_type(dataim, np.double))
+		stdvar = np.sum(varim[:, cols] * apmask, 1, dtype=np.result_type(varim, np.double))
+
+	return stdspec, stdvar, adjspec, dataim
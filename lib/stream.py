@@ -0,0 +1,199 @@
+"""
+Name: stream.py
+
+Purpose: Runs the extraction pipeline on a frame one block of rows at a time.
+Without a geometry adjustment, the background fit, its subtraction and the
+standard sum are local to each row, so they run block by block through a
+chain of generators, and only the columns x1..x2 of each block are kept. The
+full frame background, subtracted and variance images are never built. The
+profile fit, which fits each column along the whole wavelength axis, and the
+optimal extraction then run on the (ny, x2-x1+1) aperture images.
+
+The results are identical to those of the staged pipeline of reduce_frame
+(fitbg, stdextr, fitprof and extrspec on full frame images): each block is
+read in the types reduce_frame keeps the frame in, every row is fitted
+alone, and the aperture stages see the same values.
+
+Category:
+	Optimal Spectrum Extraction Package
+		- Pipeline
+
+Calling Example:
+	rc = streamextr(data, opts)
+	optspec = rc.optspec
+
+Inputs:
+	data: the data image, (ny, nx). A memory mapped image is read one block at
+		  a time.
+	opts: the pipeline configuration, as for reduce_frame. x1, x2, q and rn
+		  are required.
+
+Keyword Arguments (in opts):
+	blockrows: number of rows per block (default 256)
+	dtype: float32 or float64, for the blocks and the aperture images
+		   (default float64)
+	var, inmask, skyvar: full frame images, sliced by block when given
+	stats: a Stats timing the stages and counting their fits. The time of each
+		   block's background fit and standard sum adds to fitbg and stdextr.
+	Other options are passed to fitbg, stdextr, fitprof and extrspec.
+	workers and chunks are only used by the aperture stages.
+
+Outputs:
+	A Config with the results of every stage: stdspec, stdvar, adjspec, spec,
+	optspec, opvar, the aperture images dataim (background subtracted), bgim,
+	varim, skyvar, quality, profim, and berrvect, the rows where the background
+	fit stopped. bgsub is the subtracted aperture before stdextr repairs it
+	(dataim itself without adjspec). xoffset is the column of the frame the
+	aperture images start at, and x1, x2 are the aperture bounds within them.
+
+History:
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.excep import ParameterException
+from lib.fitbg import fitbg
+from lib.stdextr import stdextr
+from lib.vectsetup import fitprof, extrspec
+from lib.utils import Config, sky_bounds, plane_dtype
+from lib.quality import quality_plane
+from lib.stats import NOSTATS
+
+
+def row_blocks(data, blockrows, opts):
+	"""
+	Yields (lo, hi, block) for each block of rows of data, where block is a
+	dict of the data, variance and sky variance rows and the quality plane of
+	the rows made from the inmask option. The rows are in the types
+	reduce_frame works on the whole frame in: the data in the dtype option,
+	or without it in its own floating point type, and the variance made in
+	the dtype option, or double.
+	"""
+	ny, nx = np.shape(data)
+	dtype = plane_dtype(opts.get('dtype'))
+	datatype = dtype if opts.get('dtype') else np.result_type(data.dtype, np.float32)
+	for lo in range(0, ny, blockrows):
+		hi = min(lo + blockrows, ny)
+		datab = np.array(data[lo:hi], datatype)
+
+		if opts.get('var') is not None:
+			varb = np.array(opts['var'][lo:hi])
+		else:
+			varb = np.abs(datab, dtype=dtype)
+			varb /= opts['q']
+			varb += opts['rn'] ** 2
+		if opts.get('inmask') is not None:
+			qualityb = quality_plane(opts['inmask'][lo:hi])
+		else:
+			qualityb = quality_plane(shape=(hi - lo, nx))
+		if opts.get('skyvar') is not None:
+			skyvarb = np.array(opts['skyvar'][lo:hi], dtype)
+		else:
+			skyvarb = np.zeros((hi - lo, nx), dtype)
+
+		yield lo, hi, dict(data=datab, varim=varb, skyvar=skyvarb, quality=qualityb)
+
+
+def bg_stage(blocks, x1, x2, opts):
+	"""
+	Fits and subtracts the background of each block, yielding its aperture
+	columns: the subtracted data, background, variance, sky variance and quality.
+	"""
+	cols = slice(x1, x2 + 1)
+	# Only scalar options reach fitbg. Blocks are fitted in this process.
+	bgopts = {k: v for k, v in opts.items() if not isinstance(v, np.ndarray)
+	          and k not in ("var", "inmask", "skyvar", "varim", "x1", "x2", "workers", "chunks")}
+	gotovect = opts.get('bgotovect', -1)
+	stats = opts.get('stats') or NOSTATS
+
+	for lo, hi, block in blocks:
+		if opts.get('nobgfit'):
+			bgim = np.zeros(np.shape(block['data'])) + opts['bgmedian']
+			berrvect = np.ones(hi - lo)
+		else:
+			rowopts = dict(bgopts, gotovect=gotovect - lo if gotovect is not None and gotovect >= 0 else -1)
+			berrvect = np.ones(hi - lo)
+			# fitbg updates the variance and quality of the block in place
+			with stats.stage("fitbg"):
+				bgim, varim, quality = fitbg(block['data'], x1, x2, varim=block['varim'], skyvar=block['skyvar'],
+				                             errvect=berrvect, quality=block['quality'], **rowopts)
+
+		yield lo, hi, dict(dataim=block['data'][:, cols] - bgim[:, cols], bgim=bgim[:, cols],
+		                   varim=block['varim'][:, cols], skyvar=block['skyvar'][:, cols],
+		                   quality=block['quality'][:, cols],
+		                   berrvect=berrvect)
+
+
+def std_stage(stage, opts):
+	"""
+	Adds the standard spectrum of each aperture block to what bg_stage yields.
+	With adjspec, dataim becomes the repaired aperture and bgsub keeps the
+	subtracted one.
+	"""
+	stats = opts.get('stats') or NOSTATS
+	for lo, hi, block in stage:
+		# The aperture starts at column 0 of the block
+		block['bgsub'] = block['dataim']
+		with stats.stage("stdextr"):
+			stdspec, stdvar, adjspec, block['dataim'] = stdextr(block['dataim'], block['varim'], 0,
+			                                                    opts['x2'] - opts['x1'],
+			                                                    quality=block['quality'],
+			                                                    adjspec=opts.get('adjspec', False))
+		block.update(stdspec=stdspec, stdvar=stdvar, adjspec=adjspec)
+		yield lo, hi, block
+
+
+def streamextr(data, opts):
+	opts = dict(opts)
+	ny, nx = np.shape(data)
+	x1 = int(np.round(opts['x1']))
+	x2 = int(np.round(opts['x2']))
+	opts.update(x1=x1, x2=x2, v0=opts['rn'] ** 2)
+
+	if opts.get('adjfunc'):
+		raise ParameterException("Streaming extraction cannot adjust the geometry of the frame.")
+	if x1 < 0 or x1 > x2 or x2 > nx - 1:
+		raise ParameterException("x1 and x2 must satisfy 0 <= x1 <= x2 <= nx-1.")
+	blockrows = opts.get('blockrows') or 256
+
+	if opts.get('nobgfit'):
+		# The one global piece of the background: the median of the sky
+		c1, c2 = sky_bounds(x1, x2, nx, opts.get('skywidth'))
+		xvals = np.array([*np.arange(c1, x1), *np.arange(x2 + 1, c2)])
+		opts['bgmedian'] = np.median(data[:, xvals])
+
+	# Aperture images, filled block by block
+	anx = x2 - x1 + 1
+	rc = Config(**{k: v for k, v in opts.items() if k not in ("var", "inmask", "skyvar")})
+	for name in ("dataim", "bgim", "varim", "skyvar"):
+		setattr(rc, name, np.zeros((ny, anx), plane_dtype(opts.get('dtype'))))
+	for name in ("stdspec", "stdvar", "adjspec", "berrvect"):
+		setattr(rc, name, np.zeros(ny))
+	# stdextr repairs the masked pixels of the aperture only with adjspec
+	rc.bgsub = np.zeros((ny, anx), plane_dtype(opts.get('dtype'))) if opts.get('adjspec') else rc.dataim
+	rc.quality = np.zeros((ny, anx), np.uint8)
+
+	stage = std_stage(bg_stage(row_blocks(data, blockrows, opts), x1, x2, opts), opts)
+	for lo, hi, block in stage:
+		for name in ("dataim", "bgim", "varim", "skyvar", "quality", "stdspec", "stdvar", "berrvect"):
+			getattr(rc, name)[lo:hi] = block[name]
+		if opts.get('adjspec'):
+			rc.adjspec[lo:hi] = block['adjspec']
+			rc.bgsub[lo:hi] = block['bgsub']
+	if not opts.get('adjspec'):
+		rc.adjspec = False
+
+	# The profile is fitted along whole columns, so it waits for every block
+	rc.xoffset = (opts.get('xoffset') or 0) + x1
+	rc.x1 = 0
+	rc.x2 = anx - 1
+	rc.spec = rc.adjspec if opts.get('integrate') == True else rc.stdspec
+
+	stats = opts.get('stats') or NOSTATS
+	with stats.stage("fitprof"):
+		fitprof(rc)
+	with stats.stage("extrspec"):
+		extrspec(rc)
+
+	return rc
@@ -20,20 +20,11 @@ import numpy as np
 
 def polyfunc_test():
 	from lib.fitting import polyfunc
+	from lib.benchmarks.synth import synth_vector
 	from matplotlib import pyplot as plt
 	print("Polyfunc Test:")
 	nx = 100
-	xvals = np.arange(nx)
-	profv = ((-xvals/nx*2 - 1)**2 + 1)*0.75/nx*2
-	sbump = 10
-	specv = np.sin(xvals/nx * np.pi * 6) + sbump
-	gain = 10
-	basey = profv*specv
-	datav = np.random.normal(basey, basey,(nx,))/gain
-	varv = basey/gain
-	badloc = [int(x) for x in np.random.uniform(0, 50, 4)]
-	datav[badloc] = np.random.uniform((4,))*max(datav)*2
-	profv[badloc] = 0
+	xvals, datav, varv, profv, specv = synth_vector(nx)
 	goodloc = np.where(profv != 0)
 	eval = 0
 	deg = 0
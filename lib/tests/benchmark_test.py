@@ -0,0 +1,83 @@
+"""
+Name: benchmark_test.py
+
+Purpose: Test the synthetic frames, the benchmark report and the comparison of
+the float32 compute mode with float64.
+
+Category: Tests
+
+Calling Example: test_benchmark()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.benchmarks.bench import run_benchmarks, compare, save_report, load_report
+from lib.benchmarks.precision import reduce_planes, compare_precision, format_report
+from lib.stats import Stats
+from lib.quality import EXTR_CR
+from astropy.io import fits
+import os
+import tempfile
+import unittest
+
+
+class TestBenchmark(unittest.TestCase):
+	def test_synth_frame(self):
+		frame = synth_frame(100, 40, curvature=4., nskylines=3, crrate=0.01, seed=1)
+		self.assertEqual(frame['data'].shape, (100, 40))
+		self.assertTrue(np.allclose(np.sum(frame['profim'], 1), 1))
+		self.assertAlmostEqual(frame['trace'][0] - frame['trace'][50], 4.)
+		self.assertTrue(0 <= frame['x1'] < frame['trace'].min() < frame['trace'].max() < frame['x2'] <= 39)
+		self.assertTrue(np.any(frame['crmask']))
+
+	def test_report(self):
+		report = run_benchmarks(sizes=[(64, 32)], stages=["stdextr", "extrspec"],
+		                        modes=[{}, {"batch": True}], repeat=2)
+		self.assertEqual([(r['stage'], r['mode']) for r in report['results']],
+		                 [("stdextr", {}), ("extrspec", {}), ("extrspec", {"batch": True})])
+		for r in report['results']:
+			self.assertIsNone(r['error'])
+			self.assertEqual(len(r['times']), 2)
+
+		with tempfile.TemporaryDirectory() as tmp:
+			save_report(report, os.path.join(tmp, "bench.json"))
+			base = load_report(os.path.join(tmp, "bench.json"))
+		self.assertEqual(compare(base, base), [])
+
+		base['results'][1]['best'] /= 10
+		slower = compare(base, report)
+		self.assertEqual([(s['stage'], s['mode']) for s in slower], [("extrspec", {})])
+
+
+class TestPrecision(unittest.TestCase):
+	def setUp(self):
+		frame = synth_frame(200, 48, crrate=0.005, seed=2)
+		self.data = frame['data'].astype(np.float32)
+		self.opts = dict(x1=frame['x1'], x2=frame['x2'], q=frame['q'], rn=frame['rn'], bthresh=3, bgdeg=1,
+		                 verbose=0, plottype=0)
+
+	def test_planes(self):
+		for batch in (False, True):
+			ref = reduce_planes(self.data, dict(self.opts, dtype="float64", batch=batch), Stats())
+			new = reduce_planes(self.data, dict(self.opts, dtype="float32", batch=batch), Stats())
+			for name in ("bgim", "dataim", "varim", "profim", "exres"):
+				self.assertEqual(getattr(ref, name).dtype, np.float64)
+				self.assertEqual(getattr(new, name).dtype, np.float32)
+			# The spectra are summed in double, and agree to well within their errors
+			self.assertEqual(new.optspec.dtype, np.float64)
+			self.assertLess(np.max(np.abs(new.optspec - ref.optspec) / np.sqrt(ref.opvar)), 1e-3)
+			self.assertLess(np.count_nonzero((new.quality ^ ref.quality) & EXTR_CR), 5)
+
+	def test_report(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			fits.PrimaryHDU(self.data).writeto(os.path.join(tmp, "frame.fits"))
+			report = compare_precision(os.path.join(tmp, "frame.fits"), self.opts, repeat=1)
+		self.assertLess(report['peak']['float32'], report['peak']['float64'])
+		self.assertLess(report['accuracy']['optspec']['maxsigma'], 1e-3)
+		self.assertIn("total", format_report(report))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+"""
+Name: bgseed_test.py
+
+Purpose: Test that a BackgroundSeed warm starts fitbg from the previous
+frame's sky, converging in about one pass per row to the background a cold
+start fits, and that a batch with bgwarm reports it per frame.
+
+Category: Tests
+
+Calling Example: test_bgseed()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.benchmarks.synth import synth_frame
+from lib.bgseed import BackgroundSeed
+from lib.fitbg import fitbg
+from lib.optspecextr import optspecextr_batch
+from lib.stats import Stats
+import os
+import tempfile
+import unittest
+import yaml
+
+
+def _frames(n, ny=400, nx=60):
+	# Frames of one sky, slowly brightening, with their own noise and cosmic rays
+	base = synth_frame(ny, nx, nskylines=3, seed=0)
+	for i in range(n):
+		frame = synth_frame(ny, nx, crrate=0.01, nskylines=3, seed=10 + i)
+		frame['data'] = frame['data'] - frame['skyim'] + base['skyim'] * (1 + 0.005 * i)
+		frame['var'] = np.abs(frame['data']) / frame['q'] + frame['rn'] ** 2
+		yield frame
+
+
+class TestBackgroundSeed(unittest.TestCase):
+	def test_warm_start(self):
+		for batch in (False, True):
+			seed = BackgroundSeed(bgdeg=1)
+			for i, frame in enumerate(_frames(3)):
+				kw = dict(q=frame['q'], v0=frame['rn'] ** 2, bthresh=3, bgdeg=1, batch=batch)
+				stats = Stats()
+				cold, _, coldmask = fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']),
+				                          stats=stats, **kw)
+				warm, _, warmmask = fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']),
+				                          bgseed=seed, **kw)
+				last = seed.last
+				self.assertEqual(last['frame'], i)
+				self.assertEqual(last['warm'], i > 0)
+				if i == 0:
+					self.assertTrue(np.array_equal(warm, cold))
+					self.assertEqual(last['iterations'], stats.counts['fitbg']['iterations'])
+					continue
+
+				self.assertGreater(stats.counts['fitbg']['iterations'] / 400, 1.5)
+				self.assertLess(last['iterperrow'], 1.4)
+				self.assertGreater(last['premasked'], 0)
+				self.assertGreater(last['restored'], 0)
+				self.assertEqual(last['falsemask'], 0)
+				self.assertEqual(last['errflag'], 0)
+				self.assertLess(np.max(np.abs(warm - cold)), 1.5)
+				self.assertLess(np.mean(warmmask != coldmask), 0.01)
+			self.assertEqual(len(seed.history), 3)
+
+	def test_restore(self):
+		# With a small margin the prediction masks many good pixels, which the
+		# fit unmasks, fitting their rows again to the cold start's sky
+		for batch in (False, True):
+			seed = BackgroundSeed(bgdeg=1, margin=0.5)
+			for frame in _frames(2):
+				kw = dict(q=frame['q'], v0=frame['rn'] ** 2, bthresh=3, bgdeg=1, batch=batch)
+				cold, _, coldmask = fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']), **kw)
+				warm, _, warmmask = fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']),
+				                          bgseed=seed, **kw)
+			last = seed.last
+			self.assertGreater(last['falsemask'], last['premasked'] // 2)
+			self.assertGreater(last['vectors'], 400)
+			self.assertEqual(last['errflag'], 0)
+			self.assertLess(np.mean(warmmask != coldmask), 0.01)
+			self.assertLess(np.max(np.abs(warm - cold)), 2)
+
+	def test_cold_rows(self):
+		# A row the previous frame did not fit starts cold
+		frames = list(_frames(2))
+		seed = BackgroundSeed(bgdeg=1)
+		kw = dict(q=frames[0]['q'], v0=frames[0]['rn'] ** 2, bthresh=3, bgdeg=1, batch=True)
+		fitbg(frames[0]['data'], frames[0]['x1'], frames[0]['x2'], varim=np.copy(frames[0]['var']),
+		      bgseed=seed, **kw)
+		seed.coeffb[5] = 0
+		fitbg(frames[1]['data'], frames[1]['x1'], frames[1]['x2'], varim=np.copy(frames[1]['var']),
+		      bgseed=seed, **kw)
+		self.assertEqual(seed.last['coldrows'], 1)
+		self.assertEqual(seed.last['errflag'], 0)
+
+	def test_batch(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			for i, frame in enumerate(_frames(3, ny=64, nx=40)):
+				fits.PrimaryHDU(frame['data'].astype(np.float32)).writeto(os.path.join(tmp, "f%d.fits" % i))
+
+			config = dict(rn=2.0, q=10.0, x1=13, x2=27, bgdeg=1, bthresh=3, verbose=0, plottype=0,
+			              noupdate=True, bgwarm=True, output_dir=os.path.join(tmp, "out"))
+			with open(os.path.join(tmp, "config.yaml"), "w") as f:
+				yaml.safe_dump(config, f)
+			reports = optspecextr_batch(os.path.join(tmp, "config.yaml"), [os.path.join(tmp, "f*.fits")])
+
+			self.assertTrue(all(r['ok'] for r in reports))
+			self.assertEqual([r['bgwarm']['warm'] for r in reports], [False, True, True])
+
+
+if __name__ == '__main__':
+	unittest.main()
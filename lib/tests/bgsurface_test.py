@@ -0,0 +1,69 @@
+"""
+Name: bgsurface_test.py
+
+Purpose: Test that the arrow solve of the sky surface matches a dense least
+squares fit, and that fitbg with bgsurface recovers a sky with lines and
+cosmic rays.
+
+Category: Tests
+
+Calling Example: test_bgsurface()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.bgsurface import _surface_basis, surface_solve, surface_eval
+from lib.fitbg import fitbg
+from lib.stats import Stats
+import unittest
+
+
+class TestBackgroundSurface(unittest.TestCase):
+	def test_solve(self):
+		rng = np.random.default_rng(0)
+		ny, nx, bgdeg, bgydeg = 30, 25, 2, 3
+		xvals = np.array([*range(0, 8), *range(17, 25)])
+		tpow, leg = _surface_basis(xvals, nx, ny, bgdeg, bgydeg)
+		datas = rng.normal(100, 5, (ny, len(xvals)))
+		weights = rng.uniform(0.5, 2, (ny, len(xvals))) * (rng.random((ny, len(xvals))) > 0.1)
+
+		amps, coeffs = surface_solve(datas, weights, tpow[xvals], leg, bgdeg)
+
+		# The same fit with the design matrix written out
+		rows = np.repeat(np.arange(ny), len(xvals))
+		cols = np.tile(tpow[xvals, 1:bgdeg + 1], (ny, 1))
+		design = np.hstack([np.eye(ny)[rows],
+		                    (cols[:, :, None] * leg[rows][:, None, :]).reshape(len(rows), -1)])
+		sw = np.sqrt(weights.ravel())
+		dense = np.linalg.lstsq(design * sw[:, None], datas.ravel() * sw, rcond=None)[0]
+		self.assertTrue(np.allclose(amps, dense[:ny]))
+		self.assertTrue(np.allclose(coeffs.ravel(), dense[ny:]))
+		self.assertTrue(np.allclose(surface_eval(amps, coeffs, tpow[xvals], leg).ravel(), design @ dense))
+
+	def test_fitbg(self):
+		frame = synth_frame(400, 60, crrate=0.01, nskylines=8, seed=1)
+		x1, x2 = frame['x1'], frame['x2']
+		kw = dict(q=frame['q'], v0=frame['rn'] ** 2, bthresh=3, bgdeg=1)
+
+		stats = Stats()
+		surface, varim, inmask = fitbg(frame['data'], x1, x2, varim=np.copy(frame['var']), bgsurface=True,
+		                               stats=stats, **kw)
+		rows, _, _ = fitbg(frame['data'], x1, x2, varim=np.copy(frame['var']), batch=True, **kw)
+
+		self.assertEqual(stats.counts['fitbg']['errflag'], 0)
+		self.assertEqual(stats.counts['fitbg']['vectors'], 400)
+		err = surface - frame['skyim']
+		self.assertLess(np.std(err), np.std(rows - frame['skyim']))
+		self.assertLess(np.max(np.abs(err)), 4)
+
+		# The cosmic rays in the sky windows are masked
+		sky = np.ones(60, bool)
+		sky[x1:x2 + 1] = False
+		self.assertTrue(np.all(inmask[:, sky][frame['crmask'][:, sky] == 1] == 0))
+		self.assertTrue(np.all(inmask[:, x1:x2 + 1] == 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
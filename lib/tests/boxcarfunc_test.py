@@ -0,0 +1,77 @@
+"""
+Name: boxcarfunc_test.py
+
+Purpose: Test the masked running median and mean of boxcarfunc against
+taking each window on its own, and the boxcar profile fit of fitprof.
+
+Category: Tests
+
+Calling Example: test_boxcarfunc()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.fitting.boxcarfunc import running_median, running_mean, boxcarfunc
+from lib.procvect import procvect
+from lib.vectsetup import fitprof
+from lib.utils import Config, fill_bad
+import unittest
+
+
+class TestBoxcarFunc(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		self.data = rng.normal(size=(5, 97))
+		self.mask = rng.random((5, 97)) > 0.3
+
+	def _windows(self, hw, func):
+		out = np.zeros(np.shape(self.data))
+		for i, j in np.ndindex(*np.shape(self.data)):
+			window = slice(max(j - hw, 0), j + hw + 1)
+			values = self.data[i, window][self.mask[i, window]]
+			out[i, j] = func(values) if len(values) else 0.
+		return out
+
+	def test_running(self):
+		for hw in (1, 3, 5, 12):
+			median, ngood = running_median(self.data, self.mask, hw)
+			self.assertTrue(np.allclose(median, self._windows(hw, np.median)))
+			self.assertTrue(np.array_equal(ngood, self._windows(hw, len)))
+
+			mean, ngood = running_mean(self.data, self.mask, hw)
+			self.assertTrue(np.allclose(mean, self._windows(hw, np.mean)))
+
+	def test_fill_bad(self):
+		filled = fill_bad(self.data, self.mask)
+		idx = np.arange(97)
+		for i in range(5):
+			good = self.mask[i]
+			self.assertTrue(np.allclose(filled[i], np.interp(idx, idx[good], self.data[i, good])))
+		self.assertTrue(np.all(fill_bad(self.data, np.zeros((5, 97), bool)) == 0))
+
+	def test_procvect(self):
+		# The single vector form still works through procvect
+		datav = 5 + np.sin(np.arange(200) / 20.)
+		datav[[30, 90]] += 50
+		fiteval, maskv, errflag, coeffv = procvect(datav, func="boxcarfunc", parm=3, thresh=5)
+		self.assertEqual(list(np.flatnonzero(maskv == 0)), [30, 90])
+		est, coeffv = boxcarfunc(np.arange(200), datav, np.ones(200), maskv, True, None, 3)
+		self.assertTrue(np.allclose(fiteval, est))
+		self.assertLess(np.max(np.abs(fiteval - 5 - np.sin(np.arange(200) / 20.))), 0.1)
+
+	def test_fitprof(self):
+		frame = synth_frame(1000, 40, crrate=0.005, seed=2)
+		dataim = frame['data'] - frame['skyim']
+		x1, x2 = frame['x1'], frame['x2']
+		rc = Config(dataim=dataim, varim=np.copy(frame['var']), spec=np.sum(dataim[:, x1:x2 + 1], 1), x1=x1,
+		            x2=x2, q=frame['q'], v0=frame['rn'] ** 2, pthresh=5, fitboxcar=True, boxcarhw=5, reject="all")
+		profim = fitprof(rc)
+		self.assertTrue(np.allclose(np.sum(profim, 1), 1))
+		self.assertLess(np.mean(np.abs(profim - frame['profim'])[:, x1:x2 + 1]), 0.002)
+		self.assertTrue(np.all(rc.perrvect == 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
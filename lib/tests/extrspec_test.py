@@ -0,0 +1,72 @@
+"""
+Name: extrspec_test.py
+
+Purpose: Test the batched optimal extraction against the row by row loop.
+
+Category: Tests
+
+Calling Example: test_extrspec()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.fitting.extractfunc import extractfunc, extractfunc_batch
+from lib.vectsetup import extrspec
+from lib.utils import Config
+from lib.quality import quality_plane, EXTR_CR, USER_BAD
+import unittest
+
+
+def make_frame(ny=200, nx=30, seed=0):
+	# A sky subtracted Gaussian profile with a known spectrum, a cosmic ray on
+	# the trace every tenth row, and a few pixels bad in the input mask
+	rng = np.random.default_rng(seed)
+	x = np.arange(nx)
+	spec = 1000 + 200 * np.sin(np.arange(ny) / 20.)
+	profim = np.exp(-0.5 * ((x - nx / 2) / 2.5) ** 2) * np.ones((ny, 1))
+	profim = profim / np.sum(profim, 1)[:, None]
+	varim = spec[:, None] * profim / 10 + 4
+	data = spec[:, None] * profim + rng.normal(0, np.sqrt(varim))
+	crmask = np.zeros((ny, nx), bool)
+	crmask[::10, nx // 2 + 1] = True
+	data[crmask] += 1000
+	inmask = np.ones((ny, nx))
+	inmask[5::10, nx // 2] = 0
+	return data, varim, profim, spec, crmask, inmask
+
+
+class TestExtrspec(unittest.TestCase):
+	def setUp(self):
+		self.data, self.varim, self.profim, self.spec, self.crmask, self.inmask = make_frame()
+
+	def test_extractfunc_batch(self):
+		data, varim, profim = self.data, self.varim, self.profim
+		maskb = self.inmask == 1
+		maskb[3] = False
+		estb, coeffb = extractfunc_batch(None, data, varim, profim, maskb, False, None, None)
+		self.assertTrue(np.array_equal(coeffb[3], [0, 0]))
+
+		for i in range(len(data)):
+			est, coeffv = extractfunc(None, data[i], varim[i], profim[i] * maskb[i], False, None, None)
+			self.assertTrue(np.allclose(coeffv, coeffb[i]))
+
+	def test_batch_matches_loop(self):
+		results = []
+		for batch in (False, True):
+			rc = Config(dataim=self.data, varim=np.copy(self.varim), profim=self.profim,
+			            quality=quality_plane(self.inmask), x1=2, x2=27, q=10, v0=4, batch=batch)
+			optspec = extrspec(rc)
+			results.append((rc.quality, optspec, rc.opvar, rc.varim, rc.eerrvect))
+
+			self.assertTrue(np.all(rc.quality[self.crmask] & EXTR_CR))
+			self.assertTrue(np.all(rc.quality[self.inmask == 0] == USER_BAD))
+			self.assertLess(np.max(np.abs(optspec - self.spec) / np.sqrt(rc.opvar)), 5)
+
+		self.assertTrue(np.array_equal(results[0][0], results[1][0]))
+		for loop, batch in zip(results[0][1:], results[1][1:]):
+			self.assertTrue(np.allclose(loop, batch))
+
+
+if __name__ == '__main__':
+	unittest.main()
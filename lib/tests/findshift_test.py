@@ -0,0 +1,57 @@
+"""
+Name: findshift_test.py
+
+Purpose: Test that findshift finds the trace of a synthetic frame, and that
+its Gaussian centers match fitting the rows one by one with procvect.
+
+Category: Tests
+
+Calling Example: test_findshift()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.findshift import findshift
+from lib.procvect import procvect
+import unittest
+
+
+class TestFindShift(unittest.TestCase):
+	def setUp(self):
+		self.frame = synth_frame(200, 40, curvature=3., crrate=0.003, seed=2)
+		self.dataim = self.frame['data'] - self.frame['skyim']
+		self.x1, self.x2 = self.frame['x1'], self.frame['x2']
+		self.spec = np.sum(self.dataim[:, self.x1:self.x2 + 1], 1)
+
+	def test_gaussian_trace(self):
+		tracemask = np.ones(np.shape(self.dataim))
+		shiftv, widthv, height, shmask = findshift(self.dataim, varim=self.frame['var'], spec=self.spec,
+		                                           x1=self.x1, x2=self.x2, tracemask=tracemask)
+		self.assertLess(np.max(np.abs(shiftv - self.frame['trace'])), 0.4)
+		self.assertTrue(np.allclose(np.median(widthv), 2., atol=0.1))
+		self.assertGreater(np.sum(shmask), 190)
+		self.assertTrue(np.all(tracemask[:, :self.x1] == 1))
+
+		# The rows not rejected by the trace fit have procvect's centers
+		nap = self.x2 - self.x1 + 1
+		for i in np.flatnonzero(shmask)[::10]:
+			maskv = np.ones(nap)
+			datav = np.maximum(self.dataim[i, self.x1:self.x2 + 1], 0)
+			varv = self.frame['var'][i, self.x1:self.x2 + 1]
+			_, maskv, errflag, coeff = procvect(datav, varv=varv, noupdate=True, thresh=0.03, maskv=maskv,
+			                                    func="gaussfunc", parm=1, multv=np.full(nap, self.spec[i]),
+			                                    absthresh=True)
+			self.assertAlmostEqual(shiftv[i], coeff[1] + self.x1, 4)
+			self.assertTrue(np.array_equal(tracemask[i, self.x1:self.x2 + 1], maskv))
+
+	def test_centroid(self):
+		shiftv, widthv, height, shmask = findshift(self.dataim, varim=self.frame['var'], spec=self.spec,
+		                                           x1=self.x1, x2=self.x2, centroid=True, centerfit=True)
+		self.assertLess(np.max(np.abs(shiftv - self.frame['trace'])), 1.)
+		self.assertTrue(np.all(widthv == 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,74 @@
+"""
+Name: fitbg_test.py
+
+Purpose: Test the batched background fitting against the row by row loop.
+
+Category: Tests
+
+Calling Example: test_fitbg()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from numpy.polynomial import polynomial as poly
+from lib.fitbg import fitbg
+from lib.fitting.polyfunc import polyfit_batch
+from lib.benchmarks.synth import synth_frame
+import unittest
+
+
+class TestFitbg(unittest.TestCase):
+	def test_polyfit_batch(self):
+		rng = np.random.default_rng(1)
+		xvals = np.array([*np.arange(30), *np.arange(50, 80)])
+		datab = rng.normal(100, 5, (10, len(xvals)))
+		maskb = rng.random(datab.shape) > 0.2
+
+		coeffb = polyfit_batch(xvals, datab, maskb, 2)
+
+		for i in range(len(datab)):
+			coeffv = poly.polyfit(xvals[maskb[i]], datab[i, maskb[i]], 2)
+			self.assertTrue(np.allclose(coeffb[i], coeffv))
+
+	def test_batch_matches_loop(self):
+		frame = synth_frame(120, 80, curvature=2., crrate=0.01, seed=0)
+		data, x1, x2 = frame['data'], frame['x1'], frame['x2']
+		opts = dict(bgdeg=2, bthresh=3, q=10, v0=4, verbose=0)
+
+		for noupdate in (True, False):
+			varim1 = abs(data) / 10 + 4
+			inmask1 = np.ones(data.shape)
+			bgim1, varim1, inmask1 = fitbg(data, x1, x2, varim=varim1, inmask=inmask1,
+			                               noupdate=noupdate, **opts)
+
+			varim2 = abs(data) / 10 + 4
+			inmask2 = np.ones(data.shape)
+			bgim2, varim2, inmask2 = fitbg(data, x1, x2, varim=varim2, inmask=inmask2,
+			                               noupdate=noupdate, batch=True, **opts)
+
+			self.assertTrue(np.array_equal(inmask1, inmask2))
+			self.assertTrue(np.allclose(bgim1, bgim2))
+			self.assertTrue(np.allclose(varim1, varim2))
+			self.assertTrue(np.any(inmask2 == 0))
+
+	def test_thin_window(self):
+		# A row with fewer than 2 good sky pixels on one side is fitted with
+		# polyfunc's default degree rather than bgdeg, in both engines
+		frame = synth_frame(40, 60, crrate=0.01, seed=2)
+		data, x1, x2 = frame['data'], frame['x1'], frame['x2']
+		inmask = np.ones(data.shape)
+		inmask[3, 1:x1] = 0
+		inmask[7, x2 + 1:] = 0
+
+		results = []
+		for batch in (False, True):
+			results.append(fitbg(data, x1, x2, varim=np.copy(frame['var']), inmask=np.copy(inmask), bgdeg=1,
+			                     bthresh=3, q=10, v0=4, batch=batch))
+
+		for loop, batch in zip(*results):
+			self.assertTrue(np.allclose(loop, batch))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,70 @@
+"""
+Name: gaussfunc_test.py
+
+Purpose: Test the batched Gaussian fitter against curve_fit, and the batch
+profile fit of fitprof against fitting row by row with procvect.
+
+Category: Tests
+
+Calling Example: test_gaussfunc()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from scipy.optimize import curve_fit
+from lib.fitting.gaussfunc import gaussfunc, gaussfunc_batch, gausseval, newton_cotes
+from lib.benchmarks.synth import synth_frame
+from lib.vectsetup import fitprof
+from lib.utils import Config
+import unittest
+
+
+def _gauss_rows(nvect=50, nx=25, seed=0):
+	rng = np.random.default_rng(seed)
+	xvals = np.arange(nx, dtype=np.double)
+	truth = np.stack([rng.uniform(0.1, 0.3, nvect), rng.uniform(9, 15, nvect), rng.uniform(1.5, 3, nvect)], 1)
+	specb = rng.uniform(500, 2000, nvect)[:, None] * np.ones(nx)
+	model = gausseval(xvals, truth) * specb
+	varb = np.abs(model) / 10 + 4
+	datab = model + rng.normal(0, np.sqrt(varb))
+	return xvals, datab, varb, specb, truth
+
+
+class TestGaussFunc(unittest.TestCase):
+	def test_newton_cotes(self):
+		xvals = np.arange(17.)
+		self.assertAlmostEqual(newton_cotes(xvals, np.exp(-0.5 * ((xvals - 8) / 2) ** 2)),
+		                       np.sqrt(2 * np.pi) * 2, 2)
+
+	def test_matches_curve_fit(self):
+		xvals, datab, varb, specb, truth = _gauss_rows()
+		est, coeffb = gaussfunc_batch(xvals, datab, varb, specb, True, False, None, 0)
+
+		for i in range(len(datab)):
+			sigma = np.sqrt(varb[i]) / specb[i]
+			ref = curve_fit(lambda x, *a: gausseval(x, a), xvals, datab[i] / specb[i], p0=truth[i],
+			                sigma=sigma)[0]
+			self.assertTrue(np.allclose(coeffb[i], ref, rtol=1e-4))
+
+			# One vector, as procvect calls it, fits the same
+			estv, coeffv = gaussfunc(xvals, datab[i], varb[i], specb[i], False, None, 0)
+			self.assertTrue(np.allclose(coeffv, coeffb[i], rtol=1e-4))
+			self.assertTrue(np.allclose(estv, est[i], rtol=1e-4, atol=1e-8))
+
+	def test_fitprof_batch(self):
+		frame = synth_frame(120, 40, crrate=0.005, seed=1)
+		profs = []
+		for batch in (False, True):
+			rc = Config(dataim=frame['data'] - frame['skyim'], varim=np.copy(frame['var']), spec=frame['spec'],
+			            x1=frame['x1'], x2=frame['x2'], q=frame['q'], v0=frame['rn'] ** 2, pthresh=5,
+			            fitgauss=True, batch=batch)
+			profs.append(fitprof(rc))
+			self.assertTrue(np.all(rc.perrvect == 1))
+			self.assertLess(np.max(np.abs(rc.profim - frame['profim'])), 0.02)
+
+		self.assertTrue(np.allclose(profs[0], profs[1], atol=1e-3))
+
+
+if __name__ == '__main__':
+	unittest.main()
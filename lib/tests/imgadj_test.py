@@ -0,0 +1,83 @@
+"""
+Name: imgadj_test.py
+
+Purpose: Test that adjgauss straightens a curved trace with its compiled
+operators, that reverting recovers the images, and that fitprof fits the
+profile of a curved trace better through it.
+
+Category: Tests
+
+Calling Example: test_imgadj()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.imgadj import adjgauss
+from lib.sampleshift import sampleshift
+from lib.vectsetup import fitprof
+from lib.utils import Config
+from lib.quality import quality_plane
+import unittest
+
+
+class TestAdjGauss(unittest.TestCase):
+	def setUp(self):
+		self.frame = synth_frame(200, 40, curvature=4., seed=3)
+		self.dataim = self.frame['data'] - self.frame['skyim']
+		self.x1, self.x2 = self.frame['x1'], self.frame['x2']
+		self.cols = slice(self.x1, self.x2 + 1)
+		self.optinfo = Config(dataim=self.dataim, varim=self.frame['var'], x1=self.x1, x2=self.x2,
+		                      spec=np.sum(self.dataim[:, self.cols], 1))
+
+	def test_forward_and_revert(self):
+		inarray = np.stack([self.dataim[:, self.cols], self.frame['var'][:, self.cols],
+		                    self.frame['profim'][:, self.cols]], -1)
+		adjparms = {}
+		outarray = adjgauss(inarray, self.optinfo, adjparms=adjparms, adjoptions=dict(level=3))
+		self.assertEqual(np.shape(outarray), (200, 3 * np.shape(inarray)[1], 3))
+
+		# One sparse product gives what sampleshift gives for each image
+		for i in range(3):
+			self.assertTrue(np.allclose(outarray[:, :, i],
+			                            sampleshift(inarray[:, :, i], adjparms['origx'], adjparms['adjx'],
+			                                        fitspline=True)))
+
+		# The straightened profile peaks in the same place on every row
+		peaks = np.argmax(outarray[:, :, 2], 1)
+		self.assertLessEqual(np.ptp(peaks), 2)
+
+		# Reverting recovers the smooth profile image
+		reverted = adjgauss(outarray[:, :, 2:], self.optinfo, adjparms=adjparms, adjoptions=dict(level=3),
+		                    revert=True)
+		self.assertLess(np.max(np.abs(reverted[:, :, 0] - inarray[:, :, 2])), 0.01)
+
+	def test_quality(self):
+		# The mask of the aperture is read from the quality plane as from inmask
+		inmask = np.ones(np.shape(self.dataim))
+		inmask[::7, self.x1 + 5] = 0
+		inarray = self.dataim[:, self.cols]
+		results = []
+		for mask in (dict(inmask=inmask), dict(quality=quality_plane(inmask))):
+			adjparms = {}
+			optinfo = Config(**dict(vars(self.optinfo), **mask))
+			results.append((adjgauss(inarray, optinfo, adjparms=adjparms), adjparms['traceest'], adjparms['mask']))
+		for byinmask, byquality in zip(*results):
+			self.assertTrue(np.array_equal(byinmask, byquality))
+		self.assertEqual(np.shape(results[0][2]), np.shape(inarray))
+		self.assertTrue(np.all(results[0][2][::7, 5] == 0))
+
+	def test_fitprof(self):
+		errors = []
+		for adjfunc in (None, "adjgauss"):
+			rc = Config(dataim=self.dataim, varim=np.copy(self.frame['var']), spec=self.optinfo.spec,
+			            x1=self.x1, x2=self.x2, q=self.frame['q'], v0=self.frame['rn'] ** 2, pthresh=5,
+			            adjfunc=adjfunc, adjoptions=dict(level=3), batch=True)
+			errors.append(np.max(np.abs(fitprof(rc) - self.frame['profim'])))
+		self.assertLess(errors[1], 0.01)
+		self.assertLess(errors[1], errors[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
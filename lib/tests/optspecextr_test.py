@@ -0,0 +1,67 @@
+"""
+Name: optspecextr_test.py
+
+Purpose: Test the multi-frame batch driver of the pipeline.
+
+Category: Tests
+
+Calling Example: test_optspecextr()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.optspecextr import optspecextr_batch, frame_prefixes
+from lib.output import PRODUCTS
+import os
+import tempfile
+import unittest
+import yaml
+
+
+def write_frame(path, flux, ny=64, nx=40, seed=0):
+	# A Gaussian trace of the given flux per row on a sloped sky, so each
+	# frame's spectrum tells which frame it was extracted from
+	rng = np.random.default_rng(seed)
+	x = np.arange(nx)
+	prof = np.exp(-0.5 * ((x - 20) / 2.) ** 2)
+	data = 100 + 0.5 * x + flux * prof / np.sum(prof) * np.ones((ny, 1))
+	data = data + rng.normal(0, np.sqrt(data / 10 + 4))
+	fits.PrimaryHDU(data.astype(np.float32)).writeto(path)
+
+
+class TestOptspecextrBatch(unittest.TestCase):
+	def test_frame_prefixes(self):
+		prefixes = frame_prefixes(["a/f1.fits", "b/f1.fits", "f2.fits.gz"])
+		self.assertEqual(prefixes, ["f1", "f1_1", "f2"])
+
+	def test_batch(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			fluxes = (5000., 10000.)
+			for i, flux in enumerate(fluxes):
+				write_frame(os.path.join(tmp, "frame%d.fits" % i), flux, seed=i)
+			with open(os.path.join(tmp, "bad.fits"), "w") as f:
+				f.write("not a FITS file")
+
+			config = dict(rn=2.0, q=10.0, x1=14, x2=26, bgdeg=1, bthresh=3, verbose=0,
+			              plottype=0, noupdate=True, output_dir=os.path.join(tmp, "out"))
+			with open(os.path.join(tmp, "config.yaml"), "w") as f:
+				yaml.safe_dump(config, f)
+
+			reports = optspecextr_batch(os.path.join(tmp, "config.yaml"), [os.path.join(tmp, "*.fits")])
+
+			self.assertEqual([r['prefix'] for r in reports], ["bad", "frame0", "frame1"])
+			self.assertEqual([r['ok'] for r in reports], [False, True, True])
+			for r, flux in zip(reports[1:], fluxes):
+				with fits.open(os.path.join(tmp, "out", r['prefix'] + "_products.fits")) as hdus:
+					self.assertEqual([hdu.name for hdu in hdus[1:]], list(PRODUCTS))
+					optspec = hdus["OPTSPEC"].data
+					self.assertEqual(len(optspec), 64)
+					self.assertLess(abs(np.median(optspec) / flux - 1), 0.02)
+					self.assertEqual(hdus["BGSUB"].data.shape, (64, 40))
+				self.assertTrue(os.path.exists(os.path.join(tmp, "out", r['prefix'] + "_stdspec.png")))
+
+
+if __name__ == '__main__':
+	unittest.main()
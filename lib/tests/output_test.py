@@ -0,0 +1,96 @@
+"""
+Name: output_test.py
+
+Purpose: Test that the background writer puts the products of each frame in
+one multi-extension FITS file, compressed without loss, and reports the
+frames that failed to write.
+
+Category: Tests
+
+Calling Example: test_output()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.output import FrameWriter
+from lib.quality import quality_plane, quality_cards, QUALITY_BITS
+from lib.optspecextr import reduce_frame
+from lib.excep import OutputException, ParameterException
+from lib.benchmarks.synth import synth_frame
+import os
+import tempfile
+import unittest
+
+
+class TestFrameWriter(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		self.image = rng.normal(100, 10, (60, 30))
+		self.quality = quality_plane(rng.random((60, 30)) > 0.1)
+		self.spec = rng.normal(1000, 30, 60)
+
+	def test_write(self):
+		for compress in (None, "GZIP_2", True):
+			with tempfile.TemporaryDirectory() as tmp:
+				with FrameWriter(os.path.join(tmp, "out"), compress=compress, maxqueue=1) as writer:
+					for prefix in ("f1", "f2"):
+						writer.add(prefix, "BGSUB", self.image)
+						writer.add(prefix, "QUALITY", self.quality, quality_cards())
+						writer.plot(prefix, "stdspec", self.spec)
+						writer.add(prefix, "OPTSPEC", self.spec)
+						writer.write(prefix, dict(X1=10, X2=20))
+				self.assertEqual(writer.errors, {})
+
+				for prefix in ("f1", "f2"):
+					self.assertTrue(os.path.exists(os.path.join(tmp, "out", prefix + "_stdspec.png")))
+					with fits.open(os.path.join(tmp, "out", prefix + "_products.fits")) as hdus:
+						self.assertEqual([hdu.name for hdu in hdus[1:]], ["BGSUB", "QUALITY", "OPTSPEC"])
+						self.assertEqual(hdus[0].header["X2"], 20)
+						self.assertEqual(isinstance(hdus["BGSUB"], fits.CompImageHDU), bool(compress))
+						# GZIP keeps floating point images exactly
+						self.assertTrue(np.array_equal(hdus["BGSUB"].data, self.image))
+						self.assertTrue(np.array_equal(hdus["QUALITY"].data, self.quality))
+						self.assertEqual(hdus["QUALITY"].header["QBIT1"], QUALITY_BITS[1][0])
+						self.assertTrue(np.array_equal(hdus["OPTSPEC"].data, self.spec))
+
+	def test_errors(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			# A frame written under a directory that does not exist fails
+			writer = FrameWriter(tmp, compress="GZIP_2")
+			writer.add("missing/bad", "BGSUB", self.image)
+			writer.write("missing/bad")
+			writer.add("good", "OPTSPEC", self.spec)
+			writer.write("good")
+			writer.add("dropped", "OPTSPEC", self.spec)
+			writer.discard("dropped")
+			writer.write("dropped")
+			errors = writer.close()
+
+			self.assertEqual(list(errors), ["missing/bad"])
+			self.assertTrue(os.path.exists(os.path.join(tmp, "good_products.fits")))
+			with fits.open(os.path.join(tmp, "dropped_products.fits")) as hdus:
+				self.assertEqual(len(hdus), 1)
+
+		with self.assertRaises(ParameterException):
+			FrameWriter(compress="NOT_A_COMPRESSION")
+
+	def test_reduce_frame(self):
+		frame = synth_frame(120, 40, crrate=0.005, seed=1)
+		with tempfile.TemporaryDirectory() as tmp:
+			opts = dict(x1=frame['x1'], x2=frame['x2'], q=frame['q'], rn=frame['rn'], bthresh=3, bgdeg=1,
+			            verbose=0, plottype=0, output_dir=tmp)
+			optspec = reduce_frame(frame['data'], opts, "frame")
+			with fits.open(os.path.join(tmp, "frame_products.fits")) as hdus:
+				self.assertTrue(np.array_equal(hdus["OPTSPEC"].data, optspec))
+				self.assertEqual(hdus["PROFILE"].data.shape, (120, 40))
+				self.assertEqual(hdus[0].header["X1"], frame['x1'])
+
+			# A frame whose products cannot be written fails
+			with self.assertRaises(OutputException):
+				reduce_frame(frame['data'], opts, "missing/frame")
+
+
+if __name__ == '__main__':
+	unittest.main()
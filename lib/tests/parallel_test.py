@@ -0,0 +1,80 @@
+"""
+Name: parallel_test.py
+
+Purpose: Test that the process pool stages match the serial stages exactly.
+
+Category: Tests
+
+Calling Example: test_parallel()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.fitbg import fitbg
+from lib.vectsetup import fitprof, extrspec
+from lib.utils import Config
+from lib.quality import quality_plane, USER_BAD, SKY_CR, PROF_CR, EXTR_CR
+import unittest
+
+
+def make_frame(ny=96, nx=48, seed=0):
+	# A tilted Gaussian trace on a flat sky with cosmic rays over the sky and
+	# the trace, and an input mask with a bad column segment and scattered
+	# bad pixels, so every block has pixels masked before and rejected by the fits
+	rng = np.random.default_rng(seed)
+	x = np.arange(nx)
+	y = np.arange(ny)
+	spec = 1000 + 200 * np.sin(y / 20.)
+	prof = np.exp(-0.5 * ((x[None, :] - nx / 2 - 0.02 * y[:, None]) / 2.) ** 2)
+	sky = np.full((ny, nx), 50.)
+	data = sky + spec[:, None] * prof / np.sum(prof, 1)[:, None]
+	varim = data / 10 + 4
+	data = data + rng.normal(0, np.sqrt(varim))
+	crs = rng.random(data.shape) < 0.01
+	data[crs] += rng.uniform(100, 1000, np.sum(crs))
+
+	inmask = np.ones((ny, nx))
+	inmask[20:40, 5] = 0
+	inmask[rng.integers(0, ny, 30), rng.integers(0, nx, 30)] = 0
+	return data, varim, sky, inmask
+
+
+class TestParallel(unittest.TestCase):
+	def setUp(self):
+		self.data, self.varim, self.sky, self.inmask = make_frame()
+
+	def test_fitbg(self):
+		results = []
+		for workers in (1, 2):
+			bgim, var, quality = fitbg(self.data, 16, 32, varim=np.copy(self.varim),
+			                           quality=quality_plane(self.inmask), bgdeg=1, bthresh=3, q=10, v0=4,
+			                           workers=workers, chunks=5)
+			results.append((bgim, var, quality))
+
+		for serial, pooled in zip(*results):
+			self.assertTrue(np.array_equal(serial, pooled))
+		quality = results[0][2]
+		self.assertTrue(np.any(quality & USER_BAD))
+		self.assertTrue(np.any(quality & SKY_CR))
+
+	def test_fitprof_extrspec(self):
+		results = []
+		for workers in (1, 2):
+			dataim = self.data - self.sky
+			rc = Config(dataim=dataim, varim=np.copy(self.varim), spec=np.sum(dataim[:, 16:33], 1),
+			            quality=quality_plane(self.inmask), x1=16, x2=32, q=10, v0=4, workers=workers, chunks=3)
+			profim = fitprof(rc)
+			optspec = extrspec(rc)
+			results.append((profim, optspec, rc.opvar, rc.quality, rc.varim))
+
+		for serial, pooled in zip(*results):
+			self.assertTrue(np.array_equal(serial, pooled))
+		quality = results[0][3][:, 16:33]
+		self.assertTrue(np.any(quality & USER_BAD))
+		self.assertTrue(np.any(quality & PROF_CR))
+		self.assertTrue(np.any(quality & EXTR_CR))
+
+
+if __name__ == '__main__':
+	unittest.main()
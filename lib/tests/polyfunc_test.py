@@ -0,0 +1,68 @@
+"""
+Name: polyfunc_test.py
+
+Purpose: Test the cached polynomial solvers of polyfunc against poly.polyfit.
+
+Category: Tests
+
+Calling Example: test_polyfunc()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from numpy.polynomial import polynomial as poly
+from lib.fitting import polyfunc
+import unittest
+
+
+class TestPolySolver(unittest.TestCase):
+	def setUp(self):
+		polyfunc.clear_solver_cache()
+
+	def test_matches_polyfit(self):
+		rng = np.random.default_rng(0)
+		xvals = np.arange(40., 240.)
+		datav = 100 + 0.3 * xvals - 1e-3 * xvals ** 2 + rng.normal(0, 1, len(xvals))
+		ones = np.ones(len(xvals))
+
+		for deg in (1, 2, 3):
+			est, coeffv = polyfunc.polyfunc(xvals, datav, ones, ones, False, None, deg)
+			self.assertTrue(np.allclose(coeffv, poly.polyfit(xvals, datav, deg)))
+
+			# The good pixels of the grid, as procvect passes them, are fitted
+			# the same whatever solvers are cached
+			good = np.sort(rng.choice(len(xvals), 150, replace=False))
+			est, coeffv = polyfunc.polyfunc(xvals[good], datav[good], ones[good], ones[good], False, None, deg)
+			self.assertTrue(np.allclose(coeffv, poly.polyfit(xvals[good], datav[good], deg)))
+			polyfunc.clear_solver_cache()
+			est, fresh = polyfunc.polyfunc(xvals[good], datav[good], ones[good], ones[good], False, None, deg)
+			self.assertTrue(np.array_equal(coeffv, fresh))
+
+	def test_weighted_batch(self):
+		rng = np.random.default_rng(1)
+		xvals = np.sort(rng.uniform(0, 50, 60))
+		datab = rng.normal(0, 1, (5, 60)) + xvals
+		weightb = rng.uniform(0, 2, (5, 60))
+		weightb[0] = 1.
+		weightb[1, :58] = 0.  # too few pixels for the fit
+		coeffb = polyfunc.polyfit_batch(xvals, datab, weightb, 2)
+
+		self.assertTrue(np.all(coeffb[1] == 0))
+		for i in (0, 2, 3, 4):
+			self.assertTrue(np.allclose(coeffb[i], poly.polyfit(xvals, datab[i], 2, w=np.sqrt(weightb[i]))))
+
+	def test_lru(self):
+		for n in range(polyfunc.SOLVER_CACHE_SIZE + 5):
+			polyfunc.poly_solver(np.arange(10. + n), 2)
+		self.assertEqual(len(polyfunc._solvers), polyfunc.SOLVER_CACHE_SIZE)
+
+		# A used solver becomes the most recent and survives the next insertions
+		first = polyfunc.poly_solver(np.arange(15.), 2)
+		for n in range(polyfunc.SOLVER_CACHE_SIZE - 1):
+			polyfunc.poly_solver(np.arange(100. + n), 2)
+		self.assertIs(polyfunc.poly_solver(np.arange(15.), 2), first)
+
+
+if __name__ == '__main__':
+	unittest.main()
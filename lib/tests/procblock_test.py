@@ -0,0 +1,76 @@
+"""
+Name: procblock_test.py
+
+Purpose: Test the block sigma-clipping engine against procvect.
+
+Category: Tests
+
+Calling Example: test_procblock()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.procvect import procvect
+from lib.procblock import procblock
+import unittest
+
+
+def make_block(nvect=40, nx=256, seed=0):
+	# Rows of a slowly changing quadratic with noise and i % 6 cosmic rays in
+	# row i, so the rows stop clipping after different passes, and a few
+	# pixels masked before the fit
+	rng = np.random.default_rng(seed)
+	xvals = np.linspace(-1, 1, nx)
+	datab = 200 + np.arange(nvect)[:, None] + 10 * xvals - 20 * xvals ** 2
+	varb = datab / 10 + 4
+	datab = datab + rng.normal(0, np.sqrt(varb))
+	crmask = np.zeros((nvect, nx), bool)
+	for i in range(nvect):
+		crmask[i, rng.choice(nx, i % 6, replace=False)] = True
+	datab[crmask] += rng.uniform(100, 500, np.sum(crmask))
+	maskb = np.ones((nvect, nx))
+	maskb[::4, 10] = 0
+	return datab, varb, maskb, crmask
+
+
+class TestProcblock(unittest.TestCase):
+	def setUp(self):
+		self.datab, self.varb, self.maskb, self.crmask = make_block()
+
+	def test_matches_procvect(self):
+		datab, var = self.datab, self.varb
+		nvect, nx = np.shape(datab)
+		xvals = np.array([*np.arange(100), *np.arange(150, nx)])
+		opts = dict(thresh=3, q=10, v0=4, func="polyfunc", parm=2)
+
+		varb = np.copy(var)
+		maskb = np.copy(self.maskb)
+		fiteval, maskb, errflag, coeffb = procblock(datab, xvals=xvals, varb=varb, maskb=maskb, **opts)
+		self.assertTrue(np.all(maskb[:, xvals][self.crmask[:, xvals]] == 0))
+		self.assertTrue(np.all(maskb[:, 100:150] == 1))
+		self.assertTrue(np.all(maskb[::4, 10] == 0))
+
+		for i in range(nvect):
+			varv = np.copy(var[i])
+			maskv = np.copy(self.maskb[i])
+			evalv, maskv, flag, coeffv = procvect(np.copy(datab[i]), xvals=xvals, varv=varv,
+			                                      maskv=maskv, **opts)
+			self.assertTrue(np.array_equal(maskv, maskb[i]))
+			self.assertTrue(np.allclose(evalv, fiteval[i]))
+			self.assertTrue(np.allclose(varv, varb[i]))
+			self.assertEqual(flag, errflag[i])
+
+	def test_reject_all(self):
+		datab, var = self.datab, self.varb
+		worst = procblock(datab, varb=np.copy(var), thresh=5, parm=2, noupdate=True)
+		every = procblock(datab, varb=np.copy(var), thresh=5, parm=2, noupdate=True, reject="all")
+
+		# Rejecting everything above threshold on each pass is more aggressive,
+		# so it must mask at least every pixel the worst-first mode masks
+		self.assertTrue(np.all(every[1][worst[1] == 0] == 0))
+		self.assertTrue(np.sum(worst[1] == 0) > 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -12,7 +12,8 @@ Created on 9/27/2021$
 
 import numpy as np
 from numpy.polynomial import Polynomial
-from lib.procvect import procvect
+from lib.procvect import procvect, PreparedVect
+from lib.excep import VectorLengthException, ParameterException
 from matplotlib import pyplot as plt
 from astropy.io import fits
 import random
@@ -130,5 +131,71 @@ class TestProcvect(unittest.TestCase):
 		self.assertTrue(np.all(np.isclose(subtracted, np.zeros_like(subtracted))))
 
 
+class TestPreparedVect(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		self.nx = 60
+		self.data = 50 + rng.normal(0, 2, (20, self.nx)) + np.arange(self.nx) / 10.
+		self.data[rng.integers(0, 20, 30), rng.integers(0, self.nx, 30)] += 200
+		self.var = np.full((20, self.nx), 4.)
+		self.mult = rng.uniform(0.5, 1.5, (20, self.nx))
+		self.bg = rng.uniform(0, 5, (20, self.nx))
+
+	def _compare(self, fitter, kw, vects):
+		# One fitter reused for every vector gives what procvect gives for
+		# each vector alone
+		for i in range(len(self.data)):
+			args = [{k: np.copy(v[i]) for k, v in vects.items()} for _ in range(2)]
+			for a in args:
+				a["maskv"] = np.ones(self.nx)
+				a["crv"] = np.zeros(self.nx)
+			expect = procvect(self.data[i], **args[0], **kw)
+			got = fitter(self.data[i], **args[1])
+			for e, g in zip(expect, got):
+				self.assertTrue(np.array_equal(e, g))
+			for k in args[0]:
+				self.assertTrue(np.array_equal(args[0][k], args[1][k]))
+
+	def test_reuse(self):
+		xvals = np.array([*range(0, 20), *range(40, 60)])
+		kw = dict(xvals=xvals, func="polyfunc", parm=1, thresh=4, q=2, v0=1)
+		self._compare(PreparedVect(self.nx, **kw), kw, dict(varv=self.var, skyvarv=self.var))
+
+		kw = dict(func="polyfunc", parm=2, thresh=5, absthresh=True)
+		self._compare(PreparedVect(self.nx, **kw), kw, dict(varv=self.var, multv=self.mult, bgv=self.bg))
+
+		kw = dict(func="extractfunc", thresh=4, q=1, v0=1)
+		self._compare(PreparedVect(self.nx, **kw), kw, dict(varv=self.var, multv=self.mult))
+
+	def test_defaults(self):
+		fitter = PreparedVect(self.nx, parm=1, thresh=4)
+		fiteval, maskv, errflag, coeffv = fitter(self.data[0])
+		expect = procvect(self.data[0], parm=1, thresh=4)
+		self.assertTrue(np.array_equal(fiteval, expect[0]))
+		self.assertTrue(np.array_equal(maskv, expect[1]))
+		self.assertTrue(np.all(fitter.crv[maskv == 1] > 0))
+
+		# The vectors of 1 made for absent varv and maskv are reused, and the
+		# masks returned are not changed by later calls
+		masks = [fitter(self.data[i])[1] for i in range(len(self.data))]
+		for i, maskv in enumerate(masks):
+			expect = procvect(self.data[i], parm=1, thresh=4)
+			self.assertTrue(np.array_equal(maskv, expect[1]))
+		clean = fitter(50 + np.arange(self.nx) / 10.)[1]
+		fitter(self.data[0])
+		self.assertTrue(np.all(clean == 1))
+		self.assertTrue(np.all(fitter.ones == 1))
+
+	def test_checks(self):
+		with self.assertRaises(ParameterException):
+			PreparedVect(10, thresh=-1)
+		with self.assertRaises(ParameterException):
+			PreparedVect(10, bpct=2)
+		with self.assertRaises(ParameterException):
+			PreparedVect(10, func="nosuchfunc")
+		with self.assertRaises(VectorLengthException):
+			procvect(np.ones(10), varv=np.ones(9))
+
+
 if __name__ == '__main__':
 	unittest.main()
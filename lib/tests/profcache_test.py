@@ -0,0 +1,66 @@
+"""
+Name: profcache_test.py
+
+Purpose: Test that a batch with profreuse reuses the reference profile while
+the trace holds still, and fits it again when the trace drifts.
+
+Category: Tests
+
+Calling Example: test_profcache()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.benchmarks.synth import synth_frame
+from lib.optspecextr import optspecextr_batch
+from lib.profcache import ProfileCache, trace_centroids
+from lib.utils import Config
+import os
+import tempfile
+import unittest
+import yaml
+
+
+class TestProfileCache(unittest.TestCase):
+	def test_drift(self):
+		still = synth_frame(100, 40, seed=0)
+		moved = synth_frame(100, 40, x0=20.5, seed=1)
+		cache = ProfileCache(tol=0.2)
+		self.assertTrue(cache.needs_fit(still['data'], still['x1'], still['x2']))
+
+		cache.store(Config(profim=still['profim'], dataim=still['data'], x1=still['x1'], x2=still['x2']))
+		self.assertFalse(cache.needs_fit(synth_frame(100, 40, seed=2)['data'], still['x1'], still['x2']))
+		self.assertTrue(cache.needs_fit(moved['data'], still['x1'], still['x2']))
+		self.assertGreater(cache.drift, 0.2)
+		self.assertEqual(len(trace_centroids(still['data'], still['x1'], still['x2'])), 8)
+
+	def test_batch(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			for i, x0 in enumerate((20., 20., 20., 21., 21.)):
+				frame = synth_frame(64, 40, x0=x0, sky=0., skyslope=0., halfwidth=7, seed=i)
+				fits.PrimaryHDU(frame['data'].astype(np.float32)).writeto(os.path.join(tmp, "f%d.fits" % i))
+
+			config = dict(rn=2.0, q=10.0, x1=13, x2=27, bgdeg=1, bthresh=3, verbose=0, plottype=0,
+			              noupdate=True, profreuse=True, profdrift=0.2)
+			reports = {}
+			for reuse in (True, False):
+				config.update(profreuse=reuse, output_dir=os.path.join(tmp, "out%d" % reuse))
+				with open(os.path.join(tmp, "config.yaml"), "w") as f:
+					yaml.safe_dump(config, f)
+				reports[reuse] = optspecextr_batch(os.path.join(tmp, "config.yaml"),
+				                                   [os.path.join(tmp, "f*.fits")])
+
+			self.assertTrue(all(r['ok'] for r in reports[True]))
+			self.assertEqual([r['profile'] for r in reports[True]], ["reused"] * 3 + ["fit", "reused"])
+			self.assertNotIn('profile', reports[False][0])
+
+			for r in reports[True]:
+				reused = fits.getdata(os.path.join(tmp, "out1", r['prefix'] + "_products.fits"), "OPTSPEC")
+				fitted = fits.getdata(os.path.join(tmp, "out0", r['prefix'] + "_products.fits"), "OPTSPEC")
+				self.assertLess(np.max(np.abs(reused / fitted - 1)), 0.02)
+
+
+if __name__ == '__main__':
+	unittest.main()
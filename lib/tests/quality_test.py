@@ -0,0 +1,121 @@
+"""
+Name: quality_test.py
+
+Purpose: Test that the quality plane records the rejections of each stage,
+as the stage masks and error vectors do, and that it is saved with the
+meaning of its bits.
+
+Category: Tests
+
+Calling Example: test_quality()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.benchmarks.synth import synth_frame
+from lib.fitbg import fitbg
+from lib.stdextr import stdextr
+from lib.stream import streamextr
+from lib.vectsetup import fitprof, extrspec
+from lib.quality import *
+from lib.utils import Config
+from lib.output import FrameWriter
+import os
+import tempfile
+import unittest
+
+
+class TestQuality(unittest.TestCase):
+	def setUp(self):
+		self.frame = synth_frame(300, 50, crrate=0.01, seed=4)
+		self.x1, self.x2 = self.frame['x1'], self.frame['x2']
+		self.inmask = np.ones((300, 50))
+		self.inmask[10, 5] = self.inmask[20, self.x1 + 2] = 0
+
+	def test_stages(self):
+		frame, x1, x2 = self.frame, self.x1, self.x2
+		cols = slice(x1, x2 + 1)
+		opts = dict(q=frame['q'], v0=frame['rn'] ** 2, bthresh=3, bgdeg=1)
+		quality = quality_plane(self.inmask)
+		self.assertEqual(quality.dtype, np.uint8)
+		self.assertTrue(np.array_equal(quality == USER_BAD, self.inmask == 0))
+
+		errvect = np.ones(300)
+		bgim, varim, marked = fitbg(frame['data'], x1, x2, varim=np.copy(frame['var']), errvect=errvect,
+		                            quality=quality, **opts)
+		self.assertIs(marked, quality)
+		self.assertTrue(np.any(quality & SKY_CR))
+		self.assertFalse(np.any((quality & SKY_CR) & (quality & USER_BAD)))
+		self.assertTrue(np.array_equal(np.all(quality & SKY_FAIL, 1), errvect == 0))
+
+		# An inmask passed without quality is given back with the same rejections
+		inmask = np.copy(self.inmask)
+		fitbg(frame['data'], x1, x2, varim=np.copy(frame['var']), inmask=inmask, **opts)
+		self.assertTrue(np.array_equal(quality_mask(quality), inmask))
+
+		# The stages read the mask from quality
+		dataim = frame['data'] - bgim
+		stdspec, stdvar, adjspec, dataim = stdextr(dataim, varim, x1, x2, quality=quality)
+		self.assertTrue(np.array_equal(stdspec, stdextr(dataim, varim, x1, x2, inmask=inmask)[0]))
+		rc = Config(dataim=dataim, varim=varim, bgim=bgim, spec=stdspec, x1=x1, x2=x2, pthresh=4, quality=quality,
+		            **opts)
+		fitprof(rc)
+		self.assertTrue(np.array_equal((quality[:, cols] & PROF_CR) != 0, rc.difpmask == 1))
+		self.assertFalse(np.any(quality[:, :x1] & PROF_CR))
+		legacy = Config(dataim=dataim, varim=np.copy(rc.varim), profim=rc.profim, bgim=bgim, inmask=inmask, x1=x1, x2=x2,
+		                **opts)
+		extrspec(legacy)
+		extrspec(rc)
+		self.assertTrue(np.array_equal((quality[:, cols] & EXTR_CR) != 0,
+		                               (legacy.exmask[:, cols] == 0) & (inmask[:, cols] == 1)))
+		self.assertTrue(np.any(quality & EXTR_CR))
+		self.assertTrue(np.array_equal(rc.optspec, legacy.optspec))
+		self.assertEqual(legacy.exmask.dtype, np.byte)
+		self.assertIsNone(rc.exmask)
+
+		# Most cosmic rays are recorded by one stage or another
+		found = (quality & (SKY_CR | PROF_CR | EXTR_CR)) != 0
+		self.assertGreater(np.mean(found[frame['crmask'] == 1]), 0.8)
+
+		counts = quality_counts(quality)
+		self.assertEqual(counts['USER_BAD'], 2)
+		self.assertEqual(counts['SKY_CR'], np.count_nonzero(quality & SKY_CR))
+
+	def test_mark_rows(self):
+		quality = quality_plane(shape=(4, 6))
+		mark_rows(quality, [1, 0, 1, 1], SKY_FAIL)
+		mark_rows(quality, [1, 0, 1], PROF_FAIL, slice(2, 5), byrow=False)
+		self.assertTrue(np.all(quality[1] & SKY_FAIL))
+		self.assertEqual(np.count_nonzero(quality & SKY_FAIL), 6)
+		self.assertEqual(list(np.flatnonzero(quality[0] & PROF_FAIL)), [3])
+
+	def test_stream(self):
+		# The streamed pipeline records the aperture of the staged one
+		frame, x1, x2 = self.frame, self.x1, self.x2
+		opts = dict(x1=x1, x2=x2, q=frame['q'], rn=frame['rn'], bthresh=3, bgdeg=1, inmask=self.inmask)
+		sc = streamextr(frame['data'], dict(opts, blockrows=64))
+		self.assertEqual(np.shape(sc.quality), (300, x2 - x1 + 1))
+		self.assertEqual(sc.quality[20, 2], USER_BAD)
+		self.assertTrue(np.any(sc.quality & EXTR_CR))
+		self.assertFalse(np.any((sc.quality & EXTR_CR) & (sc.quality & REJECTED)))
+
+	def test_save(self):
+		quality = quality_plane(self.inmask)
+		quality[5, 5] |= SKY_CR | EXTR_FAIL
+		with tempfile.TemporaryDirectory() as tmp:
+			with FrameWriter(tmp, compress=True) as writer:
+				writer.add("frame", "QUALITY", quality, quality_cards())
+				writer.write("frame")
+			with fits.open(os.path.join(tmp, "frame_products.fits")) as hdus:
+				self.assertEqual(hdus[1].name, "QUALITY")
+				self.assertTrue(np.array_equal(hdus[1].data, quality))
+				self.assertEqual(hdus[1].data.dtype.itemsize, 1)
+				header = hdus[1].header
+				names = [header["QBIT%d" % n] for n in range(len(QUALITY_BITS))]
+				self.assertEqual(names, [name for name, bit, desc in QUALITY_BITS])
+
+
+if __name__ == '__main__':
+	unittest.main()
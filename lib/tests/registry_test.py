@@ -0,0 +1,79 @@
+"""
+Name: registry_test.py
+
+Purpose: Test that fitters are resolved once through the registry, and that
+procblock fits with a fitter's batch form or, without one, row by row.
+
+Category: Tests
+
+Calling Example: test_registry()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.excep import ParameterException
+from lib.fitting.polyfunc import polyfunc
+from lib.fitting.registry import get_fitter, register_fitter
+from lib.procblock import procblock
+from lib.procvect import procvect
+import unittest
+
+
+def make_block(nvect, nx=256, seed=0):
+	# Rows of a quadratic with noise and i % 6 cosmic rays in row i, so the
+	# rows drop out of the clipping after different passes, and one row with
+	# too few pixels left unmasked to fit
+	rng = np.random.default_rng(seed)
+	xvals = np.linspace(-1, 1, nx)
+	datab = 200 + np.arange(nvect)[:, None] + 10 * xvals - 20 * xvals ** 2 + rng.normal(0, 2, (nvect, nx))
+	for i in range(nvect):
+		bad = rng.choice(nx, i % 6, replace=False)
+		datab[i, bad] += rng.uniform(50, 500, len(bad))
+	maskb = np.ones((nvect, nx))
+	maskb[1, 4:] = 0
+	return datab, maskb
+
+
+class TestRegistry(unittest.TestCase):
+	def test_lookup(self):
+		fitter = get_fitter("polyfunc")
+		self.assertIs(get_fitter("polyfunc"), fitter)
+		self.assertIs(get_fitter(fitter), fitter)
+		self.assertTrue(fitter.batched)
+		self.assertTrue(get_fitter("myfunc").batched)
+		with self.assertRaises(ParameterException):
+			get_fitter("nosuchfunc")
+
+	def test_loop_fallback(self):
+		# polyfunc registered without its batch form is fitted row by row,
+		# and gives what the batch form gives
+		looped = register_fitter("polyloop", polyfunc)
+		self.assertFalse(looped.batched)
+
+		datab, maskb = make_block(nvect=12)
+		xvals = np.array([*np.arange(100), *np.arange(150, 256)])
+		results = [procblock(datab, xvals=xvals, varb=np.full(datab.shape, 4.), maskb=np.copy(maskb), thresh=3, v0=4,
+		                     parm=2, func=func)
+		           for func in ("polyfunc", "polyloop")]
+		self.assertTrue(np.array_equal(results[0][1], results[1][1]))
+		self.assertTrue(np.array_equal(results[0][2], results[1][2]))
+		self.assertEqual(list(np.nonzero(results[0][2])[0]), [1])
+		self.assertTrue(np.allclose(results[0][0], results[1][0]))
+		self.assertTrue(np.allclose(results[0][3], results[1][3]))
+
+	def test_myfunc(self):
+		# The template user fitter works both ways
+		datab = 10 + np.random.default_rng(0).normal(0, 1, (6, 50))
+		datab[2, 7] += 100
+		fiteval, maskb, errflag, coeffb = procblock(datab, func="myfunc", thresh=5)
+		self.assertEqual(maskb[2, 7], 0)
+		for i in range(6):
+			evalv, maskv, flag, coeffv = procvect(np.copy(datab[i]), func="myfunc", thresh=5)
+			self.assertTrue(np.array_equal(maskv, maskb[i]))
+			self.assertTrue(np.allclose(evalv, fiteval[i]))
+		self.assertTrue(np.allclose(coeffb[:, 0], 10, atol=0.5))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+"""
+Name: sampleshift_test.py
+
+Purpose: Test the resampling modes of sampleshift against resampling each
+row on its own with numpy and scipy.
+
+Category: Tests
+
+Calling Example: test_sampleshift()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from numpy.polynomial import polynomial as poly
+from scipy.interpolate import CubicSpline
+from lib.sampleshift import sampleshift, searchsorted_rows, sampleshift_operator, resample
+import unittest
+
+
+class TestSampleShift(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		ny, nxi, level = 40, 20, 7
+		self.inx = (np.arange(nxi)[None, :] - rng.uniform(7, 12, ny)[:, None]) / rng.uniform(1.5, 2.5, ny)[:, None]
+		self.data = np.exp(-0.5 * self.inx ** 2) + rng.normal(0, 0.01, (ny, nxi))
+		self.outx = np.linspace(self.inx.min(1), self.inx.max(1), nxi * level).T + rng.uniform(-0.3, 0.3, (ny, 1))
+
+	def test_searchsorted_rows(self):
+		idx = searchsorted_rows(self.inx, self.outx)
+		for i in range(len(idx)):
+			self.assertTrue(np.array_equal(idx[i], np.searchsorted(self.inx[i], self.outx[i])))
+
+	def test_expand(self):
+		inx, data, outx = self.inx, self.data, self.outx
+		nearest = np.argmin(abs(outx[:, :, None] - inx[:, None, :]), 2)
+		self.assertTrue(np.array_equal(sampleshift(data, inx, outx, fitsample=True),
+		                               np.take_along_axis(data, nearest, 1)))
+
+		interp = np.array([np.interp(x, xp, fp) for x, xp, fp in zip(outx, inx, data)])
+		self.assertTrue(np.allclose(sampleshift(data, inx, outx, fitinterp=True), interp))
+
+		spline = np.array([CubicSpline(xp, fp, bc_type="natural")(x) for x, xp, fp in zip(outx, inx, data)])
+		spline = np.where(outx <= inx[:, :1], data[:, :1], np.where(outx >= inx[:, -1:], data[:, -1:], spline))
+		self.assertTrue(np.allclose(sampleshift(data, inx, outx), spline))
+
+		# Decreasing coordinates give the same result
+		self.assertTrue(np.allclose(sampleshift(data[:, ::-1], inx[:, ::-1], outx), spline))
+
+	def test_operator(self):
+		inx, data, outx = self.inx, self.data, self.outx
+		inx, data = np.copy(inx), np.copy(data)
+		inx[::3], data[::3] = inx[::3, ::-1], data[::3, ::-1]
+		ny, nxi = np.shape(inx)
+		for level in (3, 7, 15):
+			outx = np.linspace(inx.min(1), inx.max(1), nxi * level).T
+			operator = sampleshift_operator(inx, outx, fitspline=True)
+			stack = resample(operator, np.stack([data, 2 * data], -1))
+			self.assertTrue(np.allclose(stack[..., 0], sampleshift(data, inx, outx)))
+			self.assertTrue(np.allclose(stack[..., 1], 2 * stack[..., 0]))
+
+			# A few terms for each output coordinate and input pixel, rather
+			# than one for every pixel of the row
+			self.assertLessEqual(operator.nnz, 4 * outx.size + 6 * inx.size)
+
+	def test_contract(self):
+		inx, outx = self.inx, self.outx
+		big = np.exp(-0.5 * outx ** 2)
+		average = sampleshift(big, outx, inx, fitaverage=True)
+		fitted = sampleshift(big, outx, inx, fitpoly=True)
+
+		halfwidth = np.mean(np.diff(inx, axis=1)) / 2
+		for i in range(len(inx)):
+			rowhalf = np.mean(np.diff(inx[i])) / 2
+			for j in range(np.shape(inx)[1]):
+				near = np.flatnonzero(abs(outx[i] - inx[i, j]) <= halfwidth)
+				if len(near):
+					self.assertAlmostEqual(average[i, j], np.mean(big[i, near]))
+
+				near = np.flatnonzero(abs(outx[i] - inx[i, j]) <= rowhalf)
+				if outx[i, 0] < inx[i, j] < outx[i, -1] and len(near) > 1:
+					deg = 2 if len(near) > 2 else 1
+					self.assertAlmostEqual(fitted[i, j],
+					                       poly.polyval(inx[i, j], poly.polyfit(outx[i, near], big[i, near], deg)))
+
+
+if __name__ == '__main__':
+	unittest.main()
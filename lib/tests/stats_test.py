@@ -0,0 +1,74 @@
+"""
+Name: stats_test.py
+
+Purpose: Test the stage timing and vector fit counters.
+
+Category: Tests
+
+Calling Example: test_stats()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.benchmarks.synth import synth_frame
+from lib.fitbg import fitbg
+from lib.stats import Stats
+from lib.vectsetup import extrspec
+from lib.utils import Config
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+
+class TestStats(unittest.TestCase):
+	def test_fitbg_counts(self):
+		frame = synth_frame(80, 40, crrate=0.01, seed=2)
+		results = []
+		for opts in ({}, {"batch": True}, {"workers": 2}):
+			stats = Stats()
+			with stats.stage("fitbg"):
+				bgim, varim, inmask = fitbg(frame['data'], frame['x1'], frame['x2'], varim=np.copy(frame['var']),
+				                            q=frame['q'], v0=frame['rn'] ** 2, bthresh=4, stats=stats, **opts)
+			fitbg_stats = stats.as_dict()["fitbg"]
+			self.assertGreater(fitbg_stats["time"], 0)
+			self.assertEqual(fitbg_stats["vectors"], 80)
+			self.assertEqual(fitbg_stats["rejected"], np.sum(inmask == 0))
+			self.assertGreaterEqual(fitbg_stats["iterations"], 80 + fitbg_stats["rejected"])
+			results.append(fitbg_stats)
+
+		for r in results[1:]:
+			self.assertEqual({k: v for k, v in r.items() if k != "time"},
+			                 {k: v for k, v in results[0].items() if k != "time"})
+
+	def test_dump(self):
+		frame = synth_frame(50, 30, crrate=0.01, seed=3)
+		profim = np.copy(frame['profim'])
+		profim[[4, 9]] = 0
+		for batch in (False, True):
+			stats = Stats()
+			with stats.stage("extrspec"):
+				rc = Config(dataim=frame['data'] - frame['skyim'], varim=np.copy(frame['var']),
+				            profim=profim, x1=frame['x1'], x2=frame['x2'], q=frame['q'],
+				            v0=frame['rn'] ** 2, batch=batch, stats=stats)
+				extrspec(rc)
+			self.assertEqual(stats.as_dict()["extrspec"]["vectors"], 50)
+			self.assertEqual(stats.as_dict()["extrspec"]["errflag"], np.sum(rc.eerrvect == 0))
+			# The rows without profile are counted rather than printed
+			self.assertEqual(stats.as_dict()["extrspec"]["noprofile"], 2)
+
+		with tempfile.TemporaryDirectory() as tmp:
+			stats.dump(os.path.join(tmp, "stats.json"))
+			stats.dump(os.path.join(tmp, "stats.csv"))
+			with open(os.path.join(tmp, "stats.json")) as f:
+				self.assertEqual(json.load(f), stats.as_dict())
+			with open(os.path.join(tmp, "stats.csv")) as f:
+				rows = list(csv.reader(f))
+		self.assertEqual(rows[0], ["stage", "time", "vectors", "iterations", "rejected", "errflag", "noprofile"])
+		self.assertEqual(rows[1][0], "extrspec")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+"""
+Name: stdextr_test.py
+
+Purpose: Test the standard extraction over x1..x2, and that adjspec repairs
+the bad pixels of the aperture as interpolating each row does, without
+changing the caller's image unless inplace is set.
+
+Category: Tests
+
+Calling Example: test_stdextr()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.stdextr import stdextr, repair_aperture
+import unittest
+
+
+class TestStdExtr(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		self.dataim = rng.normal(100, 10, (50, 30))
+		self.varim = rng.uniform(1, 2, (50, 30))
+		self.inmask = (rng.random((50, 30)) > 0.1).astype(np.byte)
+		self.inmask[3, 10:21] = 0  # a row without good pixels in the aperture
+		self.x1, self.x2 = 10, 20
+
+	def test_sum(self):
+		stdspec, stdvar, adjspec, dataim = stdextr(self.dataim, self.varim, self.x1, self.x2, inmask=self.inmask)
+		cols = slice(self.x1, self.x2 + 1)
+		self.assertTrue(np.allclose(stdspec, np.sum((self.dataim * self.inmask)[:, cols], 1)))
+		self.assertTrue(np.allclose(stdvar, np.sum((self.varim * self.inmask)[:, cols], 1)))
+		self.assertFalse(adjspec)
+		self.assertIs(dataim, self.dataim)
+
+	def test_repair(self):
+		aperture, adjspec = repair_aperture(self.dataim, self.inmask, self.x1, self.x2)
+		idx = np.arange(self.x2 - self.x1 + 1)
+		for i in range(50):
+			good = self.inmask[i, self.x1:self.x2 + 1] == 1
+			if not np.any(good):
+				self.assertTrue(np.all(aperture[i] == 0))
+				continue
+			expect = np.interp(idx, idx[good], self.dataim[i, self.x1:self.x2 + 1][good])
+			self.assertTrue(np.allclose(aperture[i], expect))
+		self.assertTrue(np.allclose(adjspec, np.sum(aperture, 1)))
+
+	def test_adjspec(self):
+		original = np.copy(self.dataim)
+		stdspec, stdvar, adjspec, dataim = stdextr(self.dataim, self.varim, self.x1, self.x2, inmask=self.inmask,
+		                                           adjspec=True)
+		self.assertTrue(np.array_equal(self.dataim, original))
+		aperture, expect = repair_aperture(original, self.inmask, self.x1, self.x2)
+		self.assertTrue(np.allclose(adjspec, expect))
+		self.assertTrue(np.allclose(dataim[:, self.x1:self.x2 + 1], aperture))
+
+		stdextr(self.dataim, self.varim, self.x1, self.x2, inmask=self.inmask, adjspec=True, inplace=True)
+		self.assertTrue(np.allclose(self.dataim, dataim))
+		self.assertFalse(np.array_equal(self.dataim, original))
+
+	def test_no_mask(self):
+		# Without a mask the sums skip masking and match a mask of ones
+		ones = np.ones(np.shape(self.dataim))
+		for adjspec in (False, True):
+			expect = stdextr(self.dataim, self.varim, self.x1, self.x2, inmask=ones, adjspec=adjspec)
+			got = stdextr(self.dataim, self.varim, self.x1, self.x2, adjspec=adjspec)
+			for e, g in zip(expect, got):
+				self.assertTrue(np.array_equal(e, g))
+
+
+if __name__ == '__main__':
+	unittest.main()
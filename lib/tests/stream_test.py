@@ -0,0 +1,98 @@
+"""
+Name: stream_test.py
+
+Purpose: Test the streaming pipeline against the staged one, and that
+reduce_frame gives the same products streamed as staged.
+
+Category: Tests
+
+Calling Example: test_stream()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from lib.fitbg import fitbg
+from lib.stdextr import stdextr
+from lib.stream import streamextr
+from lib.vectsetup import fitprof, extrspec
+from lib.utils import Config
+from lib.quality import quality_plane, USER_BAD, SKY_CR
+from lib.optspecextr import reduce_frame
+from astropy.io import fits
+import os
+import tempfile
+import unittest
+
+
+def make_frame(ny=120, nx=40, seed=0):
+	# A Gaussian trace on a sloped sky, with cosmic rays on the sky and the
+	# trace in the rows on either side of every 32 row block boundary, and an
+	# input mask with a bad segment across one of them
+	rng = np.random.default_rng(seed)
+	x = np.arange(nx)
+	prof = np.exp(-0.5 * ((x - 20) / 2.) ** 2)
+	data = 100 + 0.5 * x + 2000 * prof * np.ones((ny, 1))
+	data = data + rng.normal(0, np.sqrt(data / 10 + 4))
+	edges = np.array([31, 32, 63, 64, 95, 96])
+	data[edges, 5] += 1000
+	data[edges, 21] += 1000
+	inmask = np.ones((ny, nx))
+	inmask[60:68, 18] = 0
+	return data, inmask
+
+
+class TestStream(unittest.TestCase):
+	def test_stream_matches_staged(self):
+		data, inmask = make_frame()
+		opts = dict(x1=14, x2=26, q=10., rn=2., bgdeg=1, bthresh=3, batch=True, noupdate=True)
+
+		# The staged pipeline, as in reduce_frame
+		v0 = opts['rn'] ** 2
+		varim = np.abs(data) / opts['q'] + v0
+		bgim, varim, quality = fitbg(data, varim=varim, v0=v0, quality=quality_plane(inmask), **opts)
+		self.assertTrue(np.all(quality[[31, 32, 63, 64, 95, 96], 5] & SKY_CR))
+		dataim = data - bgim
+		stdspec, stdvar, adjspec, dataim = stdextr(dataim, varim, quality=quality, **opts)
+		rc = Config(dataim=dataim, varim=varim, bgim=bgim, quality=quality, spec=stdspec, v0=v0, **opts)
+		fitprof(rc)
+		extrspec(rc)
+
+		cols = slice(opts['x1'], opts['x2'] + 1)
+		for blockrows in (32, 1000):
+			sc = streamextr(data, dict(opts, blockrows=blockrows, inmask=inmask))
+			self.assertEqual((sc.x1, sc.x2, sc.xoffset), (0, 12, 14))
+			self.assertTrue(np.allclose(sc.stdspec, stdspec))
+			self.assertTrue(np.allclose(sc.bgim, bgim[:, cols]))
+			self.assertTrue(np.array_equal(sc.quality, quality[:, cols]))
+			self.assertTrue(np.all(sc.quality[60:68, 4] == USER_BAD))
+			self.assertTrue(np.allclose(sc.profim, rc.profim[:, cols]))
+			self.assertTrue(np.allclose(sc.optspec, rc.optspec))
+			self.assertTrue(np.allclose(sc.opvar, rc.opvar))
+
+	def test_reduce_frame(self):
+		# A single precision frame, as read from FITS, which reduce_frame keeps
+		# in single precision
+		data, inmask = make_frame(seed=5)
+		data = data.astype('>f4')
+		opts = dict(x1=14, x2=26, q=10., rn=2., bgdeg=2, bthresh=3, adjspec=True, verbose=0, plottype=0,
+		            blockrows=32)
+		cols = slice(14, 27)
+		with tempfile.TemporaryDirectory() as tmp:
+			products = []
+			for stream in (False, True):
+				outdir = os.path.join(tmp, str(stream))
+				optspec = reduce_frame(data, dict(opts, stream=stream, inmask=inmask, output_dir=outdir), "frame")
+				with fits.open(os.path.join(outdir, "frame_products.fits")) as hdus:
+					products.append({hdu.name: np.array(hdu.data) for hdu in hdus[1:]})
+				self.assertTrue(np.array_equal(optspec, products[-1]["OPTSPEC"]))
+
+		staged, streamed = products
+		for name in ("OPTSPEC", "OPVAR", "STDSPEC", "STDVAR"):
+			self.assertTrue(np.array_equal(streamed[name], staged[name]), name)
+		for name in ("BGSUB", "BGIM", "PROFILE", "VARIANCE", "QUALITY"):
+			self.assertTrue(np.array_equal(streamed[name], staged[name][:, cols]), name)
+
+
+if __name__ == '__main__':
+	unittest.main()
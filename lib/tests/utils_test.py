@@ -0,0 +1,80 @@
+"""
+Name: utils_test.py
+
+Purpose: Test the section-only FITS loading.
+
+Category: Tests
+
+Calling Example: test_utils()
+
+Created on 10/18/2026$
+"""
+
+import numpy as np
+from astropy.io import fits
+from lib.utils import load_fits, load_frame, sky_bounds, constant_plane, constant_value, plane_dtype
+from lib.excep import ParameterException
+from lib.fitbg import fitbg
+import os
+import tempfile
+import unittest
+
+
+class TestSectionLoading(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		x = np.arange(120)
+		self.data = (100 + 0.2 * x + 2000 * np.exp(-0.5 * ((x - 60) / 2.) ** 2) +
+		             rng.normal(0, 3, (50, 120))).astype(np.float32)
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, "frame.fits")
+		fits.PrimaryHDU(self.data).writeto(self.path)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_load_section(self):
+		section = load_fits(self.path, section=(40, 81), chunkrows=7)
+		self.assertEqual(section.dtype, np.double)
+		self.assertTrue(np.array_equal(section, self.data[:, 40:81]))
+
+	def test_load_frame(self):
+		opts = dict(x1=55, x2=65, section=True, skywidth=15, chunkrows=16)
+		data, frameopts = load_frame(self.path, opts)
+
+		c1, c2 = sky_bounds(55, 65, 120, 15)
+		self.assertEqual((c1, c2), (40, 81))
+		self.assertEqual(np.shape(data), (50, 41))
+		self.assertEqual((frameopts['x1'], frameopts['x2'], frameopts['xoffset']), (15, 25, 40))
+		self.assertEqual(opts['x1'], 55)
+
+		# The background fitted to the section matches the full frame's
+		bgfull = fitbg(self.data.astype(np.double), 55, 65, skywidth=15, bgdeg=1, verbose=0)[0]
+		bgsect = fitbg(data, 15, 25, skywidth=15, bgdeg=1, verbose=0)[0]
+		self.assertTrue(np.allclose(bgfull[:, 40:81], bgsect))
+
+
+class TestConstantPlane(unittest.TestCase):
+	def test_constant_plane(self):
+		plane = constant_plane(1, (4000, 3000), np.byte)
+		self.assertEqual(plane.shape, (4000, 3000))
+		self.assertEqual(plane.dtype, np.byte)
+		self.assertEqual(plane.strides, (0, 0))
+		self.assertFalse(plane.flags.writeable)
+
+		self.assertEqual(constant_value(plane), 1)
+		self.assertEqual(constant_value(plane[10:20, 5]), 1)
+		self.assertEqual(constant_value(0.), 0)
+		self.assertIsNone(constant_value(None))
+		self.assertIsNone(constant_value(np.ones((3, 3))))
+		self.assertIsNone(constant_value(np.broadcast_to(np.arange(3.), (3, 3))))
+
+	def test_plane_dtype(self):
+		self.assertEqual(plane_dtype(), np.float64)
+		self.assertEqual(plane_dtype("float32"), np.float32)
+		with self.assertRaises(ParameterException):
+			plane_dtype("int16")
+
+
+if __name__ == '__main__':
+	unittest.main()
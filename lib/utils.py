@@ -19,6 +19,7 @@ Created on 4/17/2021$
 """
 
 from astropy.io import fits
+import numpy as np
 from lib.excep import ParameterException
 import os
 
@@ -26,6 +27,12 @@ class Config:
 	def __init__(self, **config_entries):
 		self.__dict__.update(config_entries)
 
+	def __getattr__(self, name):
+		# Options left out of the configuration read as unset, like IDL keywords
+		if name.startswith("__"):
+			raise AttributeError(name)
+		return None
+
 def check_defaults(rc):
 
 	with open("./lib/defaults.yaml") as r:
@@ -51,25 +58,161 @@ def check_defaults(rc):
 			pass
 
 
-def load_config(config_file):
+def read_config(config_file):
 	with open(config_file) as r:
 		config_map = yaml.safe_load(r)
 
-	#rc = Config(**config_map)
-
-	with fits.open(config_map['data_file']) as r:
-		fits_data = r[0].data
-
-	data = fits_data
-
 	empty_keys = [k for k, v in config_map.items() if v==None]
 	for k in empty_keys:
 		config_map.pop(k)
 
+	return config_map
+
+def sky_bounds(x1, x2, nx, skywidth=None):
+	"""
+	Returns the half-open column range (c1, c2) holding the x1..x2 aperture
+	and the sky windows of skywidth columns either side of it that fitbg
+	fits. Without skywidth the sky is every column outside the aperture.
+	"""
+	if skywidth is None:
+		return 0, nx
+	return max(0, x1 - skywidth), min(nx, x2 + 1 + skywidth)
+
+def fill_bad(datab, maskb):
+	"""
+	Replaces the pixels of every row of a block that are not in maskb by
+	linear interpolation between the nearest good pixels either side, or the
+	nearest good pixel past the ends of the good pixels, for every row at
+	once. Rows without good pixels are set to 0. Returns a new array.
+	"""
+	datab = np.atleast_2d(datab)
+	nvect, n = np.shape(datab)
+	good = np.asarray(maskb, bool)
+	idx = np.arange(n)
+	# The nearest good pixel at or before, and at or after, each pixel, by
+	# running maxima and minima of the good pixels' indices
+	left = np.maximum.accumulate(np.where(good, idx, -1), 1)
+	right = np.minimum.accumulate(np.where(good, idx, n)[:, ::-1], 1)[:, ::-1]
+	left = np.where(left < 0, right, left)
+	right = np.where(right >= n, left, right)
+
+	rows = np.arange(nvect)[:, None]
+	nogood = left >= n
+	left[nogood] = 0
+	right[nogood] = 0
+	lval = datab[rows, left]
+	rval = datab[rows, right]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		frac = np.where(right > left, (idx - left) / (right - left), 0.)
+	filled = np.where(good, datab, lval + frac * (rval - lval))
+	filled[nogood] = 0.
+	return filled
+
+def constant_plane(value, shape, dtype=np.double):
+	"""
+	The image of the given shape with every pixel value, for an optional
+	plane (mask, variance, sky) that was not passed. It is a read-only
+	zero-stride view of a single element, so it takes no memory, and
+	constant_value recognizes it.
+	"""
+	return np.broadcast_to(np.asarray(value, dtype), shape)
+
+def constant_value(arr):
+	"""
+	The value of every pixel of arr if it is a scalar or a zero-stride view,
+	such as constant_plane returns or slices of one, otherwise None. Lets a
+	stage take a fast path, e.g. skip masking when every pixel is good.
+	"""
+	if arr is None:
+		return None
+	if np.ndim(arr) == 0:
+		return np.asarray(arr)[()]
+	if isinstance(arr, np.ndarray) and arr.size and not any(arr.strides):
+		return arr.flat[0]
+	return None
+
+def plane_dtype(dtype=None):
+	"""
+	The floating point type the image planes of a stage are stored in and
+	worked on, for the dtype option: float32 or float64 (np.double, when it
+	is not set). This is the precision policy of every stage: the sums the
+	fits are decided by (the polynomial normal equations, the extraction and
+	standard sums) are taken in double either way, so float32 only changes
+	how the planes are stored and streamed through memory.
+	"""
+	if dtype is None:
+		return np.dtype(np.double)
+	dtype = np.dtype(dtype)
+	if dtype not in (np.float32, np.float64):
+		raise ParameterException("dtype must be float32 or float64.")
+	return dtype
+
+def load_fits(data_file, section=None, chunkrows=None):
+	"""
+	Reads the primary image of data_file. Without section or chunkrows the
+	data are returned as astropy loads them. Otherwise the file is memory
+	mapped and only columns section = (c1, c2) are read, chunkrows rows at a
+	time, each chunk converted to double as it is read, so memory peaks at
+	the float section plus one chunk.
+	"""
+	if section is None and chunkrows is None:
+		with fits.open(data_file) as r:
+			fits_data = r[0].data
+
+		return fits_data
+
+	with fits.open(data_file, memmap=True) as r:
+		hdu = r[0]
+		ny, nx = hdu.shape
+		c1, c2 = section if section is not None else (0, nx)
+		chunkrows = chunkrows or ny
+
+		fits_data = np.empty((ny, c2 - c1), np.double)
+		for lo in range(0, ny, chunkrows):
+			hi = min(ny, lo + chunkrows)
+			fits_data[lo:hi] = hdu.section[lo:hi, c1:c2]
+
+	return fits_data
+
+def load_frame(data_file, opts):
+	"""
+	Loads a frame as configured by opts. With the section option only the
+	aperture and the sky windows are read (see load_fits), and a copy of opts
+	is returned with x1 and x2 moved into the section and xoffset set to the
+	first column read.
+	"""
+	if not opts.get('section'):
+		return load_fits(data_file), opts
+
+	nx = fits.getheader(data_file)['NAXIS1']
+	x1 = int(np.round(opts['x1']))
+	x2 = int(np.round(opts['x2']))
+	c1, c2 = sky_bounds(x1, x2, nx, opts.get('skywidth'))
+
+	data = load_fits(data_file, section=(c1, c2), chunkrows=opts.get('chunkrows', 256))
+
+	opts = dict(opts)
+	opts['x1'] = x1 - c1
+	opts['x2'] = x2 - c1
+	opts['xoffset'] = c1
+
+	return data, opts
+
+def load_config(config_file):
+	config_map = read_config(config_file)
+
+	#rc = Config(**config_map)
+
+	data, config_map = load_frame(config_map['data_file'], config_map)
+
 	return data, config_map
 
-def save_fits(arr, fname):
+def save_fits(arr, fname, output_dir="./output", prefix=None):
+
+	if prefix:
+		fname = prefix + "_" + fname
+	os.makedirs(output_dir, exist_ok=True)
 
 	hdu = fits.PrimaryHDU(arr)
-	hdu.writeto("./output/"+fname+".fits", overwrite=True)
+	hdu.writeto(os.path.join(output_dir, fname+".fits"), overwrite=True)
 	return
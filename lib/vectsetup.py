@@ -19,7 +19,14 @@ Created on 5/25/2021$
 
 import numpy as np
 from lib.excep import ParameterException, VectorLengthException
-from lib.procvect import procvect
+from lib.procvect import PreparedVect
+from lib.procblock import procblock
+from lib.parallel import parmap
+from lib.stats import NOSTATS
+from lib.utils import Config, constant_plane, constant_value, plane_dtype
+from lib.quality import quality_plane, quality_mask, mark, mark_rows, REJECTED, PROF_CR, PROF_FAIL, EXTR_CR, EXTR_FAIL
+from collections import Counter
+from importlib import import_module
 from lib.misc import plot_procvect
 from lib.misc import plot_fitbg
 
@@ -42,8 +49,12 @@ def fitprof(rc):
 					default: array of 0s
 			bgim:   The background image to be subtracted off the data.
 					default: array of 0s
-			inmask: The mask used for all functions.
+			inmask: The mask used for all functions, without quality.
 					default: array of 1s
+			quality: A quality plane (see quality.py), read for the mask of
+					the aperture instead of inmask. PROF_CR is set on the
+					pixels the fit rejected and PROF_FAIL on the vectors it
+					stopped on, in place (not with adjfunc).
 			q:      The gain of the image.
 					default: 1
 			v0:     The squared read noise of the data.
@@ -52,13 +63,19 @@ def fitprof(rc):
 					default: 0.5
 		Geometry Modification:
 			adjfunc:    Function to use to conduct any geometry manipulation.
-			adjparms:   The parameters of the geometry for this dataset.
+			adjparms:   The parameters of the geometry for this dataset, filled
+						in by adjfunc (for adjgauss, with the compiled resampling
+						operators that revert the fitted profile).
 			adjoptions: Any options that can be set for the adjfunc.
 
 		Profile Smoothing Options:
 			noproffit:  If set, will not smooth profile image.
 			fitgauss:   Set to fit profile in spacial direction with a gaussian.
-			fitboxcar:  Set to fit the profile with a boxcar filter.
+			fitboxcar:  Set to fit the profile with a boxcar filter: a masked
+						running median along the wavelength axis while clipping,
+						and a masked running mean of the good pixels, with the
+						bad ones interpolated, for the profile. Every aperture
+						column is smoothed at once by procblock.
 			boxcarhw:   The width of the median in boxcar average.
 						default: 3
 			pthresh:    The threshold for sigma rejection.
@@ -79,6 +96,25 @@ def fitprof(rc):
 						default: 0
 			gotovect:   Stop when this vector is reached.
 						default: None
+
+		Instrumentation:
+			stats:      A Stats to count the vectors fitted, clipping iterations,
+						rejected pixels and errflag vectors into, as stage "fitprof"
+
+		Precision:
+			dtype:      float32 or float64, for the profile, its residuals
+						and the working variance. default: float64
+
+		Batch and Parallel Fitting:
+			batch:      Set to fit the vectors together with procblock instead
+						of calling procvect vector by vector (always with
+						fitboxcar).
+			reject:     With batch, "all" rejects every pixel above pthresh on
+						each pass rather than only the worst (see procblock).
+			workers:    Number of processes to fit blocks of vectors in.
+						default: 1
+			chunks:     Number of blocks to split the vectors into.
+						default: 4 per worker
 	Outputs:
 		Returns an image with the same dimensions as dataim containing the spatial profile,
 		optionally smoothed, positivity enforced and normalized.
@@ -89,16 +125,20 @@ def fitprof(rc):
 	nx = dims[1]
 	ny = dims[0]
 
-	if not np.any(rc.varim):
-		rc.varim = np.ones((ny, nx), np.double)
-	if not np.any(rc.inmask):
-		rc.inmask = np.ones((ny, nx), np.byte)
+	dtype = plane_dtype(rc.dtype)
+
+	# The planes not passed are constant planes, which take no memory, but
+	# for varim, which receives the updated variance
+	if rc.varim is None:
+		rc.varim = np.ones((ny, nx), dtype)
+	if rc.inmask is None and rc.quality is None:
+		rc.inmask = constant_plane(1, (ny, nx), np.byte)
 	if not rc.pthresh:
 		rc.pthresh = 3
-	if not np.any(rc.bgim):
-		rc.bgim = np.ones((ny, nx), np.double)
-	if not np.any(rc.skyvar):
-		rc.skyvar = np.ones((ny, nx), np.double)
+	if rc.bgim is None:
+		rc.bgim = constant_plane(0., (ny, nx))
+	if rc.skyvar is None:
+		rc.skyvar = constant_plane(0., (ny, nx))
 	if not rc.profdeg:
 		rc.profdeg = 3
 	if not rc.boxcarhw:
@@ -119,7 +159,7 @@ def fitprof(rc):
 		raise ParameterException("x2 must be less than nx-1 and greater than x1")
 	if np.shape(rc.varim)[1] != nx or np.shape(rc.varim)[0] != ny:
 		raise ParameterException("varim must be the same dimensions as dataim.")
-	if np.shape(rc.inmask)[1] != nx or np.shape(rc.inmask)[0] != ny:
+	if np.shape(rc.inmask if rc.quality is None else rc.quality) != (ny, nx):
 		raise ParameterException("inmask must be the same dimensions as dataim.")
 	if np.shape(rc.bgim)[1] != nx or np.shape(rc.bgim)[0] != ny:
 		raise ParameterException("bgim must be the same dimensions as dataim.")
@@ -135,46 +175,48 @@ def fitprof(rc):
 	# The image is then normalized and made greater than zero everywhere.
 
 	if rc.noproffit:
-		rc.specim = np.matmul(np.ones(nx), rc.spec)
+		rc.specim = np.broadcast_to(np.asarray(rc.spec, np.double)[:, None], (ny, nx))
 		rc.profim = rc.dataim / rc.specim
-		rc.profim = rc.profim * rc.inmask > 0
-		rc.t = np.sum(rc.profim[:, rc.x1:rc.x2], 1)
-		rc.t = np.matmul(np.ones(nx), rc.t)
-		rc.profim = rc.profim / rc.t
-		rc.profmask = rc.inmask
+		rc.profmask = _aperture_mask(rc, slice(None))
+		rc.profim = np.maximum(rc.profim * rc.profmask, 0)
+		rc.t = np.sum(rc.profim[:, rc.x1:rc.x2 + 1], 1)
+		rc.profim = rc.profim / rc.t[:, None]
 		rc.difpmask = rc.profmask - rc.profmask
-		rc.Perrvect = np.ones(ny, np.byte)
+		rc.perrvect = np.ones(ny, np.byte)
 		return rc.profim
 
 	if rc.adjfunc:
-		inarray = np.zeros((ny, rc.x2-rc.x2+1, 5))
-		inarray[:,:,0] = rc.dataim[:, rc.x1:rc.x2]
-		inarray[:, :, 1] = rc.varim[:, rc.x1:rc.x2]
-		inarray[:, :, 2] = rc.inmask[:, rc.x1:rc.x2]
-		inarray[:, :, 3] = rc.skyvar[:, rc.x1:rc.x2]
-		inarray[:, :, 4] = rc.bgim[:, rc.x1:rc.x2]
-
-		# TODO setup adjust function calling
-		# outarray = call_function(AdjFunc, InArray, OptInfo, AdjParms = AdjParms, $
-		#                            AdjOptions = AdjOptions)
-		# TODO Remove this line later
-		outarray = None
-
-		rc.pdataim = outarray[:,:,0]
+		inarray = np.zeros((ny, rc.x2-rc.x1+1, 5))
+		inarray[:, :, 0] = rc.dataim[:, rc.x1:rc.x2 + 1]
+		inarray[:, :, 1] = rc.varim[:, rc.x1:rc.x2 + 1]
+		inarray[:, :, 2] = _aperture_mask(rc, slice(rc.x1, rc.x2 + 1))
+		inarray[:, :, 3] = rc.skyvar[:, rc.x1:rc.x2 + 1]
+		inarray[:, :, 4] = rc.bgim[:, rc.x1:rc.x2 + 1]
+
+		# Pass what is known of the frame to the adjust function, which fills
+		# adjparms with what it needs to revert the adjustment
+		adjfunc = getattr(import_module("lib.imgadj"), rc.adjfunc)
+		optinfo = Config(dataim=rc.dataim, varim=rc.varim, bgim=rc.bgim, skyvar=rc.skyvar, spec=rc.spec,
+		                 inmask=rc.inmask, quality=rc.quality, x1=rc.x1, x2=rc.x2, verbose=rc.verbose, plottype=rc.plottype,
+		                 bpct=rc.bpct, q=rc.q, v0=rc.v0)
+		if rc.adjparms is None:
+			rc.adjparms = {}
+		outarray = adjfunc(inarray, optinfo, adjparms=rc.adjparms, adjoptions=rc.adjoptions)
+
+		rc.pdataim = outarray[:, :, 0]
 		rc.pvarim = outarray[:, :, 1]
 		rc.pmask = outarray[:, :, 2]
 		rc.pskyvar = outarray[:, :, 3]
 		rc.pbgim = outarray[:, :, 4]
 
 		# Estimate the influence of a bad pixel on its neighbors
-		# TODO check this
-		rc.pmask = rc.pmask > 0.99 and rc.pmask < 1.01
+		rc.pmask = (rc.pmask > 0.99) & (rc.pmask < 1.01)
 	else:
-		rc.pdataim = rc.dataim[:, rc.x1:rc.x2]
-		rc.pvarim = rc.varim[:, rc.x1:rc.x2]
-		rc.pmask = rc.inmask[:, rc.x1:rc.x2]
-		rc.pskyvar = rc.skyvar[:, rc.x1:rc.x2]
-		rc.pbgim = rc.bgim[:, rc.x1:rc.x2]
+		rc.pdataim = rc.dataim[:, rc.x1:rc.x2 + 1]
+		rc.pvarim = np.array(rc.varim[:, rc.x1:rc.x2 + 1], dtype)
+		rc.pmask = _aperture_mask(rc, slice(rc.x1, rc.x2 + 1))
+		rc.pskyvar = rc.skyvar[:, rc.x1:rc.x2 + 1]
+		rc.pbgim = rc.bgim[:, rc.x1:rc.x2 + 1]
 
 	#INITIALIZE
 	#Because the images may be a different size now, new initilization is
@@ -185,19 +227,11 @@ def fitprof(rc):
 	pny = np.shape(rc.pdataim)[0]
 
 	if rc.fitgauss == True:
-		f1 = 0
-		f2 = pny-1
-		nvect = pnx
-		ndata = pny
+		nvect = pny
 		func = "gaussfunc"
 		parm = 1
-		# TODO
-		# this is where the fitting function will need to be moved for the main loop
 	else:
-		f1 = 0
-		f2 = pnx - 1
-		nvect = pny
-		ndata = pnx
+		nvect = pnx
 		if rc.fitboxcar == True:
 			func = "boxcarfunc"
 			parm = rc.boxcarhw
@@ -205,37 +239,135 @@ def fitprof(rc):
 			func = "polyfunc"
 			parm = rc.profdeg
 
-	rc.profmask = rc.pmask
-	rc.profres = np.zeros((pnx, pny))
-	rc.pprofim = np.zeros((pnx, pny))
-	rc.pspecim = np.matmul(np.ones((pnx)), rc.spec)
-	rc.datav = np.zeros(nvect)
-	rc.maskv = np.zeros(nvect)
-	rc.varv = np.zeros(nvect)
-	rc.multv = np.zeros(nvect)
-	rc.skyvarv = np.zeros(nvect)
-	rc.bgv = np.zeros(nvect)
-	rc.errvect = np.ones(ndata)
-	index = np.arange(ndata+1)
-	rc.pprofim = rc.pdataim / rc.pspecim
-	yvals = np.arange(pny+1)
-	xvals = np.arange(pnx+1)
+	rc.profmask = np.array(rc.pmask, np.byte)
+	rc.profres = np.zeros((pny, pnx), dtype)
+	rc.pprofim = np.zeros((pny, pnx), dtype)
+	rc.pspecim = np.broadcast_to(np.asarray(rc.spec, np.double)[:, None], (pny, pnx))
+	rc.perrvect = np.ones(nvect)
 
 	# Loop through Rows or Columns
 	# Cut up the data according to the type of fitting and pass the info into procvect.
-	# Procvect will take care of bad pixel rejection and pass the smoothed porfile back
-
-	for i in range(f1, f2):
-		if rc.fitgauss:
-			i_s = index[i, :]
+	# Procvect will take care of bad pixel rejection and pass the smoothed porfile back.
+	# With workers, blocks of vectors are fitted in a process pool.
+
+	arrays = dict(pdataim=rc.pdataim, profmask=rc.profmask, pvarim=rc.pvarim, pspecim=rc.pspecim,
+	              pskyvar=rc.pskyvar, pbgim=rc.pbgim, pprofim=rc.pprofim, profres=rc.profres,
+	              perrvect=rc.perrvect)
+	if rc.batch or func == "boxcarfunc":
+		vectfunc = _fitprof_batch_vects
+		opts = dict(reject=rc.reject or "worst")
+	else:
+		vectfunc = _fitprof_vects
+		opts = dict(verbose=rc.verbose, plottype=rc.plottype, gotovect=rc.pgotovect)
+	stats = rc.stats or NOSTATS
+	counts = parmap(vectfunc, nvect, arrays, workers=rc.workers, chunks=rc.chunks,
+	                outputs=("profmask", "pvarim", "pprofim", "profres", "perrvect"),
+	                byrow=rc.fitgauss == True, func=func, parm=parm, thresh=rc.pthresh, q=rc.q or 1,
+	                v0=rc.v0 or 0, bpct=rc.bpct or 0.5, counts=stats.enabled, **opts)
+	stats.merge("fitprof", counts)
+
+	rc.profim = np.zeros((ny, nx), dtype)
+	if rc.adjfunc:
+		outarr = adjfunc(np.stack([rc.pprofim, rc.pvarim], -1), optinfo, adjparms=rc.adjparms,
+		                 adjoptions=rc.adjoptions, revert=True)
+		rc.profim[:, rc.x1:rc.x2 + 1] = outarr[:, :, 0]
+		rc.varim[:, rc.x1:rc.x2 + 1] = outarr[:, :, 1]
+	else:
+		rc.varim[:, rc.x1:rc.x2 + 1] = rc.pvarim
+		rc.profim[:, rc.x1:rc.x2 + 1] = rc.pprofim
+
+	rc.profim = np.maximum(rc.profim, 0)
+	rc.t = np.sum(rc.profim[:, rc.x1:rc.x2 + 1], 1, dtype=np.double)
+	rc.profim /= rc.t[:, None]
+	rc.difpmask = rc.pmask - rc.profmask
+
+	# Record the pixels the fit rejected and the vectors it stopped on. An
+	# adjusted profile is not in the columns of the frame, so only the
+	# profile fit of the frame itself is recorded.
+	if rc.quality is not None and not rc.adjfunc:
+		cols = slice(rc.x1, rc.x2 + 1)
+		mark(rc.quality, rc.difpmask == 1, PROF_CR, cols)
+		mark_rows(rc.quality, rc.perrvect, PROF_FAIL, cols, byrow=rc.fitgauss == True)
+
+	return rc.profim
+
+
+def _aperture_mask(rc, cols):
+	# The mask of columns cols, read from the quality plane when there is one
+	if rc.quality is not None:
+		return quality_mask(rc.quality[:, cols], dtype=np.byte)
+	return rc.inmask[:, cols]
+
+
+def _fitprof_vects(lo, hi, arrays, byrow, gotovect, counts=False, **kwargs):
+	# Fit vectors lo..hi-1 of the profile: rows if byrow, otherwise columns
+	counts = Counter() if counts else None
+	fitter = PreparedVect(np.shape(arrays["pdataim"])[1 if byrow else 0], **kwargs)
+	# A background or sky variance of 0 everywhere (none was passed) is left
+	# out of the fits
+	nobg = constant_value(arrays["pbgim"]) == 0
+	noskyvar = constant_value(arrays["pskyvar"]) == 0
+
+	for i in range(lo, hi):
+		if byrow:
+			i_s = (i, slice(None))
 		else:
-			i_s = index[:, i]
+			i_s = (slice(None), i)
+
+		datav = arrays["pdataim"][i_s]
+		maskv = np.copy(arrays["profmask"][i_s])
+		varv = np.copy(arrays["pvarim"][i_s])
+		crv = np.copy(arrays["profres"][i_s])
+		multv = arrays["pspecim"][i_s]
+		skyvarv = None if noskyvar else arrays["pskyvar"][i_s]
+		bgv = None if nobg else arrays["pbgim"][i_s]
+
+		if i == gotovect:
+			fitter.verbose = 5
 
-		rc.datav[:] = rc.pdataim[i_s]
-		rc.maskv[:]
+		fiteval, maskv, errflag, coeffv = fitter(datav, varv=varv, multv=multv, maskv=maskv, crv=crv,
+		                                         bgv=bgv, skyvarv=skyvarv, vectnum=i, counts=counts)
+		arrays["pprofim"][i_s] = fiteval
+		if errflag:
+			arrays["perrvect"][i] = 0
 
+		arrays["profmask"][i_s] = maskv
+		arrays["pvarim"][i_s] = varv
+		arrays["profres"][i_s] = crv * maskv
+
+	return counts
+
+
+def _fitprof_batch_vects(lo, hi, arrays, byrow, counts=False, **kwargs):
+	# Fit vectors lo..hi-1 of the profile together with procblock. Columns
+	# are transposed into a block of rows.
+	counts = Counter() if counts else None
+
+	if byrow:
+		i_s = (slice(lo, hi), slice(None))
+		block = lambda arr: arr[i_s]
+	else:
+		i_s = (slice(None), slice(lo, hi))
+		block = lambda arr: arr[i_s].T
+
+	maskb = np.array(block(arrays["profmask"]), np.double)
+	varb = np.array(block(arrays["pvarim"]))
+	crb = np.zeros(np.shape(maskb))
+
+	fiteval, maskb, errflag, coeffb = procblock(block(arrays["pdataim"]), varb=varb,
+	                                            multb=block(arrays["pspecim"]), maskb=maskb, crb=crb,
+	                                            bgb=block(arrays["pbgim"]), skyvarb=block(arrays["pskyvar"]),
+	                                            counts=counts, **kwargs)
+
+	unblock = (lambda b: b) if byrow else (lambda b: b.T)
+	arrays["pprofim"][i_s] = unblock(fiteval)
+	arrays["perrvect"][lo:hi] = 1 - errflag
+	arrays["profmask"][i_s] = unblock(maskb)
+	arrays["pvarim"][i_s] = unblock(varb)
+	arrays["profres"][i_s] = unblock(crb * maskb)
+
+	return counts
 
-	return
 
 def extrspec(rc):
 	# TODO DOCS: extrspec
@@ -244,64 +376,132 @@ def extrspec(rc):
 	Optimally extracts spectra using weighted profiles.
 
 	Calling Example:
+		optspec = extrspec(rc)
 
 	Inputs:
 		dataim: Sky-subtracted, processed image to extract spectrum from.
 				Horizontal is pixel position, vertical is wavelength, assuming no curvature.
 		profim: image of spatial profiles
 		varim:  variance image from processed image
-		v_0:    root(v_0) is squared readout noise in DN
+		v0:     root(v0) is squared readout noise in DN
 		q:      effective number of photons per DN
 		x1, x2: boundaries in x which contain spectrum (inclusive)
 	Optional Keywords:
+		inmask:   The mask used for all functions, without quality. default:
+				  a constant plane of 1s
+		quality:  A quality plane (see quality.py), read for the mask of each
+				  row instead of inmask. EXTR_CR is set on the pixels
+				  rejected and EXTR_FAIL on the rows stopped, in place.
+		bgim:     The background image. default: a constant plane of 0s
+		skyvar:   The sky variance image. default: a constant plane of 0s
+		ethresh:  The threshold for sigma rejection. default: 5
+		bpct:     The percentage of allowable bad pixels before halting.
+		batch:    Set to extract all rows at once with procblock instead of
+				  calling procvect row by row.
+		reject:   With batch, "all" rejects every pixel above ethresh on each
+				  pass rather than only the worst (see procblock).
+		workers:  Number of processes to extract blocks of rows in. default: 1
+		stats:    A Stats to count the rows extracted, clipping iterations,
+				  rejected pixels and errflag rows into, as stage "extrspec"
+		dtype:    float32 or float64, for the residual image and the
+				  working variance. default: float64
 
 	Outputs:
-		Returns fopt, an array of optimally extracted spectra, and their variances.
+		Returns optspec, the optimally extracted spectrum. Also sets opvar, its
+		variance, exres, the residual image, eerrvect, the rows where
+		iteration stopped, and updates varim. Without quality, also sets
+		exmask, the mask of the pixels kept, 0 for the cosmic rays found.
 	History:
 
 	Created on 4/17/2021$
 	"""
-	# TODO FUNC: extrspec
 
 	ny = np.shape(rc.dataim)[0]
 	nx = np.shape(rc.dataim)[1]
+	dtype = plane_dtype(rc.dtype)
+
+	if rc.bgim is None:
+		rc.bgim = constant_plane(0., (ny, nx))
+	if rc.skyvar is None:
+		rc.skyvar = constant_plane(0., (ny, nx))
+	if not rc.ethresh:
+		rc.ethresh = 5
+	if not rc.verbose:
+		rc.verbose = 0
+	if not rc.egotovect:
+		rc.egotovect = -1
 
 	if rc.verbose > 1:
 		print("Starting Optimal Extraction")
 
-	# TODO fix exceptions here
 	if rc.x1 < 0 or rc.x1 > rc.x2:
-		raise ParameterException("Exception here.")
-	if rc.x2 > nx - 1 or rc.x2 < rc.x2:
-		raise ParameterException("Exception here.")
-	# str += (size(varim ))[1] ne nx || (size(varim ))[2] ne ny ? "varim "  : ""
-	# str += (size(profim))[1] ne nx || (size(profim))[2] ne ny ? "profim " : ""
-	# str += (size(inmask))[1] ne nx || (size(inmask))[2] ne ny ? "inmask " : ""
-	# str += (size(bgim  ))[1] ne nx || (size(bgim  ))[2] ne ny ? "bgim "   : ""
-	# str += (size(skyvar))[1] ne nx || (size(skyvar))[2] ne ny ? "skyvar " : ""
-	# str += 4 ne n_elements(plottype)                          ? "plottype" : ""
-
-	exres = np.zeros((nx, ny))
-	exmask = np.ones((nx, ny))
-	crv = np.zeros((rc.x2 - rc.x1 + 1))
-	optspec = np.zeros((ny))
-	opvar = np.zeros((ny))
-	errvect = np.ones((ny))
-	func = "extractfunc"
-
-	# LOOP THRROUGH ROWS
-	# Cut up the images into rows and pass each to procvect.  Tells
-	# procvect to use extractfunc.pro which returns the optimal
-	# extraction.  It also return in parm the variance of the extraction.
-	# Procvect will handle the sigma rejection.
-
-	for i in range(ny):
-		varv = rc.varim[i, rc.x1:rc.x2]
-		maskv = rc.inmask[i, rc.x1:rc.x2]
-		datav = rc.dataim[i, rc.x1:rc.x2]
-		multv = rc.profim[i, rc.x1:rc.x2]
-		bgv = rc.bgim[i, rc.x1:rc.x2]
-		skyvarv = rc.skyvar[i, rc.x1:rc.x2]
+		raise ParameterException("x1 must be greater than 0 and less than x2.")
+	if rc.x2 > nx - 1 or rc.x2 < rc.x1:
+		raise ParameterException("x2 must be less than nx-1 and greater than x1")
+	for name in ("varim", "profim", "inmask", "quality", "bgim", "skyvar"):
+		if getattr(rc, name) is not None and np.shape(getattr(rc, name)) != (ny, nx):
+			raise ParameterException(name + " must be the same dimensions as dataim.")
+
+	# The rows read their masks from the quality plane and mark it. An
+	# inmask passed without one is made into a plane here.
+	quality = rc.quality
+	if quality is None:
+		quality = quality_plane(rc.inmask, (ny, nx))
+
+	rc.exres = np.zeros((ny, nx), dtype)
+	rc.optspec = np.zeros(ny)
+	rc.opvar = np.zeros(ny)
+	rc.eerrvect = np.ones(ny)
+
+	# LOOP THROUGH ROWS
+	# Cut up the images into rows and pass each to procvect. Tells
+	# procvect to use extractfunc which returns the optimal
+	# extraction. It also returns in coeffv the variance of the extraction.
+	# Procvect will handle the sigma rejection. With batch, the rows are
+	# extracted together by procblock, so a frame without outliers takes a
+	# single pass of array sums. With workers, blocks of rows are extracted
+	# in a process pool.
+
+	arrays = dict(dataim=rc.dataim, profim=rc.profim, varim=rc.varim, quality=quality,
+	              bgim=rc.bgim, skyvar=rc.skyvar, exres=rc.exres, optspec=rc.optspec, opvar=rc.opvar, eerrvect=rc.eerrvect)
+	if rc.batch:
+		rowfunc = _extrspec_batch_rows
+		opts = dict(reject=rc.reject or "worst")
+	else:
+		rowfunc = _extrspec_rows
+		opts = dict(verbose=rc.verbose, plottype=rc.plottype, gotovect=rc.egotovect)
+	stats = rc.stats or NOSTATS
+	counts = parmap(rowfunc, ny, arrays, workers=rc.workers, chunks=rc.chunks,
+	                outputs=("varim", "exres", "quality", "optspec", "opvar", "eerrvect"),
+	                x1=rc.x1, x2=rc.x2, thresh=rc.ethresh, q=rc.q or 1, v0=rc.v0 or 0,
+	                bpct=rc.bpct or 0.5, dtype=dtype, counts=stats.enabled, **opts)
+	stats.merge("extrspec", counts)
+
+	# Without a quality plane, give back the mask of the pixels the extraction
+	# kept, as before the plane
+	if rc.quality is None:
+		cols = slice(rc.x1, rc.x2 + 1)
+		rc.exmask = np.ones((ny, nx), np.byte)
+		rc.exmask[:, cols] = quality_mask(quality[:, cols], REJECTED | EXTR_CR, np.byte)
+
+	return rc.optspec
+
+
+def _extrspec_rows(lo, hi, arrays, x1, x2, gotovect, dtype=np.double, counts=False, **kwargs):
+	# Optimally extract rows lo..hi-1
+	counts = Counter() if counts else None
+	fitter = PreparedVect(x2 - x1 + 1, func="extractfunc", **kwargs)
+	nobg = constant_value(arrays["bgim"]) == 0
+	noskyvar = constant_value(arrays["skyvar"]) == 0
+
+	for i in range(lo, hi):
+		varv = np.array(arrays["varim"][i, x1:x2 + 1], dtype)
+		quality = arrays["quality"][i, x1:x2 + 1]
+		maskv = quality_mask(quality)
+		datav = arrays["dataim"][i, x1:x2 + 1]
+		multv = arrays["profim"][i, x1:x2 + 1]
+		bgv = None if nobg else arrays["bgim"][i, x1:x2 + 1]
+		skyvarv = None if noskyvar else arrays["skyvar"][i, x1:x2 + 1]
 
 		# TODO Plotting
 		# if (i eq gotovect) then verbose = 5
@@ -309,9 +509,6 @@ def extrspec(rc):
 		# device, window_state = ws   ; get the present window state
 		# if not ws[12] then window, 12 else wset, 12 ; open window 12
 		# !p.multi = [0, 2, 3, 1, 1]  ; fit all six inside
-		# !p.charsize = 2.0
-		# !x.margin = [8, 2]
-		# !y.margin = [2, 2]
 		# plot, datav,   title = 'Data Vector for Extraction', /ystyle
 		# plot, multv,   title = 'Profile', /ystyle
 		# plot, maskv,   title = 'Input Mask', yrange = [-0.1, 1.1]
@@ -319,19 +516,55 @@ def extrspec(rc):
 		# plot, skyvarv, title = 'Sky variance', /ystyle
 		# plot, bgv,     title = 'Background', /ystyle
 		# !p.multi = 0
-		# !p.charsize = 1.0
-		# !x.margin = [10, 3]
-		# !y.margin = [4, 2]
 		# wait, 0.01                  ; pause to allow user to view
 		# endif
 
-		rc.optspec[i] = procvect(rc)
-
-		if (rc.errflag):
-			errvect[i] = 0
-		opvar[i] = parm
-		exmask[i, rc.x1:rc.x2] = maskv
-		varim[i, rc.x1:rc.x2] = varv
-		exres[i, rc.x1:rc.x2] = crv * maskv
-
-	return
\ No newline at end of file
+		if i == gotovect:
+			fitter.verbose = 5
+
+		# The residuals are left in fitter.crv
+		fiteval, newmask, errflag, coeffv = fitter(datav, varv=varv, multv=multv, maskv=np.copy(maskv), bgv=bgv,
+		                                           skyvarv=skyvarv, vectnum=i, counts=counts)
+		quality[(maskv == 1) & (newmask != 1)] |= EXTR_CR
+		maskv = newmask
+
+		arrays["optspec"][i] = fiteval[0]
+		if errflag:
+			arrays["eerrvect"][i] = 0
+			quality |= EXTR_FAIL
+		arrays["opvar"][i] = coeffv[1]  # the optimal spectrum's variance
+		arrays["varim"][i, x1:x2 + 1] = varv
+		arrays["exres"][i, x1:x2 + 1] = fitter.crv * maskv
+		if counts is not None and not np.any(multv * maskv):
+			counts.update(noprofile=1)
+
+	return counts
+
+
+def _extrspec_batch_rows(lo, hi, arrays, x1, x2, dtype=np.double, counts=False, **kwargs):
+	# Optimally extract rows lo..hi-1 together with procblock
+
+	rows = slice(lo, hi)
+	counts = Counter() if counts else None
+	cols = slice(x1, x2 + 1)
+	varb = np.array(arrays["varim"][rows, cols], dtype)
+	before = quality_mask(arrays["quality"][rows, cols])
+	crb = np.zeros(np.shape(before))
+
+	fiteval, maskb, errflag, coeffb = procblock(arrays["dataim"][rows, cols], varb=varb,
+	                                            multb=arrays["profim"][rows, cols], maskb=np.copy(before),
+	                                            crb=crb, bgb=arrays["bgim"][rows, cols],
+	                                            skyvarb=arrays["skyvar"][rows, cols],
+	                                            func="extractfunc", counts=counts, **kwargs)
+
+	arrays["optspec"][rows] = coeffb[:, 0]
+	arrays["opvar"][rows] = coeffb[:, 1]  # the optimal spectrum's variance
+	arrays["eerrvect"][rows] = 1 - errflag
+	mark(arrays["quality"][rows], (before == 1) & (maskb != 1), EXTR_CR, cols)
+	mark_rows(arrays["quality"][rows], 1 - errflag, EXTR_FAIL, cols)
+	arrays["varim"][rows, cols] = varb
+	arrays["exres"][rows, cols] = crb * maskb
+	if counts is not None:
+		counts.update(noprofile=int(np.sum(~np.any(arrays["profim"][rows, cols] * maskb, 1))))
+
+	return counts